@@ -1,38 +1,33 @@
 #!/usr/bin/env python
-#analyzes the liquidbotlog.txt file to find out total price of all that were bought/sold
-#this should no longer be needed because i added a new file that the bot will write only successes to in a special format
+#analyzes the fills ledger a bot writes (lib/ledger.py) to find out the total price of all that were bought/sold
+#usage: analyzebotlog.py [ledger file] [hours per period]
+#   or: analyzebotlog.py import filled.txt [ledger file]   to add the lines of the old filled.txt to a ledger once
+import sys
+import time
 
+import ledger
 
-#filetoopen = raw_input("Enter the filename in the data/ directory to open: ")
-# filetoopen = "liquidbotlog.txt"
+def import_filled(filename, fills):
+    #the old format: "... Buy order ... <btc> ... $<price> ..."
+    with open(filename,'r') as filled:
+        for line in filled:
+            if "order" in line and ("Buy" in line or "Sell" in line):
+                wordlist = line.split()
+                fills.fill("buy" if "Buy" in line else "sell", wordlist[5], wordlist[8][1:], stamp=0)
 
-# filled = open("filled.txt",'w') 
-# with open(filetoopen,'r') as f:
-#     for line in f:
-#     	if "filled" in line:
-#     		filled.write(line)
-# filled.close()
+if len(sys.argv) > 2 and sys.argv[1] == "import":
+    fills = ledger.Ledger(sys.argv[3] if len(sys.argv) > 3 else "ledger_liquidbot.led")
+    import_filled(sys.argv[2], fills)
+    print "Imported, %s fills in the ledger now." % fills.count
+    sys.exit()
 
-filled = open("filled.txt",'r') 
-buylinelist = []
-selllinelist = []
-for line in filled:
-	if "Buy" in line and "order" in line:
-		wordlist = line.split()
-		buybtc = float(wordlist[5])
-		buyprice = float(wordlist[8][1:])
-		buylinelist.append([buybtc,buyprice])
-	if "Sell" in line and "order" in line:
-		wordlist = line.split()
-		sellbtc = float(wordlist[5])
-		sellprice = float(wordlist[8][1:])
-		selllinelist.append([sellbtc,sellprice])
-	
-totalbuy = 0
-totalsell = 0
-for x in buylinelist:
-	totalbuy += x[0]*x[1]
-for x in selllinelist:
-	totalsell += x[0]*x[1]
+fills = ledger.Ledger(sys.argv[1] if len(sys.argv) > 1 else "ledger_liquidbot.led")
+hours = float(sys.argv[2]) if len(sys.argv) > 2 else 24
 
-print "Total Bought: $%s.  Total Sold: $%s"	% (totalbuy,totalsell)
\ No newline at end of file
+total = fills.summary()
+print "Total Bought: $%s.  Total Sold: $%s" % (total.buy_value, total.sell_value)
+print "Position: %s BTC @ $%s  Realised: $%s  Fees: $%s  Net: $%s" % (fills.position, fills.avgcost, fills.realised, fills.fees, total.net())
+print
+for period in fills.periods(width=int(hours*3600)):
+    print "%s  %4d fills  bought %s ($%.2f)  sold %s ($%.2f)  realised $%.5f  fees $%.5f" % (time.strftime("%Y-%m-%d %H:%M", time.localtime(period.start)),
+        period.fills, period.bought, period.buy_value, period.sold, period.sell_value, period.realised, period.fees)
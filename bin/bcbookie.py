@@ -25,6 +25,8 @@ import pickle
 from operator import itemgetter
 from time import *
 import mtgoxhmac
+import ordertracker
+import ledger
 
 # connect to the xml server
 #
@@ -65,7 +67,11 @@ class bookie:
 		self.client_info = None
 		self.client_commission = 0 
 		self.orders = []
+		#our orders by oid, diffed against the REST order list on every load_orders()
+		self.tracker = ordertracker.OrderTracker("mtgox")
 		self.records = []
+		#every fill with the running position and P&L (lib/ledger.py)
+		self.ledger = ledger.Ledger("./report/bookie_ledger.led")
 		self.balance = 0
 		self.balance_committed = 0
 		self.usds = 0
@@ -178,7 +184,9 @@ class bookie:
 	def load_orders(self):
 		while 1:
 			try:
+				since = time()
 				self.orders = self.client.get_orders()['orders']
+				self.tracker.reconcile([ordertracker.from_mtgox(o) for o in self.orders],since)
 				return
 			except:
 				print "load_orders: client error..retrying @ " + ctime()
@@ -204,6 +212,11 @@ class bookie:
 		self.records.append(record)
 		self.save_records()
 	
+	def record_fill(self,side,r):
+		#write a filled order to the ledger, the commission is the fee
+		fee = float(r['amount']) * float(r['price']) * r['commission'] / 100.0
+		self.ledger.fill(side,"%.8f"%float(r['amount']),"%.5f"%float(r['price']),"%.5f"%fee,oid=r['oid'])
+
 	def get_last_order(self):
 		#the last order will be the one with the largest date stamp
 		self.load_orders()
@@ -312,6 +325,7 @@ class bookie:
 				if self.btcs > last_btc_balance:
 					print 'buy: instant order verified'
 					order = {'commission':self.client_commission,'parent_oid':'none','price':buy_price,'oid':'none','localtime':time(),'pending_counter':10,'book':'held','commit':commit_price,'target':target_price,'stop':stop_loss,'max_wait':max_wait,'max_hold':max_hold}
+					self.record_fill("buy",dict(order,amount=qty))
 				else:
 					print 'buy: third level order verification failed'
 					order = {'commission':self.client_commission,'parent_oid':'none','price':buy_price,'oid':'none','localtime':time(),'pending_counter':10,'book':'closed: order not acknowledged','commit':commit_price,'target':target_price,'stop':stop_loss,'max_wait':max_wait,'max_hold':max_hold}
@@ -341,6 +355,7 @@ class bookie:
 	
 	def cancel_buy_order(self,oid):
 		print "cancel_buy_order: canceling"
+		self.tracker.cancel_requested(oid)
 		while 1:
 			try:	
 				self.client.cancel_buy_order(oid)
@@ -360,20 +375,22 @@ class bookie:
 			if r['book'].find("open") >= 0:
 				found = 0
 				#print "record_synch: searching for OID:",r['oid']
-				for o in self.orders:
-					if o['oid'] == r['oid']:
-						found = 1
-						print "\trecord_synch: OID:",r['oid'], " active"
-						#update with the current order status
-						r['status'] = o['status']
-						r['real_status'] = o['real_status']
-						r.update({'amount_remaining':o['amount']})				
+				order = self.tracker.get(r['oid'])
+				if order is not None and order.live():
+					o = order.info
+					found = 1
+					print "\trecord_synch: OID:",r['oid'], " active"
+					#update with the current order status
+					r['status'] = o['status']
+					r['real_status'] = o['real_status']
+					r.update({'amount_remaining':o['amount']})				
 
 				if found == 0:
 					print "\trecord_synch: OID:",r['oid'], " not active"
 					if r['type'] == 1:
 						#the order was filled
 						r['book'] = "sold"
+						self.record_fill("sell",r)
 						r.update({'trade_id': ",".join(self.client.get_ask_tids(r['oid']))})
 						print "\t\trecord_synch: OID:",r['oid'], " tag as sold"
 						if self.__enable_text_messaging==True:
@@ -385,6 +402,7 @@ class bookie:
 						if len(r['trade_id']) > 0:
 							#the order was filled
 							r['book'] = "held"
+							self.record_fill("buy",r)
 							print "\t\trecord_synch: OID:",r['oid'], " tag as held"
 							if self.__enable_text_messaging==True:
 								msg = 'Bought %sBTC @ $%s'%(str(r['amount']),str(r['price']))
@@ -399,16 +417,18 @@ class bookie:
 
 		#print "record_synch: error check:"
 		error_found = 0
-		for o in self.orders:
+		records = dict((r['oid'],r) for r in self.records)
+		for order in self.tracker.open_orders():
+			o = order.info
+			r = records.get(order.oid)
 			order_found = 0
-			for r in self.records:
-				if o['oid'] == r['oid']:
-					order_found = 1
-					if r['book'] != "open":
-						error_found = 1
-						print "\trecord_synch: record error found, canceling order"
-						self.cancel_buy_order(r['oid'])
-						r['book'] += ": error"
+			if r is not None:
+				order_found = 1
+				if r['book'] != "open":
+					error_found = 1
+					print "\trecord_synch: record error found, canceling order"
+					self.cancel_buy_order(r['oid'])
+					r['book'] += ": error"
 			if order_found == 0:		
 				print "!!!!!!! record_synch: orphaned or manual order found:","TYPE:",o['type'],"AMOUNT:",o['amount'],"PRICE:",o['price']
 		
@@ -8,6 +8,8 @@ import time
 import io
 import gzip
 import os
+import tradearchive
+from common import tail
 __app_version__ = "0.03"
 
 print """
@@ -29,16 +31,18 @@ if os.name == 'nt':
 else:
     partialpath=os.path.join(fullpath + '/../data/')
     
-try:
-    for line in open(os.path.join(partialpath + 'download_mtgoxUSD.csv')):pass
-    line = line.split(',')[0]
-    line = line.split('.')[0]
-    start_time = int(line) + 1
+archive = tradearchive.TradeArchive("bitcoincharts_mtgoxUSD")
+if archive.last() is None and os.path.exists(os.path.join(partialpath + 'download_mtgoxUSD.csv')):
+    print "Moving the existing download_mtgoxUSD.csv into the trade archive (only done once)..."
+    with open(os.path.join(partialpath + 'download_mtgoxUSD.csv')) as f:
+        archive.append(tradearchive.from_csv(f))
+last = archive.last()
+if last:
+    start_time = last.stamp // 1000000 + 1
     incremental_update = 1
-    print "The last time in the file was %s aka %s" % (start_time-1,datetime.datetime.fromtimestamp(start_time-1))
-except:
+    print "The last time in the archive was %s aka %s" % (start_time-1,datetime.datetime.fromtimestamp(start_time-1))
+else:
     print "Incremental update not possible."
-    pass
 print "Downloading mtgox historic data..."
 link = link.replace('{START_TIME}',str(start_time))
 req = urllib2.Request(link)
@@ -55,50 +59,50 @@ if data:
     f.write('\n')
     f.write(data)
 f.close()
+added = archive.append(tradearchive.from_csv(data.splitlines()))
 
-print "Download complete."
+print "Download complete. %s new trades archived." % added
 
-f = open(os.path.join(partialpath + "download_mtgoxUSD.csv"),'r')
-d = f.readlines()
-f.close()
+#only the trades after the last minute already in the output file are read from the archive
+outfile = os.path.join(partialpath + "bcfeed_mtgoxUSD_1min.csv")
+last_out = 0
+if os.path.exists(outfile):
+    with open(outfile,'r') as f:
+        lastline = tail(f,1).strip()
+    if lastline:
+        last_out = int(float(lastline.split(',')[0]))
 
 print "Processing input..."
 one_min = []
 accum_r = []
-#exception handling to address issue #11 - unhandled exception when download or input file has no data
-try:
-    last_t = d[0].split(',')[0]
-except:
-    print "No new data to process"
-    sys.exit()
-
-last_m = ctime(int(last_t)).split(':')[1]
-for r in d:
-    sr = r.replace('\n','').split(',')
-    t,p,v = sr
-    if (ctime(int(t)).split(':')[1] == last_m):
-        accum_r.append(map(float,sr))
-    else:
+last_t = None
+last_m = None
+for trade in archive.read(start=last_out+1):
+    t = trade.stamp // 1000000
+    m = t // 60
+    if last_m is not None and m != last_m:
         tv = 0
         twp = 0
         for r in accum_r:
-            #print r
             twp += (r[1] * r[2])
             tv += r[2]
         if tv > 0:
             wp = twp / tv
             one_min.append([last_t,wp,tv])
-            #print last_t,wp,tv
-        accum_r = [map(float,sr)]
-    
-    last_t = int(t)
-    last_m = ctime(last_t).split(':')[1]
+        accum_r = []
+    accum_r.append([t,tradearchive.price(trade),tradearchive.amount(trade)])
+    last_t = t
+    last_m = m
+
+#exception handling to address issue #11 - unhandled exception when download or input file has no data
+if not one_min:
+    print "No new data to process"
+    sys.exit()
 
 print "Writing output file..."
 print "Updating the data directory directly...no need to manualy move the output file"
 
-f = open(os.path.join(partialpath + "bcfeed_mtgoxUSD_1min.csv"),'w')
-
+f = open(outfile,'a')
 for t,p,v in one_min:
     f.write(",".join(map(str,[t,p,v])) + '\n')
 f.close()
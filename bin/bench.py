@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# bench.py
+# Microbenchmarks of the hot paths, on the sample fulldepth in
+# data/mtgox_fulldepth.txt and on synthetic streams made from a fixed random
+# seed, so two runs on the same machine measure the same work. Every
+# benchmark is timed <repeat> times, the fastest round counts (microseconds
+# per call).
+#
+# Results can be written to a json file and compared with a stored baseline
+# (data/bench_baseline.json): anything more than <threshold> slower than its
+# baseline is reported as a regression and the exit code is 1. Baselines
+# only mean something on the machine they were made on, make a new one with
+# --save-baseline after changing machines.
+#
+# Usage: bench.py [-f filter] [-r repeat] [-o results.json] [--check] [--threshold 0.25]
+#                 [--baseline file] [--save-baseline] [--list]
+#   ie:  bench.py --check               run all and compare with the baseline
+#        bench.py -f book -r 10         only the benchmarks with "book" in their name
+
+import collections
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+from decimal import Decimal as D
+from optparse import OptionParser
+
+fullpath = os.path.dirname(os.path.realpath(__file__))
+if os.name == 'nt':
+    partialpath = os.path.join(fullpath + '\\..\\data\\')
+else:
+    partialpath = os.path.join(fullpath + '/../data/')
+
+SEED = 1366085903
+BENCHMARKS = collections.OrderedDict()      #name -> setup(), which returns (run, calls per run)
+
+
+def bench(name):
+    """register setup() under name: it prepares the data and returns the
+    function to time and how many calls of the benchmarked code one call of
+    it makes"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+_cache = {}
+def fulldepth():
+    """the "data" of the sample money/depth/full answer (read once)"""
+    if "fulldepth" not in _cache:
+        with open(os.path.join(partialpath + 'mtgox_fulldepth.txt'), 'r') as f:
+            everything = f.readlines()
+        #first line is the vintage, second the json from money/depth/full
+        _cache["fulldepth"] = json.loads(everything[1])
+    return _cache["fulldepth"]
+
+def intbook():
+    from book import Book
+    if "intbook" not in _cache:
+        book = Book.parse(fulldepth()["data"], goxfulldepth=True, cPrec=D('0.00001'), bPrec=D('0.00000001'))
+        book.sort()
+        _cache["intbook"] = book
+    return _cache["intbook"]
+
+def depth_stream(count, top, levels=2000, empty=0.2, step=1000):
+    """<count> (price, total volume) depth updates within <levels> cents
+    (step -1000 for below) of <top>, <empty> of them removing the level"""
+    rnd = random.Random(SEED)
+    stream = []
+    for i in xrange(count):
+        price = top + rnd.randint(0, levels) * step
+        volume = 0 if rnd.random() < empty else rnd.randint(1, 5000) * 1000000
+        stream.append((price, volume))
+    return stream
+
+
+#---- book.py
+
+@bench("book.parse")
+def _():
+    from book import Book
+    data = fulldepth()["data"]
+    return (lambda: Book.parse(data, goxfulldepth=True)), 1
+
+@bench("book.parse_int")
+def _():
+    from book import Book
+    data = fulldepth()["data"]
+    return (lambda: Book.parse(data, goxfulldepth=True, cPrec=D('0.00001'), bPrec=D('0.00000001'))), 1
+
+@bench("book.sort")
+def _():
+    from book import Book
+    book = intbook()
+    rnd = random.Random(SEED)
+    bids, asks = list(book.bids), list(book.asks)
+    rnd.shuffle(bids)
+    rnd.shuffle(asks)
+    def run():
+        shuffled = Book(list(bids), list(asks))
+        shuffled.cPrec, shuffled.bPrec = book.cPrec, book.bPrec
+        shuffled.sort()
+    return run, 1
+
+@bench("book.flatten")
+def _():
+    from book import Book
+    book = Book.parse(fulldepth()["data"], goxfulldepth=True)
+    book.sort()
+    return (lambda: book.flatten('1')), 1
+
+@bench("book.flatten_int")
+def _():
+    book = intbook()
+    return (lambda: book.flatten('1')), 1
+
+
+#---- mtgox_prof7bitapi.OrderBook, fed like Gox feeds it
+
+class _Gox(object):
+    """the part of a Gox the OrderBook connects to"""
+    def __init__(self, Signal):
+        self.currency = "USD"
+        self.client = type("Client", (object,), {})()
+        self.client.signal_backupticker = Signal()
+        for name in ("ticker", "depth", "trade", "userorder", "fulldepth"):
+            setattr(self, "signal_" + name, Signal())
+
+def orderbook():
+    import mtgox_prof7bitapi
+    gox = _Gox(mtgox_prof7bitapi.Signal)
+    book = mtgox_prof7bitapi.OrderBook(gox)
+    book.slot_fulldepth(gox, fulldepth())
+    return book
+
+@bench("orderbook.slot_fulldepth")
+def _():
+    book = orderbook()
+    depth = fulldepth()
+    return (lambda: book.slot_fulldepth(None, depth)), 1
+
+@bench("orderbook._update_asks")
+def _():
+    book = orderbook()
+    stream = depth_stream(1000, book.asks[0].price)
+    def run():
+        for price, volume in stream:
+            book._update_asks(price, volume)
+    return run, len(stream)
+
+@bench("orderbook.slot_depth")
+def _():
+    book = orderbook()
+    asks = depth_stream(500, book.asks[0].price)
+    bids = depth_stream(500, book.bids[0].price, step=-1000)
+    stream = []
+    for (ask, askvol), (bid, bidvol) in zip(asks, bids):
+        stream += [("ask", ask, 0, askvol), ("bid", bid, 0, bidvol)]
+    def run():
+        for data in stream:
+            book.slot_depth(None, data)
+    return run, len(stream)
+
+@bench("orderbook.slot_trade")
+def _():
+    book = orderbook()
+    rnd = random.Random(SEED)
+    trades = [(0, 0, rnd.randint(1, 100) * 100000, "bid" if rnd.random() < 0.5 else "ask", False)
+              for i in xrange(1000)]
+    def run():
+        for date, price, volume, typ, own in trades:
+            #at the top of the book, like a real trade
+            top = book.asks[0].price if typ == "bid" else book.bids[0].price
+            book.slot_trade(None, (date, top, volume, typ, own))
+    return run, len(trades)
+
+
+#---- depthparser.py, the argument sets of the depth command
+
+for args in ([], ["steps=10"], ["low=10", "high=20"], ["amount=500", "steps=5", "iv=true"],
+             ["cumulate=true", "iv=true"], ["side=bids", "steps=1", "amount=50"]):
+    def setup(args=args):
+        from depthparser import DepthParser
+        depth = json.dumps({"return": fulldepth()["data"]})
+        return (lambda: DepthParser(5, args).process(depth)), 1
+    bench("depthparser.process[%s]" % " ".join(args))(setup)
+
+
+#---- websocket.py
+
+@bench("websocket.ABNF.mask")
+def _():
+    import websocket
+    rnd = random.Random(SEED)
+    payload = "".join(chr(rnd.randint(0, 255)) for i in xrange(4096))
+    return (lambda: websocket.ABNF.mask("\x01\x02\x03\x04", payload)), 1
+
+class _Replay(object):
+    """stands in for the socket: recv() hands out a recorded byte stream"""
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def recv(self, size):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+@bench("websocket.recv_frame")
+def _():
+    import websocket
+    rnd = random.Random(SEED)
+    messages = []
+    for i in xrange(1000):
+        #a socket.io depth message as the server sends it (not masked)
+        msg = '4::/mtgox:' + json.dumps({"op": "private", "private": "depth", "channel": "24e67e0d-1cad-4cc0-9e7a-f8523ef460fe",
+            "depth": {"price": "120.%05d" % rnd.randint(0, 99999), "type": 2, "type_str": "ask",
+                      "volume": "0.5", "price_int": str(rnd.randint(11000000, 13000000)),
+                      "volume_int": str(rnd.randint(1, 10**9)), "item": "BTC", "currency": "USD",
+                      "now": "1366085903150000", "total_volume_int": str(rnd.randint(1, 10**10))}})
+        frame = websocket.ABNF(1, 0, 0, 0, websocket.ABNF.OPCODE_TEXT, 0, msg)
+        messages.append(frame.format())
+    stream = "".join(messages)
+    ws = websocket.WebSocket()
+    ws.sock.close()
+    def run():
+        ws.io_sock = _Replay(stream)
+        for i in xrange(len(messages)):
+            ws.recv_frame()
+    return run, len(messages)
+
+
+#---- the rest of the receive path
+
+@bench("signal.__call__")
+def _():
+    import mtgox_prof7bitapi
+    signal = mtgox_prof7bitapi.Signal()
+    class Slots(object):
+        def first(self, sender, data):
+            pass
+        def second(self, sender, data):
+            pass
+    slots = Slots()
+    def function(sender, data):
+        pass
+    signal.connect(slots.first)
+    signal.connect(slots.second)
+    signal.connect(function)
+    run = lambda: signal(None, ("ask", 12000000, 0, 100000000))
+    run.slots = (slots, function)       #Signals only keep weak references
+    return run, 1
+
+@bench("json_ascii.decode_dict")
+def _():
+    import json_ascii
+    msg = json.dumps({"op": "private", "private": "trade", "channel": "dbf1dee9-4f2e-4a08-8cb7-748919a71b21",
+        "trade": {"type": "trade", "date": 1366085903, "amount": 0.5, "price": 120.5, "tid": "1366085903150000",
+                  "amount_int": "50000000", "price_int": "12050000", "item": "BTC", "price_currency": "USD",
+                  "trade_type": "bid", "primary": "Y", "properties": "limit"}})
+    return (lambda: json.loads(msg, object_hook=json_ascii.decode_dict)), 1
+
+@bench("feedmonitor.received")
+def _():
+    import feedmonitor
+    monitor = feedmonitor.FeedMonitor()
+    msg = {"op": "private", "private": "depth", "channel": "24e67e0d-1cad-4cc0-9e7a-f8523ef460fe",
+           "depth": {"price_int": "12050000", "type_str": "ask", "volume_int": "50000000",
+                     "total_volume_int": "150000000", "currency": "USD", "now": "1366085903150000"}}
+    return (lambda: monitor.received("socketio", msg)), 1
+
+
+#---- common.py
+
+@bench("common.depthprice")
+def _():
+    import common
+    asks = intbook().asks
+    return (lambda: common.depthprice(asks, D(500), D(1), D(2000))), 1
+
+class _Exchange(object):
+    """answers every order at once, so only our side of spread() is timed"""
+    cPrec = D('0.00001')
+    bPrec = D('0.00000001')
+    def order_new(self, side, amount, price):
+        return {"data": "oid"}
+
+@bench("common.spread[10 chunks]")
+def _():
+    import common
+    exchange = _Exchange()
+    return (lambda: common.spread("mtgox", exchange, "bid", D(5), D(100), D(110), 10, silent=True)), 1
+
+
+class _Quiet(object):
+    """swallows what the benchmarked code prints"""
+    def write(self, text):
+        pass
+
+
+def measure(name, repeat, budget=0.2):
+    """microseconds per call: (fastest round, median round, calls per round)"""
+    run, calls = BENCHMARKS[name]()
+    stdout, sys.stdout = sys.stdout, _Quiet()
+    try:
+        #enough calls per round for <budget> seconds, at least one
+        start = timeit.default_timer()
+        run()
+        once = timeit.default_timer() - start
+        number = max(1, int(budget / max(once, 1e-9)))
+        rounds = []
+        for i in range(repeat):
+            start = timeit.default_timer()
+            for j in xrange(number):
+                run()
+            rounds.append((timeit.default_timer() - start) / (number * calls) * 1E6)
+    finally:
+        sys.stdout = stdout
+    rounds.sort()
+    return rounds[0], rounds[len(rounds) // 2], number * calls
+
+def compare(results, baseline, threshold):
+    """[(name, baseline us, now us, ratio)] of the ones slower than
+    baseline * (1 + threshold)"""
+    regressions = []
+    for name, result in results.iteritems():
+        if name in baseline and baseline[name]["us"] > 0:
+            ratio = result["us"] / baseline[name]["us"]
+            if ratio > 1 + threshold:
+                regressions.append((name, baseline[name]["us"], result["us"], ratio))
+    return regressions
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-f", "--filter", default="", help="only run benchmarks with this in their name")
+    parser.add_option("-r", "--repeat", type="int", default=5, help="rounds per benchmark (default 5)")
+    parser.add_option("-o", "--output", help="write the results to this json file")
+    parser.add_option("--baseline", default=os.path.join(partialpath + 'bench_baseline.json'),
+                      help="baseline file (default data/bench_baseline.json)")
+    parser.add_option("--check", action="store_true", help="compare with the baseline, exit 1 on a regression")
+    parser.add_option("--threshold", type="float", default=0.25,
+                      help="how much slower than the baseline is a regression (default 0.25 = 25%)")
+    parser.add_option("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_option("--list", action="store_true", help="list the benchmarks")
+    options, args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if options.filter in name]
+    if options.list:
+        print "\n".join(names)
+        return 0
+    baseline = {}
+    if options.check and os.path.isfile(options.baseline):
+        with open(options.baseline, 'r') as f:
+            baseline = json.load(f)["results"]
+
+    results = collections.OrderedDict()
+    print "%-42s %10s %10s %10s" % ("benchmark", "us/call", "median", "baseline")
+    for name in names:
+        try:
+            best, median, calls = measure(name, options.repeat)
+        except ImportError as e:
+            print "%-42s skipped (%s)" % (name, e)
+            continue
+        results[name] = {"us": round(best, 3), "median": round(median, 3), "calls": calls}
+        known = "%10.3f" % baseline[name]["us"] if name in baseline else ""
+        print "%-42s %10.3f %10.3f %s" % (name, best, median, known)
+        sys.stdout.flush()
+
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+              "machine": platform.platform(), "repeat": options.repeat, "results": results}
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if options.save_baseline:
+        if os.path.isfile(options.baseline):
+            #keep the baselines of the benchmarks that were not run
+            with open(options.baseline, 'r') as f:
+                old = json.load(f, object_pairs_hook=collections.OrderedDict)["results"]
+            old.update(results)
+            report["results"] = old
+        with open(options.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print "Baseline saved to %s" % options.baseline
+    if options.check:
+        if not baseline:
+            print "No baseline in %s to check against." % options.baseline
+            return 0
+        regressions = compare(results, baseline, options.threshold)
+        for name, was, now, ratio in regressions:
+            print "REGRESSION %s: %.3f us -> %.3f us (%.0f%% slower)" % (name, was, now, (ratio - 1) * 100)
+        if regressions:
+            return 1
+        print "No regressions (threshold %.0f%%)." % (options.threshold * 100)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,8 @@
 # Universal Client for all things bitfloor
 # Functionality _should_ be listed in README
 
+import asynclog
+import ledger
 import bitfloorapi
 import cmd
 import time
@@ -29,6 +31,23 @@ cPrec = bitfloor.cPrec
 
 threadlist = {}
 
+botlog = None
+
+def liquidbotlog():
+    """the log of the liquidbot, made and hooked into logging on the first
+    run only (a writer thread and the root handlers per run would pile up)"""
+    global botlog
+    if botlog is None:
+        botlog = asynclog.AsyncLog('liquidbotlog.txt', template='%(asctime)s: %(message)s',
+                                   datefmt='%m-%d %H:%M:%S')
+        console_logger = logging.getLogger('')
+        console_logger.setLevel(logging.DEBUG)
+        console_logger.addHandler(asynclog.AsyncHandler(botlog))
+        console = logging.StreamHandler()
+        console.setLevel(logging.INFO)
+        console_logger.addHandler(console)
+    return botlog
+
 
 def bal():
     balance = bitfloor.accounts()
@@ -85,7 +104,7 @@ def refreshbook():
     #get the entire Lvl 2 order book 
     orderbook = bitfloor.book(2)
     #print orderbook
-    entirebook = Book.parse(orderbook,True) 
+    entirebook = Book.parse(orderbook,True,cPrec=cPrec,bPrec=bPrec)   #integer mode
     #sort it
     entirebook.sort()
     return entirebook
@@ -297,31 +316,9 @@ class Shell(cmd.Cmd):
             # make a pair of orders 1 cent ABOVE/BELOW the spread (DOES change the spread)(fairly risky, price can change. least profit per run, most likely to work)
             # so far this works. needs a whole bunch more work though.
 
-            class StreamToLogger(object):
-                """Fake file-like stream object that redirects writes to a logger instance."""
-                def __init__(self, logger, log_level=logging.DEBUG):
-                    self.logger = logger
-                    self.log_level = log_level
-                    self.linebuf = ''
-                def write(self, buf):
-                    for line in buf.rstrip().splitlines():
-                        self.logger.log(self.log_level, line.rstrip())
-
-            logging.basicConfig(filename='liquidbotlog.txt'
-                   ,filemode='a'
-                   ,format='%(asctime)s: %(message)s'
-                   ,datefmt='%m-%d %H:%M:%S'
-                   ,level=logging.DEBUG
-                   )
-
-            stdout_logger = logging.getLogger('STDOUT')
-            sl = StreamToLogger(stdout_logger, logging.DEBUG)
-            stdout_logger.setLevel(logging.DEBUG)
-
-            console_logger = logging.getLogger('')
-            console = logging.StreamHandler()
-            console.setLevel(logging.INFO)
-            console_logger.addHandler(console)         
+            #the file is written by a background thread, what the bot prints
+            #between capture() and release() goes there too (lib/asynclog.py)
+            botlog = liquidbotlog()
 #pre inits
             TRADEAMOUNT = D('1.00000')           #<--------- number of bitcoins to buy in each go.
             BUYMAXPRICE = D('999.0')            #<------max price for buys 
@@ -336,8 +333,7 @@ class Shell(cmd.Cmd):
             numbought,numsold = initcountbuys,initcountsells       
             typedict = {0:"Buy",1:"Sell"}
             logging.info("Liquidbot started.")
-            successes = open("successlog.txt",'a')
-            successes.write("Began at %s\n" % time.time())
+            fills = ledger.Ledger("ledger_liquidbot.led")
             #TRADEAMOUNT = raw_input("How much do you want the bot to trade per order:  ")
             while(not stop_event.is_set()):
 #loop inits                 
@@ -353,26 +349,30 @@ class Shell(cmd.Cmd):
                 lowask = onaskbookprice[0]
                 highbid = onbidbookprice[0]             
                 spr = lowask - highbid
-                orders = bitfloor.orders()
+                #one call for all open orders, order_info only for the ones that are gone
+                orders = dict((o["order_id"], o) for o in bitfloor.orders())
                 allorders = buyorderids + sellorderids
 #order mgmt
-                for x in allorders:
-                    co = bitfloor.order_info(x)
+                for x in allorders[:]:
+                    if x in orders:
+                        co = dict(orders[x], status='open')
+                    else:
+                        co = bitfloor.order_info(x)
                     if co["status"]=='open':
                         v0 = D(str(co["price"]))
                         v1 = bookdict[co["side"]][0]
                         v2 = bookdict[co["side"]][1]
                         s = co["side"]
                         if (s==0 and (v0<v1 and v0<v2)) or (s==1 and (v0>v1 and v0>v2)):        #shorthand to Check that we have the best (or 2nd best) bid/ask
-                            sys.stdout = sl
+                            asynclog.capture(botlog)
                             logging.debug(bitfloor.order_cancel(x))
                             logging.debug("Order ID Listed above = CANCELLED")
                             countbuys = initcountbuys+numbought
                             countsells = initcountsells+numsold
-                            sys.stdout = sys.__stdout__
+                            asynclog.release()
                             allorders.remove(x)
                             iddicts[co["side"]].remove(x)
-                    if not(x in str(orders)):
+                    if not(x in orders):
                         if "error" in co:
                             logging.warning("There was some kind of error retrieving the order information.")
                         elif "status" in co:
@@ -389,8 +389,8 @@ class Shell(cmd.Cmd):
                                     numsold += 1
                                     amtsold += size
                                 logging.debug("size of all buys: %s . size of all sells: %s ." % (amtbought,amtsold))
-                                successes.write("%s %s @$ %.2f = %.7f , %s , %s\n" % (typedict[co["side"]],size,price,result,amtbought,amtsold))
-                                successes.flush()
+                                fills.fill("buy" if co["side"]==0 else "sell", size, price, oid=co["order_id"])
+                                logging.info("position: %s BTC @ %.2f, realised: %.5f" % (fills.position,fills.avgcost,fills.realised))
                             if co["status"]=='cancelled':
                                 logging.debug("%s order %s for %s BTC @ $%.2f has been %s!." % (typedict[co["side"]], co["order_id"],co["size"],float(co["price"]),co["status"]))
                             iddicts[co["side"]].remove(co["order_id"])
@@ -412,9 +412,9 @@ class Shell(cmd.Cmd):
                 #     if len(buyorderids) < TRADESATONCE and spr > D('0.10') and numsold >= numbought:
                 #         if targetbid <= BUYMAXPRICE:
                 #             try:
-                #                 sys.stdout = sl
+                #                 asynclog.capture(botlog)
                 #                 buyorderids += spread('bitfloor',bitfloor,0,TRADEAMOUNT,targetbid)
-                #                 sys.stdout = sys.__stdout__
+                #                 asynclog.release()
                 #                 countbuys += 1
                 #             except:
                 #                 logging.error(traceback.print_exc())
@@ -423,9 +423,9 @@ class Shell(cmd.Cmd):
                 #     if len(sellorderids) < TRADESATONCE and spr > D('0.10') and numbought >= numsold:
                 #         if targetask >= SELLMINPRICE:
                 #             try:
-                #                 sys.stdout = sl
+                #                 asynclog.capture(botlog)
                 #                 sellorderids += spread('bitfloor',bitfloor,1,TRADEAMOUNT,targetask)
-                #                 sys.stdout = sys.__stdout__
+                #                 asynclog.release()
                 #                 countsells += 1
                 #             except:
                 #                 logging.error(traceback.print_exc())
@@ -442,10 +442,10 @@ class Shell(cmd.Cmd):
                     if len(buyorderids) < TRADESATONCE and numsold >= numbought:
                         if targetbid <= BUYMAXPRICE:
                             try:
-                                sys.stdout = sl
+                                asynclog.capture(botlog)
                                 buyorderids += spread('bitfloor',bitfloor,0,TRADEAMOUNT,targetbid)
                                 SELLMINPRICE = targetbid
-                                sys.stdout = sys.__stdout__
+                                asynclog.release()
                                 countbuys += 1
                             except:
                                 logging.error(traceback.print_exc())
@@ -454,17 +454,24 @@ class Shell(cmd.Cmd):
                     if len(sellorderids) < TRADESATONCE and numbought >= numsold:
                         if targetask >= SELLMINPRICE:
                             try:
-                                sys.stdout = sl
+                                asynclog.capture(botlog)
                                 sellorderids += spread('bitfloor',bitfloor,1,TRADEAMOUNT,targetask)
                                 BUYMAXPRICE = targetask
-                                sys.stdout = sys.__stdout__
+                                asynclog.release()
                                 countsells += 1
                             except:
                                 logging.error(traceback.print_exc())
                         else:
                             logging.debug("EXCEEDED SELLMINPRICE of: %s" % SELLMINPRICE)                                    
-#restart the loop 
-                stop_event.wait(5)
+#restart the loop: within a second of one of our orders leaving the book
+#(one orders() call per second), otherwise after 5 seconds
+                for i in range(5):
+                    if stop_event.wait(1):
+                        break
+                    ours = set(buyorderids + sellorderids)
+                    if ours - set(o["order_id"] for o in bitfloor.orders()):
+                        break
+            fills.close()
 
 #main function of def do_liquidbot(): from above                
         try:
@@ -663,6 +670,8 @@ class Shell(cmd.Cmd):
         print "\n"
         print "Session Terminating......."
         print "Exiting......"           
+        if botlog is not None:
+            botlog.close()          #writes what is left of the liquidbot log
         return True
 
     def do_EOF(self,arg):        #exit out if Ctrl+Z is pressed
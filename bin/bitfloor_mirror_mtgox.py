@@ -1,129 +1,36 @@
 #!/usr/bin/env python
 # will try to mirror mtgox's order book,
 # taking into account existing bitfloor orders and the user's available funds
+#
+# The MtGox book comes live from the streaming API, bitfloor's book, our
+# orders and balances are kept in memory by mirror.Mirror and only the
+# levels that changed get orders cancelled/placed (see lib/mirror.py).
 
-
-import urllib
-import json
-import json_ascii
-import decimal
-from decimal import Decimal as D
 import sys
-
-from book import Book, Order
+import time
 
 import bitfloorapi
+import mirror
+import mtgox_prof7bitapi
 
 bitfloor = bitfloorapi.Client()
-size_LIMIT = 0.01
-
-def get_mtgox():
-    f = urllib.urlopen("http://mtgox.com/api/0/data/getDepth.php")
-    return json.loads(f.read(), object_hook=json_ascii.decode_dict)
-
-def get_funds():
-    pos = {}
-    bpositions = bitfloor.accounts()
-    for p in bpositions:
-        pos[p['currency']] = D(str(p['amount']))
-    return pos
-
-def get_our_book():
-    orders = bitfloor.orders()
-
-    our_book = {
-        'bids': {},
-        'asks': {}
-    }
-
-    our_book2 = {
-        'bids': [],
-        'asks': []
-    }
-
-    for o in orders:
-        size = D(str(o['size']))
-        price = D(str(o['price']))
-        order = Order(size, price)
-        order.id = o['order_id'] # TODO: hacky
-        tup = (str(price), str(size))
-        if o['side'] == 0:
-            our_book['bids'].setdefault(price, []).append(order)
-            our_book2['bids'].append(tup)
-        elif o['side'] == 1:
-            our_book['asks'].setdefault(price, []).append(order)
-            our_book2['asks'].append(tup)
-
-    return our_book, Book.parse(our_book2)
-
-def cancel(book, our_book, side):
-    sides = side + 's'
-    for o in getattr(book, sides):
-        if o.size < -size_LIMIT:
-            for order in our_book[sides].get(o.price, []):
-                print 'cancel ' + side, order
-                bitfloor.order_cancel(order.id)
-                o.size += order.size
-                if o.size >= 0:
-                    break
-
-def run():
-    mbook = Book.parse(get_mtgox())
-    bbook = Book.parse(bitfloor.book(level=2))
-
-    mbook.flatten('0.01')
-
-    our_book, our_book2 = get_our_book()
-
-    # remove our stuff from bbook
-    # bbook will have the orders we don't control
-    bbook.subtract(our_book2)
-
-    # mbook will now have the gap needed to be filled by our orders
-    mbook.subtract(bbook)
-
-    funds = get_funds()
-
-    # get the total remaining area needed to fill
-    # find which factor of it we can fill with our total funds
-    sumb = sum(o.price*o.size for o in mbook.bids if o.size > 0)*D('1.04')
-    bfactor = min(1, funds['USD']/sumb) if sumb > 0 else 1
-    suma = sum(o.size for o in mbook.asks if o.size > 0)
-    afactor = min(1, funds['BTC']/suma) if suma > 0 else 1
-
-    print afactor, bfactor
-    print suma, sumb
-
-    # multiply everything positive by the factor
-    # mbook will now have what we need to provide to bitfloor's book
-    for o in mbook.bids:
-        if o.size > 0:
-            o.size *= bfactor
-            o.size = o.size.quantize(D('0.00000001'), rounding=decimal.ROUND_DOWN)
-    for o in mbook.asks:
-        if o.size > 0:
-            o.size *= afactor
-            o.size = o.size.quantize(D('0.00000001'), rounding=decimal.ROUND_DOWN)
-
-    # now, get the difference between what we need to provide and what we have
-    mbook.subtract(our_book2)
-
-    # cancel orders first which are above the gap
-    cancel(mbook, our_book, 'bid')
-    cancel(mbook, our_book, 'ask')
-
-    # send in orders to fill the gaps
-    for o in mbook.bids:
-        if o.size > size_LIMIT:
-            print 'bid', o
-            bitfloor.buy(size=str(o.size), price=str(o.price))
-    for o in mbook.asks:
-        if o.size > size_LIMIT:
-            print 'ask', o
-            bitfloor.sell(size=str(o.size), price=str(o.price))
-
-while True:
+size_LIMIT = '0.01'
+
+def main():
+    #no API key needed for the public depth feed
+    gox = mtgox_prof7bitapi.Gox(mtgox_prof7bitapi.Secret(), mtgox_prof7bitapi.GoxConfig())
+    engine = mirror.Mirror(bitfloor, gox.orderbook, lock=mtgox_prof7bitapi.Signal._lock,
+                           size_limit=size_LIMIT)
+    gox.orderbook.signal_changed.connect(engine.slot_changed)
+    gox.start()
+    engine.start()
     try:
-        run()
-    except Exception as e:
-        print >> sys.stderr, e
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print >> sys.stderr, "stopping"
+    engine.stop()
+    gox.stop()
+
+if __name__ == "__main__":
+    main()
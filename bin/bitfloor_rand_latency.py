@@ -7,6 +7,7 @@ import random
 import math
 import time
 import bitfloorapi
+import latency
 import decimal
 from decimal import Decimal as D
 import cmd
@@ -15,11 +16,8 @@ import sys
 
 bitfloor = bitfloorapi.Client()
 
-olatency = [] # order latency
-clatency = [] # cancel latency
-
-def mean(l):
-    return float(sum(l))/len(l) if len(l) > 0 else None
+olatency = latency.Histogram() # order latency (microseconds)
+clatency = latency.Histogram() # cancel latency
 
 def calclatency():        
     orders = set()
@@ -30,18 +28,18 @@ def calclatency():
         testprice = float(bitfloor.ticker()['price'])+5     #creates a pending order $5 above lowest ask price to test
         magnitude=0.01                                      #Create tiny orders of 0.01 BTC
         print '{0} order/cancels: {1}, {2}'.format(count, testprice, magnitude)
-        print 'Ordering latency: {0} orders, Cancellation latency: {1} '.format(mean(olatency), mean(clatency))    
+        print 'Ordering latency: {0} orders, Cancellation latency: {1} '.format(olatency.mean(), clatency.mean())    
 
         if random.random() < .5:
             if orders:
-                start = time.time()
+                start = latency.monotonic()
                 bitfloor.order_cancel(orders.pop())
-                clatency.append(time.time() - start)
+                clatency.record((latency.monotonic() - start) * 1E6)
             
         else:
-            start = time.time()
+            start = latency.monotonic()
             order = bitfloor.order_new(1, magnitude, testprice) #add order
-            olatency.append(time.time() - start)
+            olatency.record((latency.monotonic() - start) * 1E6)
             id = order.get('order_id')
             if id:
                 orders.add(id)
@@ -50,6 +48,7 @@ def calclatency():
 #        count += 1
     time.sleep(5)
     bitfloor.cancel_all() #cancel any remaining orders
+    print latency.report({"order": olatency, "cancel": clatency})
     print "All Trades have been Cancelled, Session Terminating......."
     return True    
  
@@ -618,7 +618,7 @@ class Shell(cmd.Cmd):
             entirebook = refreshbook()
             print "Lowest ask is: $%f"  % entirebook.asks[0][0]
             print "Highest Bid is: $%f" % entirebook.bids[0][0]
-            print "The spread is: $%f" % (entirebook.asks[0][0] - entirebook.bids[0][0])
+            print "The spread is: $%f" % entirebook.spread()
         except Exception as e:
             print "Unexpected Error: %s" % e
             self.onecmd('help spread')
@@ -10,6 +10,9 @@ import os
 
 
 import unlock_api_key 
+import httppool
+import nonces
+import asyncapi
 
 
 
@@ -20,17 +23,9 @@ else:
     partialpath=os.path.join(fullpath + '/../data/')
 BTC_api_key,BTC_api_secret,unused = unlock_api_key.unlock("btc-e") 
 
-#you must have a nonce_state_btce file located in your ..\data\ directory with an integer number inside the file  
+#same nonces as btceapi (lib/nonces.py), continues from ..\data\nonce_state_btce
 def nonce_generator():
-    fd = open(os.path.join(partialpath + 'nonce_state_btce') ,'r')
-    nonce = int(fd.read())
-    fd.close()
-    while (True):
-        nonce = nonce+1
-        fd = open(os.path.join(partialpath + 'nonce_state_btce'),'w')
-        fd.write(str(nonce))
-        fd.close()
-        yield nonce
+    return nonces.allocator("btce", legacy='nonce_state_btce')
 
 def btcepost(method) :
     nonce = nonce_generator()
@@ -49,18 +44,14 @@ def btcepost(method) :
                        "Key":BTC_api_key,
                        "Sign":sign}
     while True:
-        conn = httplib.HTTPSConnection("btc-e.com")
-        conn.request("POST", "/tapi", params, headers)
-        response = conn.getresponse()
-        if response.status==200:
+        status, _, data = httppool.pool.request("POST", "https://btc-e.com/tapi", params, headers)
+        if status==200:
             break
-        conn.close()
         print "*",
         time.sleep(1)
  
-    a = json.load(response)
+    a = json.loads(data)
  
-    conn.close()
     return a
  
  
@@ -68,8 +59,7 @@ def btcepost(method) :
 def get_trades(pair):
     url='https://btc-e.com/api/2/'+pair+'/depth'
     req = urllib2.Request(url)
-    opener = urllib2.build_opener()
-    f = opener.open(req)
+    f = httppool.urlopen(req)
     x=f.read()
     y=json.loads(x)
  
@@ -79,6 +69,8 @@ def get_trades(pair):
  
  
  
+PAIRS = ['btc_usd','btc_rur','btc_eur','ltc_btc','ltc_usd','ltc_rur','nmc_btc','usd_rur','eur_usd']
+
 def ac(ret=0):
     k={}
     t={'btc':0, 'ltc':0, 'usd':0, 'rur':0, 'nmc':0}
@@ -90,12 +82,12 @@ def ac(ret=0):
    
     while True:
         try:
+            #the public depth of every pair is fetched concurrently (lib/asyncapi.py)
+            #while the private calls go out one after the other
+            depths = [asyncapi.default_executor.submit(get_trades, p) for p in PAIRS]
+
             x=btcepost("getInfo")
- 
-            time.sleep(0.2)
             y=btcepost("OrderList")
- 
-            time.sleep(0.2)
             z=btcepost("getInfo")
  
             if x['return']['funds'] != z['return']['funds']:
@@ -119,41 +111,8 @@ def ac(ret=0):
  
                     x['return']['funds'][v] = x['return']['funds'][v]+am
  
-            p='btc_usd'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
- 
-            p='btc_rur'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
-           
-            p='btc_eur'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
-           
-            p='ltc_btc'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
-           
-            p='ltc_usd'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
- 
-            p='ltc_rur'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
- 
-            p='nmc_btc'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
- 
-            p='usd_rur'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
-           
-            p='eur_usd'
-            q=get_trades(p)
-            k[p]=(q[0][0]+q[1][0])/2.
+            for p,q in zip(PAIRS, asyncapi.gather(depths)):
+                k[p]=(q[0][0]+q[1][0])/2.
  
             xf=x['return']['funds']
             k['eur_ltc']=1./k['btc_eur']/k['ltc_btc']
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# consolidated_book.py
+# Prints one order book merged from MtGox (live socket), Bitstamp, Bitfloor
+# and BTC-e, with the best bid/ask across all of them and which venue has
+# the volume at each level. See lib/consolidatedbook.py
+#
+# Usage: consolidated_book.py [levels] [seconds between prints]
+
+import sys
+import time
+import threading
+
+import bitfloorapi
+import bitstampapi
+import btceapi
+import mtgox_prof7bitapi
+from book import Book
+from consolidatedbook import ConsolidatedBook, Poller, price, volume
+
+bitstamp = bitstampapi.Client()
+bitfloor = bitfloorapi.Client()
+btce = btceapi.Client()
+
+BTCE_cPrec = '0.001'
+BTCE_bPrec = '0.00000001'
+
+def bitfloorbook():
+    return Book.parse(bitfloor.book(2), True, cPrec=bitfloor.cPrec, bPrec=bitfloor.bPrec)
+
+def btcebook():
+    return Book.parse(btce.depth("btc_usd"), cPrec=BTCE_cPrec, bPrec=BTCE_bPrec)
+
+def venuetext(venues):
+    return " ".join("%s:%.4f" % (venue, volume(v)) for venue, v in sorted(venues.iteritems()))
+
+def printbook(cbook, count):
+    asks = cbook.levels("asks", count)
+    bids = cbook.levels("bids", count)
+    for level in reversed(asks):
+        print "ASK  $%-10.5f %14.8f   %s" % (price(level.price), volume(level.volume), venuetext(level.venues))
+    print "-" * 60
+    for level in bids:
+        print "BID  $%-10.5f %14.8f   %s" % (price(level.price), volume(level.volume), venuetext(level.venues))
+    bid, ask = cbook.bbo()
+    if bid and ask:
+        print "Best bid $%.5f (%s)  best ask $%.5f (%s)  spread $%.5f" % (
+            price(bid.price), ",".join(sorted(bid.venues)), price(ask.price),
+            ",".join(sorted(ask.venues)), price(ask.price - bid.price))
+    print "Updated: " + " ".join("%s %ds ago" % (venue, time.time() - t) for venue, t in sorted(cbook.updated.iteritems()))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    cbook = ConsolidatedBook()
+    #mtgox: the whole live book is merged once after every fulldepth, in
+    #between every depth message only updates its own level.
+    #(Signal only keeps weak references, so the slots are kept here)
+    gox = mtgox_prof7bitapi.Gox(mtgox_prof7bitapi.Secret(), mtgox_prof7bitapi.GoxConfig())
+    fulldepth = threading.Event()
+    def slot_fulldepth(dummy_sender, dummy_data):
+        fulldepth.set()
+    slot_depth = cbook.slot_depth("mtgox")
+    gox.signal_fulldepth.connect(slot_fulldepth)
+    gox.signal_depth.connect(slot_depth)
+
+    poller = Poller(cbook)
+    poller.add("bitstamp", bitstamp.entirebook, 10)
+    poller.add("bitfloor", bitfloorbook, 10)
+    poller.add("btce", btcebook, 10)
+
+    gox.start()
+    poller.start()
+    try:
+        while True:
+            time.sleep(interval)
+            if fulldepth.is_set():
+                fulldepth.clear()
+                cbook.update_orderbook("mtgox", gox.orderbook, lock=mtgox_prof7bitapi.Signal._lock)
+            printbook(cbook, count)
+    except KeyboardInterrupt:
+        print >> sys.stderr, "stopping"
+    poller.stop()
+    gox.stop()
+
+if __name__ == "__main__":
+    main()
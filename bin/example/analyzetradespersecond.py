@@ -1,15 +1,20 @@
-import json
-f = open('../data/mtgox_entiretrades322.txt','r')
-everything = f.readlines()
-data = everything[1]
-data = json.loads(everything[1])
-data = data["data"]
+import sys
+import tradearchive
+#usage: analyzetradespersecond.py [starttime] [endtime]   (unix seconds, reads only that range of the archive)
+archive = tradearchive.TradeArchive("mtgox")
+if archive.last() is None:
+  tradearchive.import_mtgox_file(archive,'../data/mtgox_entiretrades322.txt')
+start = float(sys.argv[1]) if len(sys.argv) > 1 else None
+end = float(sys.argv[2]) if len(sys.argv) > 2 else None
 onedelta = 0
 lowestdelta = 999999999999999999999999999999999
-for x in xrange(0,len(data)-1):
-  onedelta = float(data[x+1]['tid'])-float(data[x]['tid'])
-  if onedelta < lowestdelta:
-    lowestdelta = onedelta
+previous = None
+for trade in archive.read(start,end):
+  if previous is not None:
+    onedelta = float(trade.tid)-float(previous.tid)
+    if onedelta < lowestdelta:
+      lowestdelta = onedelta
+  previous = trade
 
 
 print lowestdelta
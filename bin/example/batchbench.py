@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# batchbench.py
+# Wall clock time to lay and then cancel a spread ladder, one order after
+# the other against lib/batchorder.py. Runs against a local HTTPS stand-in
+# for an exchange that answers every call after <delay> ms (the round trip
+# to a real exchange), so nothing is sent anywhere. The stand-in checks that
+# no nonce is used twice, and counts the ones its own threads happened to
+# handle after a higher one (the calls are sent in nonce order, but over
+# several connections).
+# Needs the openssl command line tool (see poollatency.py).
+#
+# Usage: batchbench.py [chunks] [delay ms] [workers]
+
+import BaseHTTPServer
+import SocketServer
+import shutil
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+import json
+from decimal import Decimal as D
+
+import batchorder
+import httppool
+from poollatency import makecert
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+    delay = 0.05
+    seen = set()
+    last_nonce = [0]
+    reordered = [0]
+    duplicates = [0]
+    lock = threading.Lock()
+    def do_POST(self):
+        data = urlparse.parse_qs(self.rfile.read(int(self.headers.getheader("Content-Length") or 0)))
+        with self.lock:
+            nonce = int(data["nonce"][0])
+            if nonce in self.seen:
+                self.duplicates[0] += 1
+            elif nonce < self.last_nonce[0]:
+                self.reordered[0] += 1
+            self.seen.add(nonce)
+            self.last_nonce[0] = max(nonce, self.last_nonce[0])
+        time.sleep(self.delay)
+        body = json.dumps({"order_id": nonce})
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    def handle_error(self, request, client_address):
+        pass        #the client closing its kept open connections at the end
+
+class StandIn(object):
+    """signs and sends like bitfloorapi.Client._send_post"""
+    def __init__(self, url):
+        self.url = url
+        self.sendlock = threading.RLock()
+        self.last_nonce = 0
+    def nonce(self):
+        with self.sendlock:
+            self.last_nonce = max(self.last_nonce + 1, int(time.time()*1e6))
+            return self.last_nonce
+    def _send_post(self, path, payload):
+        def sign():
+            signed = dict(payload, nonce=self.nonce())
+            return urllib.urlencode(signed), {"Content-Type": "application/x-www-form-urlencoded"}
+        _, _, data = httppool.pool.request("POST", self.url + path, sign=sign, signlock=self.sendlock)
+        return json.loads(data)
+    def order_new(self, side, size, price):
+        return self._send_post("/order/new", {"side": side, "size": size, "price": price})
+    def order_cancel(self, order_id):
+        return self._send_post("/order/cancel", {"order_id": order_id})
+
+def main():
+    chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    Handler.delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    tmp = tempfile.mkdtemp()
+    try:
+        keyfile, certfile = makecert(tmp)
+        server = Server(("127.0.0.1", 0), Handler)
+        server.socket = ssl.wrap_socket(server.socket, keyfile=keyfile, certfile=certfile, server_side=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        httppool.pool = httppool.HTTPPool(maxsize=workers, context=ssl._create_unverified_context())
+        client = StandIn("https://127.0.0.1:%d" % server.server_address[1])
+
+        orders = [(0, amount, price) for amount, price in
+                  batchorder.ladder(6.4, 40, 41, chunks, D('0.01'), D('0.00001'))]
+        print "%d chunk ladder, %dms per call, %d workers" % (chunks, Handler.delay * 1000, workers)
+        for name, engine in (("one at a time", batchorder.BatchEngine(workers=1)),
+                             ("batchorder", batchorder.BatchEngine(workers=workers))):
+            placed = engine.place(client.order_new, orders)
+            place_time = placed.elapsed
+            cancelled = engine.cancel(client.order_cancel, [r.result["order_id"] for r in placed if r.ok])
+            print "%-14s place %6.2fs  cancel %6.2fs  (%d/%d ok)" % (
+                name, place_time, cancelled.elapsed, sum(r.ok for r in placed), sum(r.ok for r in cancelled))
+        print "nonces used twice: %d, handled after a higher one: %d" % (
+            Handler.duplicates[0], Handler.reordered[0])
+        httppool.pool.close()
+        server.shutdown()
+        server.server_close()
+        time.sleep(0.2)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# Time DepthParser.process on the sample fulldepth in data/ for the common
+# argument combinations.
+#usage: depthbench.py [runs]
+import os
+import sys
+import time
+import json
+from depthparser import DepthParser
+
+fullpath = os.path.dirname(os.path.realpath(__file__))
+if os.name == 'nt':
+    partialpath = os.path.join(fullpath + '\\..\\..\\data\\')
+else:
+    partialpath = os.path.join(fullpath + '/../../data/')
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+with open(os.path.join(partialpath + 'mtgox_fulldepth.txt'), 'r') as f:
+    everything = f.readlines()
+#first line is the vintage, second the json from money/depth/full
+depth = json.dumps({"return": json.loads(everything[1])["data"]})
+
+ARGS = ([],
+        ["steps=10"],
+        ["low=10", "high=20"],
+        ["low=1", "high=200", "steps=20"],
+        ["amount=500"],
+        ["amount=500", "steps=5", "iv=true"],
+        ["value=10000", "iv=true"],
+        ["cumulate=true", "iv=true"],
+        ["low=5", "high=30", "cumulate=true"],
+        ["side=bids", "steps=1", "amount=50"])
+
+for args in ARGS:
+    start = time.time()
+    for i in range(runs):
+        DepthParser(5, args).process(depth)
+    print "%-40s %8.2f ms" % (" ".join(args) or "(none)", (time.time() - start) * 1000 / runs)
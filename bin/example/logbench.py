@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# Cost per log message for the thread doing the logging: the old way
+# (logging.debug to a file handler, like LogWriter.slot_debug did) against
+# lib/asynclog.py, directly and through its logging handler. The messages
+# look like the debug lines of the socket thread. Writes to a temp dir.
+#usage: logbench.py [messages]
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import asynclog
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+MSG = "### got depth: bid 12345678 vol: 150000000 total: 29103912344"
+
+def timed(name, func):
+    start = time.time()
+    for i in xrange(count):
+        func("Gox", MSG)
+    print "%-28s %6.2f us per message" % (name, (time.time() - start) * 1e6 / count)
+
+tmp = tempfile.mkdtemp()
+try:
+    logger = logging.getLogger("sync")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(os.path.join(tmp, "sync.log"))
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s %(message)s'))
+    logger.addHandler(handler)
+    timed("logging.debug to a file", lambda name, msg: logger.debug("%s:%s", name, msg))
+
+    log = asynclog.AsyncLog(os.path.join(tmp, "async.log"))
+    timed("AsyncLog.debug", lambda name, msg: log.debug(name, "%s:%s", name, msg))
+    start = time.time()
+    log.flush(timeout=60)
+    print "%-28s %6.2f us per message (on the writer thread)" % ("  writing it out", (time.time() - start) * 1e6 / count)
+
+    compact = asynclog.AsyncLog(os.path.join(tmp, "compact.log"), compact=True)
+    timed("AsyncLog.debug, compact", lambda name, msg: compact.debug(name, msg))
+    compact.flush(timeout=60)
+
+    viahandler = logging.getLogger("async")
+    viahandler.propagate = False
+    viahandler.setLevel(logging.DEBUG)
+    viahandler.addHandler(asynclog.AsyncHandler(log))
+    timed("logging.debug to AsyncHandler", lambda name, msg: viahandler.debug("%s:%s", name, msg))
+    log.close()
+    compact.close()
+    for name in ("sync.log", "async.log", "compact.log"):
+        print "%-12s %8d bytes" % (name, os.path.getsize(os.path.join(tmp, name)))
+finally:
+    shutil.rmtree(tmp)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# poollatency.py
+# Per call latency of a new connection per request (urllib2.urlopen, like
+# the clients used to do) against the keep-alive connections of
+# lib/httppool.py. Runs against a local HTTPS stand-in for an exchange so
+# nothing is sent anywhere. Needs the openssl command line tool to make a
+# throwaway self-signed certificate.
+#
+# Usage: poollatency.py [calls]
+
+import BaseHTTPServer
+import SocketServer
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+import httppool
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       #keep-alive
+    wbufsize = -1                       #send the reply in one go, like a real server
+    def _reply(self):
+        body = '{"result":"success","return":{"order_id":1234}}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def do_GET(self):
+        self._reply()
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader("Content-Length") or 0))
+        self._reply()
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    def handle_error(self, request, client_address):
+        pass        #the client closing its kept open connections at the end
+
+def makecert(path):
+    keyfile = os.path.join(path, "key.pem")
+    certfile = os.path.join(path, "cert.pem")
+    with open(os.devnull, "w") as null:
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                               "-keyout", keyfile, "-out", certfile, "-days", "1",
+                               "-subj", "/CN=localhost"], stdout=null, stderr=null)
+    return keyfile, certfile
+
+def timeit(call, calls):
+    times = []
+    for i in xrange(calls):
+        start = time.time()
+        call()
+        times.append(time.time() - start)
+    times.sort()
+    return sum(times) / len(times), times[len(times) // 2], times[int(len(times) * 0.99)]
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    tmp = tempfile.mkdtemp()
+    try:
+        keyfile, certfile = makecert(tmp)
+        server = Server(("127.0.0.1", 0), Handler)
+        server.socket = ssl.wrap_socket(server.socket, keyfile=keyfile, certfile=certfile, server_side=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = "https://127.0.0.1:%d/api/order/new" % server.server_address[1]
+        post = "nonce=1&type=bid&amount=1"
+
+        #the certificate is our own, don't verify it
+        context = ssl._create_unverified_context()
+        opener = urllib2.build_opener(urllib2.HTTPSHandler(context=context))
+        httppool.pool = httppool.HTTPPool(context=context)
+
+        before = timeit(lambda: opener.open(urllib2.Request(url, post)).read(), calls)
+        after = timeit(lambda: httppool.urlopen(urllib2.Request(url, post)).read(), calls)
+        print "%d signed-order sized POSTs to a local TLS server" % calls
+        print "%-28s %9s %9s %9s" % ("", "mean ms", "median", "99%")
+        print "%-28s %9.3f %9.3f %9.3f" % (("new connection per call",) + tuple(t * 1000 for t in before))
+        print "%-28s %9.3f %9.3f %9.3f" % (("httppool keep-alive",) + tuple(t * 1000 for t in after))
+        print "connections opened by the pool: %d, requests over a reused one: %d" % (
+            httppool.pool.opened, httppool.pool.reused)
+        server.shutdown()
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
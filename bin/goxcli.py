@@ -37,6 +37,13 @@ import string
 import traceback
 import locale
 import time
+import tempfile
+
+# Depth-table filtering, shares InputError and MtGoxError with this script
+import httppool
+import nonces
+import ttlcache
+from depthparser import DepthParser, InputError, MtGoxError
 
 
 class CredentialError(Exception): pass
@@ -45,19 +52,6 @@ class RightError(Exception):
     def __init__(self, message, right=None, kind=None, arg=None):
         self.msg = "Need %s rights to use %s %s" % (right, kind, arg)
 
-class InputError(Exception):
-    def __init__(self, message, arg=None, kind=None):
-        if arg:
-            self.arg = arg
-            self.msg = "Invalid %s:" % (kind if kind else "argument")
-        else:
-            self.msg = message
-            self.arg = u""
-        Exception.__init__(self, message)
-
-class MtGoxError(Exception):
-    pass
-
 class DaemonError(Exception):
     pass
 
@@ -88,6 +82,7 @@ class XmlParse(object):
         self.path       = path
         self.doc        = None
         self.cfg        = None
+        self.mtime      = None
         self.colors     = None
         self.currencies = None
 
@@ -217,6 +212,7 @@ class XmlParse(object):
     def read(self, path=None, colors=False, currencies=False):
         u"Read config and (re)set dictionaries with new settings."
         if path: self.path = path
+        self.mtime = os.path.getmtime(self.path)
         self.doc = self.parse(self.path)
         cfg = self.doc.firstChild
         if cfg.tagName == "GoxCLI":
@@ -232,6 +228,13 @@ class XmlParse(object):
         if colors:
             self.colors = self._read_colors(sNode)
 
+    def refresh(self, path=None):
+        u"Read config, but only if it is another file or it changed since" \
+        u" it was read (the service keeps it between commands)."
+        if self.cfg is None or (path and path != self.path) or \
+           os.path.getmtime(path or self.path) != self.mtime:
+            self.read(path)
+
     def _read_colors(self,sNode):
         u"Read colors from document and return settings in a dictionary."
         ansi  = sNode.getElementsByTagName("ansi")[0].childNodes
@@ -527,10 +530,57 @@ class ServiceReader:
         return data["key"],data["secret"],int(data["counter"])
 
 
+# Where the service tells goxcli_client.py how to reach it
+SERVICE_FILE = os.path.join(tempfile.gettempdir(),
+                            "goxcli_{0}.service".format(getpass.getuser()))
+
+
+class FrameWriter(object):
+    u"File object sending what is written to the client stub as frames" \
+    u" of \"<length>\\n<data>\", a line (or 32kB) at a time."
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        if not data:
+            return
+        self._buffer.append(data)
+        self._size += len(data)
+        if "\n" in data or self._size >= 32768:
+            self.flush()
+
+    def flush(self):
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        for i in xrange(0, len(data), 32768):
+            piece = data[i:i+32768]
+            self.connection.sendall("%d\n%s" % (len(piece), piece))
+
+    def close(self):
+        u"End of the output"
+        self.flush()
+        self.connection.sendall("0\n")
+
+    def error(self, e):
+        u"The command broke off"
+        self.flush()
+        self.connection.sendall("err:%s\n" % str(e).replace("\n", " "))
+
+
 class LoginDaemon(object):
     def __init__(self, parent):
-        u"Background service providing credentials after logging in."
+        u"Background service providing credentials after logging in. It" \
+        u" also runs the commands forwarded by goxcli_client.py, keeping" \
+        u" the parsed config, the credentials, the open connections and" \
+        u" a short cache of ticker and depth between them."
         self.parent = parent
+        self._cmd   = None
 
     def kill(self, device):
         u"Kill old background service"
@@ -560,6 +610,10 @@ class LoginDaemon(object):
                 if data != "":
                     raise DaemonError(u"Malformed reply.")
                 else:
+                    try:
+                        os.remove(SERVICE_FILE)
+                    except OSError:
+                        pass
                     return r'{"return": "Terminated.", "result": "success"}'
 
     def run(self,daemon=False):
@@ -621,8 +675,12 @@ class LoginDaemon(object):
             else:
                 # TODO: Catch different kinds of errorcodes (like access denied)
                 raise DaemonError(u"Could not open listening socket.")
-        # Allow only one connection at a time
-        sock.listen(1)
+        # One connection at a time, the commands of the client stub wait in line
+        sock.listen(5)
+        # Tell the client stub where to find us
+        with open(SERVICE_FILE, "w") as f:
+            f.write(JsonParser.build(
+                {"unix": host} if socket.AF_UNIX else {"port": listening}))
         if not daemon:
             self._daemonize(self._listen, sock)
         return listening
@@ -652,7 +710,7 @@ class LoginDaemon(object):
             # Wait for a new connection
             connection, address = sock.accept()
             # Recieve data from client
-            data = connection.recv(33)
+            data = connection.recv(65536)
             if data == self.parent.device.id:
                 # Credentials requested
                 self.parent._counter += 1
@@ -662,6 +720,9 @@ class LoginDaemon(object):
                             counter=self.parent._counter
                             )
                 connection.send(cjson.encode(reply))
+            elif data.startswith("cmd:"):
+                # Command line forwarded by the client stub
+                self._command(connection, data[4:])
             else:
                 # Other data recieved, killing service
                 connection.send("")
@@ -670,11 +731,49 @@ class LoginDaemon(object):
             connection.close()
         sys.exit(0)
 
+    def _command(self, connection, data):
+        u"Run the arguments sent by the client stub and stream back what" \
+        u" goxcli.py would have printed while it prints it, in frames of" \
+        u" \"<length>\\n<data>\". \"0\\n\" ends the output, \"err:<message>\\n\"" \
+        u" ends it when the command could not be run or broke off."
+        out = FrameWriter(connection)
+        try:
+            self._handler().serve(cjson.decode(data), out)
+            out.close()
+        except socket.error:
+            # The client stub went away
+            pass
+        except Exception, e:
+            try:
+                out.error(e)
+            except socket.error:
+                pass
+
+    def _handler(self):
+        u"The CmdHandler running the commands, made once with the" \
+        u" credentials of the service. Its api caches ticker and depth."
+        if self._cmd is None:
+            cmd = CmdHandler()
+            cmd.setup()
+            cmd.api.cache = ttlcache.TTLCache(MtGoxAPI.CACHE_TTL)
+            cmd.device    = self.parent.device
+            cmd._standard = self.parent._standard
+            cmd._key      = self.parent._key
+            cmd._secret   = self.parent._secret
+            cmd._counter  = self.parent._counter
+            self._cmd = cmd
+        return self._cmd
+
 class MtGoxAPI(object):
+    # Seconds the public answers are reused when caching is on (the service)
+    CACHE_TTL = {"ticker": 1, "depth": 2, "fulldepth": 30}
+
     def __init__(self, credentials):
         u"Handles requests made to Mt.Gox."
         self._credentials = credentials
         self._url = "https://mtgox.com/api/"
+        # A ttlcache.TTLCache for the CACHE_TTL answers, if not None
+        self.cache = None
         
     @property
     def credentials(self):
@@ -866,8 +965,8 @@ class MtGoxAPI(object):
         if auth:
             # Function requires authentication
             key,secret,counter = self.credentials
-            # Timestamp*1000+counter to make no more than 1000 requests per second possible
-            params["nonce"] = (int(time.time())*1000)+counter
+            # shared with every other mtgox client on this machine (lib/nonces.py)
+            params["nonce"] = nonces.allocator("mtgox", floor=nonces.microseconds).next()
             # Format the post_data, if not null
             post_data = urllib.urlencode(params) if len(params) > 0 else None
             try:
@@ -895,10 +994,16 @@ class MtGoxAPI(object):
         else:
             post_data = urllib.urlencode(params) if len(params) > 0 else None
             req = urllib2.Request(url, post_data)
+            if self.cache is not None and rel_path in self.CACHE_TTL:
+                return self.cache.get((rel_path, url, post_data),
+                            partial(self._open, req, post_data, timeout))
+        return self._open(req, post_data, timeout)
+
+    def _open(self, req, post_data, timeout):
         try:
-            with closing(urllib2.urlopen(req, post_data, timeout)) as response:
+            with closing(httppool.urlopen(req, post_data, timeout)) as response:
                 return response.read()
-        except SSLError, e:
+        except (SSLError, socket.timeout), e:
             raise MtGoxError("Could not reach Mt.Gox. Operation timed out.")
         except urllib2.HTTPError, e:
             if e.code == 403:
@@ -907,588 +1012,6 @@ class MtGoxAPI(object):
                 raise urllib2.HTTPError(e.url, e.code, e.msg, None, None)
 
 
-class DepthParser(object):
-    def __init__(self, currencyDecimals, args = []):
-        self._cPrec = D(1) / 10 ** currencyDecimals
-        self.__sides = ("asks","bids")
-        try:
-            for arg,value in (arg.split("=") for arg in args):
-                arg = arg.lower()
-                if hasattr(self, arg):
-                    try:
-                        setattr(self, arg, value)
-                    except InvalidOperation:
-                        raise InputError( "Invalid value: %s" % value,
-                                          kind = "value", arg = value )
-                    except ValueError:
-                        raise InputError( "Invalid value: %s" % value,
-                                          kind = "value", arg = value )
-                else:
-                    raise InputError("Invalid argument: %s" % arg, arg = arg)
-        except ValueError:
-            raise InputError("Invalid argument")
-            
-    @property
-    def side(self):
-        try:
-            return self._side
-        except AttributeError:
-            return None
-
-    @side.setter
-    def side(self,value):
-        if value:
-            if value == "bids":
-                self._side = value
-                self.__sides = ("bids",)
-            elif value == "asks":
-                self._side = value
-                self.__sides = ("asks",)
-            else:
-                raise InputError( "Invalid value : %s" % value,
-                                   kind = "value", arg = value )
-        else:
-            self._side = None
-            self.__sides = ("asks","bids")
-
-    @property
-    def low(self):
-        try:
-            return self._minPrice
-        except AttributeError:
-            return None
-
-    @low.setter
-    def low(self, value):
-        if value:
-            self._minPrice = D(value)
-        else:
-            self._minPrice = None
-
-    @property
-    def high(self):
-        try:
-            return self._maxPrice
-        except AttributeError:
-            return None
-
-    @high.setter
-    def high(self, value):
-        if value:
-            self._maxPrice = D(value)
-        else:
-            self._maxPrice = None
-
-    @property
-    def amount(self):
-        try:
-            return self._maxAmount
-        except AttributeError:
-            return None
-
-    @amount.setter
-    def amount(self, value):
-        if value:
-            self._maxAmount = D(value)
-        else:
-            self._maxAmount = None
-        
-    @property
-    def value(self):
-        try:
-            return self._maxValue
-        except AttributeError:
-            return None
-
-    @value.setter
-    def value(self, value):
-        if value:
-            self._maxValue = D(value)
-        else:
-            self._maxValue = None
-        
-    @property
-    def steps(self):
-        try:
-            return self._steps
-        except AttributeError:
-            return None
-
-    @steps.setter
-    def steps(self, value):
-        if value:
-            self._steps = int(value)
-        else:
-            self._steps = False
-        
-    @property
-    def iv(self):
-        try:
-            return self._iv
-        except AttributeError:
-            return False
-
-    @iv.setter
-    def iv(self, value):
-        self._iv = self.readBool(value)
-        
-    @property
-    def full(self):
-        try:
-            return self._full
-        except AttributeError:
-            return False
-
-    @iv.setter
-    def full(self, value):
-        self._full = self.readBool(value)
-
-    @property
-    def cumulate(self):
-        try:
-            return self._cumulate
-        except AttributeError:
-            return False
-
-    @cumulate.setter
-    def cumulate(self, value):
-        self._cumulate = self.readBool(value)
-            
-    def readBool(self, value):
-        if value:
-            if isinstance(value, str):
-                try:
-                    value = {"true":True,"false":False}[value.lower()]
-                except KeyError:
-                    raise InputError( "Invalid value : %s" % value,
-                                       kind = "value", arg = value )
-            return bool(value)
-        else:
-            return False
-        
-        
-    def process(self, json, raw = True):
-        u"Parse depth-table from Mt.Gox, returning orders matching arguments"
-        # Check if user has applied any arguments so we need to parse and strip the json
-        json      = JsonParser.parse(json)["return"]
-        steps     = self.steps
-        oMinPrice = self.low
-        oMaxPrice = self.high
-        maxAmount = self.amount
-        maxValue  = self.value
-        cumulate  = self.cumulate
-        iv        = self.iv
-        # Get the decimal precision for currency
-        cPrec    = self._cPrec
-        bPrec    = D("0.00000001")
-        # Setup empty table
-        gen      = (i for i in json.iteritems() if i[0] not in ("asks","bids"))
-        table    = dict(( (key, value) for key, value in gen ))
-        if maxAmount: maxAmount = int(maxAmount / bPrec)
-        if maxValue:  maxValue  = int(maxValue / cPrec / bPrec)
-        if self.side:
-            if self.side == "asks":
-                table["bids"] = []
-            else:
-                table["asks"] = []
-        else:
-            table["gap"] = dict()
-            table["gap"]["upper"]     = json["asks"][0]["price"]
-            table["gap"]["upper_int"] = json["asks"][0]["price_int"]
-            table["gap"]["lower"]     = json["bids"][-1]["price"]
-            table["gap"]["lower_int"] = json["bids"][-1]["price_int"]
-        for side in self.__sides:
-            # Parse sides independently
-            orders = json[side]
-            # Read lowest and highest price of orders on current side
-            lowest  = int(orders[0][u"price_int"])
-            highest = int(orders[-1][u"price_int"])
-            # Convert minimum and maximum price from arguments to int
-            #  and check if any orders are within that range.
-            if oMinPrice == None: minPrice = None
-            else:
-                minPrice = int(oMinPrice / cPrec)
-                if minPrice > highest:
-                    # Argument input totally out of range, return empty
-                    table[side] = []
-                    continue
-                elif minPrice < lowest:
-                    # Adjust argument to range
-                    minPrice = lowest
-            if oMaxPrice == None: maxPrice = None
-            else:
-                maxPrice = int(oMaxPrice / cPrec)
-                if maxPrice < lowest:
-                    # Argument input totally out of range, return empty
-                    table[side] = []
-                    continue
-                elif maxPrice > highest:
-                    # Adjust argument to range
-                    maxPrice = highest
-            # Check wether argument input is within the range of
-            # the table returned from Mt.Gox.
-            if any(( steps,
-                     minPrice,
-                     maxPrice,
-                     maxAmount,
-                     maxValue,
-                     cumulate,
-                     iv )):
-                if any((minPrice, maxPrice)):
-                    # Get generator yielding orders within given pricerange.
-                    if minPrice == None: minPrice = lowest
-                    if maxPrice == None: maxPrice = highest
-                    orders = self._stripRange(
-                        orders,
-                        side,
-                        minPrice,
-                        maxPrice
-                        )
-                if any((maxAmount, maxValue)):
-                    # Filter orders from price and out, only keeping those
-                    #  that have either lower value or amount (cumulated).
-                    orders = self._processList(
-                        orders, side,
-                        precision = cPrec,
-                        cumulate  = False if steps else cumulate,
-                        maxAmount = maxAmount,
-                        maxValue  = maxValue,
-                        iv        = False if steps else iv
-                        )
-                elif not steps and any((iv, cumulate)):
-                    # If no other option is set except possibly min-/maxPrice,
-                    #  add value-item to orders and/or cumulate list.
-                    orders = self._processList(
-                        orders, side,
-                        precision = cPrec,
-                        cumulate  = cumulate,
-                        iv        = iv
-                        )
-                if steps:
-                    if any((maxAmount, maxValue, minPrice, maxPrice)) and orders:
-                        # Slice list into <steps> slices and then merge
-                        #  them into one order per slice.
-                        if any((maxAmount, maxValue)):
-                            if side == "asks":
-                                min = int( orders[0]["price_int"])
-                                max = int(orders[-1]["price_int"])
-                            else:
-                                min = int(orders[-1]["price_int"])
-                                max = int( orders[0]["price_int"])
-                        else:
-                            min = minPrice
-                            max = maxPrice
-                        orders = self._stepList(
-                            orders, side,
-                            min, max
-                            )
-                        # Flip back orderlist and resturn
-                        if side == "bids":
-                            try:
-                                # Reverse list from processList
-                                orders = reversed(orders)
-                            except TypeError:
-                                # Reverse generator from stripRange
-                                orders = list(orders)
-                                orders.reverse()
-                    else:
-                        # Grab speciefied amount of orders closest to price.
-                        if side == "asks":
-                            orders = orders[:steps]
-                        else:
-                            orders = orders[steps*-1:]
-                        if cumulate or iv:
-                            # Iterate and sum previous orders
-                            orders = self._processList(
-                                orders, side,
-                                precision = cPrec,
-                                cumulate  = cumulate,
-                                iv        = iv
-                                )
-                            # Flip back orderlist and resturn
-                            if side == "bids": orders = reversed(orders)
-                else:
-                    # Flip back orderlist and resturn
-                    if not isinstance(orders, list): orders = list(orders)
-                    if side == "bids": orders = reversed(orders)
-            table[side] = list(orders)
-        json = {
-                "return":table,
-                "result":"success"
-                }
-        return JsonParser.build(json) if raw else json
-
-    def _stepItemList(self, items, steps, kind="trades"):
-        u"Old stepList, but will work to step trades instead when creating" \
-        u" RSI and stuff."
-        if not hasattr(orders, "__delslice__"):
-            # Convert generator or tuple to lists, assume all objects that have
-            #  __delslice__ also has __getitem__ and __getslice__
-            orders = list(orders)
-        subs = list()
-        length = len(orders)
-        # Calculate volume of step and then adjust to whole integer
-        # Round to make sure no orders 
-        step = round( float(length) / steps ) * steps
-        if length/steps * steps >= length:
-            stepvolume = length / teps
-        else:
-            stepvolume = length/steps+1
-        while orders:
-            # Take slices of orderlist in stepvolume
-            subs.append(orders[0:stepvolume])
-            del orders[0:stepvolume]
-        else:
-            if not self.cumulate:
-                for step in subs:
-                    # Merge each slice of list to one order
-                    proc = self.getattr("_merge_{0}".format(kind))(*args)
-                    step = self._processList(
-                        step, side,
-                        precision = self._cPrec,
-                        cumulate  = True,
-                        iv        = iv
-                        )
-                    # Last order contains amount and value of earlier orders
-                    step          = step[-1]
-                    step["stamp"] = str(self.latestStamp)
-                    orders.append(step)
-            else:
-                # Merge each slice of list to one order while cumulating the
-                #  last layer being created
-                totalA = 0
-                totalV = 0
-                for step in subs:
-                    step = self._processList(
-                        step, side,
-                        precision = self._cPrec,
-                        cumulate  = True,
-                        iv        = iv
-                        )
-                    order   = step[-1]
-                    totalA  += int(order["amount_int"])
-                    totalV  += int(order["value_int"])
-                    # Cumulate orders
-                    order = self._manipulateOrder(
-                        order,
-                        amount_int = totalA,
-                        precision  = self._cPrec,
-                        iv         = totalV
-                        )
-                    orders.append(order)
-            return orders if side == "ask" else reversed(orders)
-
-    def _stepList(self, orders, side, min, max):
-        u"Slice a big list of orders and merge each slice to one order," + \
-        u" lists of bids needs to be reversed when passed as argument."
-        stepList = list()
-        if side == "asks":
-            stepvolume = (max - min) / self.steps
-            # Price increases for each ask
-            stepEnd = min + stepvolume
-            withinStep = lambda orderPrice: orderPrice <= stepEnd
-        else:
-            # Reverse if not allready done (roughly tuple/list, not generator)
-            if hasattr(orders, "__getitem__"):
-                if orders[-1] < orders[0]:
-                    orders = reversed(orders)
-            # Price decreases for each bid
-            stepvolume = (max - min) * -1 / self.steps
-            withinStep = lambda orderPrice: orderPrice >= stepEnd
-            stepEnd = max + stepvolume
-        if self.iv:
-            # Values included in orders
-            calcStep = lambda amount, orderAmount, orderPrice, value: \
-                ( amount + orderAmount , value + (orderAmount * orderPrice) )
-        else:
-            # Don't include value
-            calcStep = lambda amount, orderAmount, orderPrice, value: \
-                ( amount + orderAmount, False )
-        amount,value,stamp = 0,0,0
-        for order in orders:
-            orderPrice  = int(order["price_int"])
-            orderAmount = int(order["amount_int"])
-            orderStamp  = int(order["stamp"])
-            if withinStep(orderPrice):
-                # Return total amount and value of step
-                amount, value = calcStep(amount, orderAmount, orderPrice, value)
-                price         = orderPrice
-                # Replace stamp if this one is newer
-                if stamp < orderStamp: stamp = orderStamp
-            else:
-                stepList.append(
-                    self._manipulateOrder(
-                        dict(),
-                        price_int  = price,
-                        amount_int = amount,
-                        stamp      = stamp,
-                        precision  = self._cPrec,
-                        iv         = value
-                        )
-                    )
-                # Set Amount,Value,Stamp to this order's values
-                if not self.cumulate:
-                    amount, value = calcStep(0, orderAmount, orderPrice, 0)
-                stamp = orderStamp
-                # Set next step end
-                stepEnd += stepvolume
-        else:
-            if withinStep(price):
-                # Add step if orders has been parsed since last step was added
-                stepList.append(
-                    self._manipulateOrder(
-                        dict(),
-                        price_int  = price,
-                        amount_int = amount,
-                        stamp      = stamp,
-                        precision  = self._cPrec,
-                        iv         = value
-                        )
-                    )
-        return stepList
-
-    def _stripRange(self, orders, side, minPrice, maxPrice):
-        u"Strip list of all orders outside of the range between minPrice" + \
-        u" and maxPrice. All generator-objects is treated like they're"   + \
-        u" allready reversed when parsing bids."
-        if side == "asks":
-            # Allow all orders above minPrice
-            withinRange = lambda price: int(price) >= minPrice
-            # Break when iteration has reached order above maxPrice
-            breakPoint  = lambda price: int(price) >  maxPrice
-        else:
-            if hasattr(orders, "__getitem__"):
-                if orders[-1] < orders[0]:
-                    orders = reversed(orders)
-            # Allow all orders below maxPrice
-            withinRange = lambda price: int(price) <= maxPrice
-            # Break when iteration has reached order below minPrice
-            breakPoint  = lambda price: int(price) <  minPrice
-        # Iterate over list,
-        #  Asks: Low  -> High
-        #  Bids: High -> Low
-        for order in orders:
-            if withinRange(order[u"price_int"]):
-                if breakPoint(order[u"price_int"]):
-                    break
-                else:
-                    yield order
-
-    def _processList(self,
-            orders, side,
-            cumulate  = False,
-            precision = None,
-            maxAmount = False,
-            maxValue  = False,
-            iv        = False):
-        u"Iterates over orders. Adds value and/or cumulate amounts. If list" + \
-        u" is a generator it is bids being parsed the generator needs to"    + \
-        u" contain a reversed list."
-        latestStamp = 0
-        totalA  = 0
-        totalV  = 0
-        current = []
-        # Reverse bid-orders if not allready done or if object is a generator.
-        if side == "bids" and hasattr(orders, "__getitem__"):
-            if orders[1] < orders[0]:
-                orders = reversed(orders)
-        # Set up lambdas to get rid of some code when iterating over orders.
-        if iv:
-            # Generated orders will Include Values, ->
-            if cumulate:
-                # -> and also be cumulated.
-                lambda_add = lambda order, amount, totalA, value, totalV: \
-                    self._manipulateOrder(
-                        order,
-                        amount_int = totalA,
-                        precision  = precision,
-                        iv         = totalV
-                        )
-            else:
-                # -> but will not be cumulated.
-                lambda_add = lambda order, amount, totalA, value, totalV: \
-                    self._manipulateOrder(
-                        order,
-                        amount_int = amount,
-                        precision  = precision,
-                        iv         = value
-                        )
-        else:
-            # Generated orders will not include values, ->
-            if cumulate:
-                # -> but will be cumulated.
-                lambda_add = lambda order, amount, totalA, value, totalV: \
-                    self._manipulateOrder(
-                        order,
-                        amount_int = totalA,
-                        precision  = precision
-                        )
-            else:
-                # -> neither will they be cumulated.
-                lambda_add = lambda order, amount, totalA, value, totalV: \
-                    self._manipulateOrder(
-                        order,
-                        amount_int = amount,
-                        precision  = precision
-                        )
-        for order in orders:
-            # Read each order, decrementing by price if bids
-            if maxAmount and totalA > maxAmount: break
-            if maxValue and totalV > maxValue: break
-            amount = int(order[u"amount_int"])
-            price  = int(order[u"price_int"])
-            stamp  = int(order[u"stamp"])
-            value   = amount * price
-            # Increase total amount and total value in currency
-            totalA += amount
-            totalV += value
-            if stamp < latestStamp:
-                latestStamp = stamp
-            # Generate new order and append to (current) orders
-            order   = lambda_add(order, amount, totalA, value, totalV)
-            current.append(order)
-        self.latestStamp = latestStamp
-        return current
-
-    def _manipulateOrder(self, order,
-            price_int  = False,
-            amount_int = False,
-            stamp      = False,
-            precision  = False,
-            iv         = False):
-        u"Update existing order with new data such as price, amount or value."
-        bPrec = D("0.00000001")
-        if not any([price_int, amount_int, stamp, precision, iv]):
-            return order
-        if price_int:
-            # Converting price integer to decimal with proper length
-            if precision:
-                # Converting amount integer to decimal with proper length
-                price = D(price_int) * precision
-                price = price.quantize(precision)
-                # Saving as float for cjson encoding
-                order["price"]     = float(price)
-                order["price_int"] = price_int
-            else:
-                raise AttributeError("precision")
-        if amount_int:
-            # Converting amount integer to decimal with proper length
-            amount = D(amount_int) * bPrec
-            amount = amount.quantize(bPrec)
-            # Saving as float for cjson encoding
-            order["amount"]     = float(amount)
-            order["amount_int"] = str(amount_int)
-        if stamp:
-            # Replacing stamp
-            order["stamp"] = str(stamp)
-        if iv:
-            # Adds BTC value in currency to result
-            value = iv * precision * bPrec
-            value = value.quantize(precision)
-            order["value"]     = float(value)
-            order["value_int"] = int(iv)
-        return order
-
 class ActionHandler(object):
     def __init__(self):
         u"Handles arguments and additionally calls appropriate request and" \
@@ -3463,7 +2986,7 @@ class CmdHandler(ActionHandler):
     def run(self,sysargs):
         u"Launch command from CLI"
         self.opts,args = self._parser.parse_args(sysargs)
-        self.xml.read(self.opts.xml)
+        self.xml.refresh(self.opts.xml)
         if self.opts.help or self.opts.actions:
             self._proc_help(self.opts.help,args)
         else:
@@ -3521,6 +3044,20 @@ class CmdHandler(ActionHandler):
             else:
                 print result
 
+    def serve(self, sysargs, out):
+        u"Run a command line for the client stub, what run() prints goes" \
+        u" to the file object out as it is printed."
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = out
+        try:
+            try:
+                self.run(sysargs)
+            except SystemExit:
+                # OptionParser exits on invalid options
+                pass
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
     def _cli_help(self, opts, args):
         u"Show this help.\n"\
         u"help [command]\n"\
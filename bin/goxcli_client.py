@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# goxcli_client.py
+# Same arguments as goxcli.py, but the command is run by the goxcli service
+# (goxcli.py -s) that is already logged in, has the config parsed and its
+# connections to MtGox open, so a call takes milliseconds instead of seconds.
+# Only sockets and json are imported here. Without a service (or for the
+# interactive shell, -s, -k and activate) it runs goxcli.py itself. Once the
+# service has the command it is never run a second time here, even when
+# the answer does not arrive (it could have been an order).
+#
+# usage: goxcli_client.py [options] action [arguments]
+#   ie:  goxcli.py -s                   start the service once
+#        goxcli_client.py ticker
+#        goxcli_client.py -p depth steps=10
+
+import getpass
+import json
+import os
+import socket
+import sys
+import tempfile
+
+#written by the service (goxcli.SERVICE_FILE)
+SERVICE_FILE = os.path.join(tempfile.gettempdir(), "goxcli_%s.service" % getpass.getuser())
+LOCAL_OPTIONS = ("-s", "--service", "-k", "--kill-daemon")
+LOCAL_ACTIONS = ("activate",)
+
+
+def local(argv):
+    """run the full goxcli.py instead"""
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "goxcli.py")
+    os.execv(sys.executable, [sys.executable, script] + argv)
+
+def connect():
+    """a socket connected to the service, None if there is none"""
+    try:
+        with open(SERVICE_FILE, "r") as f:
+            where = json.load(f)
+        if "unix" in where:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            sock.settimeout(60)
+            sock.connect(where["unix"])
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(60)
+            sock.connect(("127.0.0.1", where["port"]))
+        return sock
+    except (IOError, ValueError, KeyError, socket.error):
+        return None
+
+def fail(message):
+    sys.stderr.write("goxcli service: %s\n" % message)
+    sys.exit(1)
+
+def receive(sock):
+    """write the output of the service to stdout as it comes. It is sent in
+    frames of "<length>\\n<data>", "0\\n" is the end of it and
+    "err:<message>\\n" means the command failed or broke off."""
+    buf = ""
+    while True:
+        while "\n" not in buf:
+            data = sock.recv(65536)
+            if not data:
+                fail("no answer" if not buf else "malformed answer")
+            buf += data
+        header, buf = buf.split("\n", 1)
+        if header.startswith("err:"):
+            sys.stdout.flush()
+            fail(header[4:])
+        try:
+            left = int(header)
+        except ValueError:
+            fail("malformed answer")
+        if not left:
+            break
+        while len(buf) < left:
+            data = sock.recv(65536)
+            if not data:
+                sys.stdout.write(buf)
+                fail("the answer broke off")
+            buf += data
+        sys.stdout.write(buf[:left])
+        sys.stdout.flush()
+        buf = buf[left:]
+
+def main(argv):
+    if not argv or [arg for arg in argv if arg in LOCAL_OPTIONS or arg in LOCAL_ACTIONS]:
+        local(argv)
+    sock = connect()
+    if sock is None:
+        local(argv)
+    try:
+        sock.send("cmd:" + json.dumps(argv))
+    except socket.error:
+        #nothing listening anymore
+        local(argv)
+    try:
+        receive(sock)
+    except socket.error as e:
+        sys.stderr.write("goxcli service: %s\n" % e)
+        sys.exit(1)
+    finally:
+        sock.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
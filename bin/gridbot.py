@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# gridbot.py
+# Runs the liquidbot grid (lib/gridengine.py) on MtGox or bitfloor.
+# On MtGox the fills come in over the streaming API and the replacement
+# order goes out right away, the REST order list is only checked every 2
+# minutes as a safety net. bitfloor has no order stream, its open orders
+# are checked every second instead.
+#
+# Usage: gridbot.py mtgox|bitfloor <center price> <interval %> <pairs> <amount>
+#   ie:  gridbot.py mtgox 120 1 3 0.1
+
+import sys
+import time
+from decimal import Decimal as D
+
+import gridengine
+import ledger
+
+def main():
+    if len(sys.argv) < 6:
+        print "Usage: gridbot.py mtgox|bitfloor <center price> <interval %> <pairs> <amount>"
+        return
+    venue_name = sys.argv[1]
+    center = D(sys.argv[2])
+    interval = D(sys.argv[3]) / 100
+    pairs = int(sys.argv[4])
+    amount = D(sys.argv[5])
+
+    fills_ledger = ledger.Ledger("ledger_gridbot_%s.led" % venue_name)
+    gox = None
+    if venue_name == "mtgox":
+        import mtgox_prof7bitapi
+        import mtgoxhmac
+        gox = mtgox_prof7bitapi.Gox(mtgox_prof7bitapi.Secret(), mtgox_prof7bitapi.GoxConfig())
+        venue = gridengine.GoxVenue(gox, rest=mtgoxhmac.Client())
+        grid = gridengine.GridEngine(venue, center, interval, pairs, amount, cPrec=D('0.00001'), ledger=fills_ledger)
+        safety = gridengine.Reconciler(grid, interval=120)
+    else:
+        import bitfloorapi
+        bitfloor = bitfloorapi.Client()
+        venue = gridengine.BitfloorVenue(bitfloor)
+        grid = gridengine.GridEngine(venue, center, interval, pairs, amount, cPrec=bitfloor.cPrec, ledger=fills_ledger)
+        safety = gridengine.Reconciler(grid, interval=1)
+    venue.connect(grid)
+    if gox:
+        gox.start()
+    grid.start()
+    safety.start()
+    try:
+        fills = 0
+        while True:
+            time.sleep(1)
+            if grid.fills != fills:
+                fills = grid.fills
+                print "fills: %d, last replacement sent %.1f ms after the fill" % (fills, (grid.reaction or 0) * 1000)
+                print "position: %s BTC @ %s, realised: %s, fees: %s" % (fills_ledger.position, fills_ledger.avgcost.quantize(D('0.00001')),
+                    fills_ledger.realised.quantize(D('0.00001')), fills_ledger.fees)
+    except KeyboardInterrupt:
+        print >> sys.stderr, "stopping, cancelling the grid"
+    safety.stop()
+    grid.stop()
+    time.sleep(1)
+    if gox:
+        gox.stop()
+    fills_ledger.close()
+
+if __name__ == "__main__":
+    main()
@@ -26,8 +26,16 @@ if os.name == 'nt':
 from book import *
 from common import *
 import depthparser
+import asynclog
 import mtgox_prof7bitapi
 import mtgoxhmac
+import retrypolicy
+import pricebuckets
+import tradearchive
+import tickerstore
+import latency
+import triggers
+import ordertracker
 
 mtgox = mtgoxhmac.Client()
 
@@ -35,27 +43,28 @@ bPrec = mtgox.bPrec
 cPrec = mtgox.cPrec
 
 threadlist = {}
-whenlist = []
+whenlist = {}            #trigger id -> {'command', 'oid'} of the when commands
+updown_triggers = []    #the above/below triggers of the updown range
+updown_range = []
 
 class LogWriter():
-    """connects to gox.signal_debug and logs it all to the logfile"""
+    """connects to gox.signal_debug and logs it all to the logfile. The
+    socket thread only queues the message, it is written in the background
+    (see lib/asynclog.py)"""
     def __init__(self, gox):
         self.gox = gox
-        logging.basicConfig(filename='goxtool.log'
-                           ,filemode='a'
-                           ,format='%(asctime)s:%(levelname)s %(message)s'
-                           ,level=logging.DEBUG
-                           )
-        console_logger = logging.getLogger('')
+        self.log = asynclog.AsyncLog('goxtool.log')
+        root_logger = logging.getLogger('')
+        root_logger.setLevel(logging.DEBUG)
+        root_logger.addHandler(asynclog.AsyncHandler(self.log))
         console = logging.StreamHandler()
         console.setLevel(logging.INFO)
-        console_logger.addHandler(console)        
+        root_logger.addHandler(console)        
         self.gox.signal_debug.connect(self.slot_debug)
 
     def close(self):
         """stop logging"""
-        #not needed
-        pass
+        self.log.close()
 
     # pylint: disable=R0201
     def slot_debug(self, sender, (msg)):
@@ -63,37 +72,69 @@ class LogWriter():
         if "https://data.mtgox.com/api/2/money/order/lag" in msg:
             return
         else:
-            logging.debug("%s:%s", sender.__class__.__name__, msg)       #change this to .info to see the messages on screen.
+            self.log.debug(sender.__class__.__name__, "%s:%s", sender.__class__.__name__, msg)
 
 
+# data partial path directory
+fullpath = os.path.dirname(os.path.realpath(__file__))
+if ".exe" in sys.argv[0]:
+    partialpath=os.path.join(fullpath + '\\data\\')
+elif os.name == 'nt':
+    partialpath=os.path.join(fullpath + '\\..\\data\\')
+else:
+    partialpath=os.path.join(fullpath + '/../data/')
+
 config = mtgox_prof7bitapi.GoxConfig()
 secret = mtgox_prof7bitapi.Secret()
 secret.decrypt(mtgox.enc_password)
 gox = mtgox_prof7bitapi.Gox(secret, config)
 logwriter = LogWriter(gox)
 logging.debug("### Initializing the mtgox_client.")
-gox.start()
 socketbook = gox.orderbook
-def request_socketbook():
+#start with the book of the last session while the fulldepth downloads, it
+#is saved every 5 minutes and on exit (see OrderBook.load_snapshot)
+socketbook.load_snapshot(os.path.join(partialpath + 'mtgox_book.snap'))
+socketbook.checkpoint(os.path.join(partialpath + 'mtgox_book.snap'))
+gox.start()
+#the when/stoploss/updown/balancenotifier conditions, all checked on the
+#streamed ticker, trades, user orders and wallet (see lib/triggers.py)
+triggerengine = triggers.TriggerEngine()
+triggerengine.connect(gox)
+#our open orders, kept up to date by the user_order stream, the REST order
+#list is only diffed against it every 5 minutes (see lib/ordertracker.py)
+tracker = ordertracker.OrderTracker("mtgox")
+tracker.connect(gox)
+tracker.start(lambda: mtgox.get_orders()['orders'], ordertracker.from_mtgox, interval=300)
+bookbuckets = pricebuckets.BookBuckets(socketbook)    #cached per socketbook.version
+def request_socketbook(provisional=False):
     if not socketbook.fulldepth_time == 0:
         fdtdelta = str(time.time() - socketbook.fulldepth_time)+" ago."
     else:
         fdtdelta = "never."
     print "Starting to download fulldepth from MtGox. (Last updated: %s)...." % (fdtdelta),
-    while socketbook.fulldepth_downloaded == False:
-        time.sleep(0.1)
+    if provisional:
+        while not socketbook.wait(provisional=True, timeout=1):
+            socketbook.refresh(0)       #the first request failed, ask again
+        if socketbook.provisional:
+            print "Using the saved book of %d seconds ago until it is downloaded." % (time.time() - socketbook.snapshot_time)
+            return
+    else:
+        while gox.client.fulldepth_pending():
+            time.sleep(0.1)
+        if socketbook.fulldepth_time < gox.client.fulldepth_started:
+            print "Failed."
+            return
     print "Finished."
-request_socketbook()
+request_socketbook(provisional=True)
 
 
-# data partial path directory
-fullpath = os.path.dirname(os.path.realpath(__file__))
-if ".exe" in sys.argv[0]:
-    partialpath=os.path.join(fullpath + '\\data\\')
-elif os.name == 'nt':
-    partialpath=os.path.join(fullpath + '\\..\\data\\')
-else:
-    partialpath=os.path.join(fullpath + '/../data/')
+#every streamed ticker goes to the ticker store (see lib/tickerstore.py),
+#the old json ticker log is taken over the first time
+tickers = tickerstore.TickerStore(os.path.join(partialpath + 'mtgox_ticker.tks'))
+if not len(tickers) and os.path.isfile(os.path.join(partialpath + 'mtgox_ticker.txt')):
+    tickerstore.import_json_lines(tickers, os.path.join(partialpath + 'mtgox_ticker.txt'))
+tickerrecorder = tickerstore.TickerRecorder(tickers)
+tickerrecorder.connect(gox)
 
 
 """
@@ -106,7 +147,7 @@ def decideto():
 def refreshbook(maxage=180):
     #get the FULL depth (current trade order) (API 2,gzip)
     depthvintage,fulldepth = updatedepthdata(mtgox,maxage)
-    entirebook = Book.parse(fulldepth["data"],goxfulldepth=True)
+    entirebook = Book.parse(fulldepth["data"],goxfulldepth=True,cPrec=cPrec,bPrec=bPrec)   #integer mode
     entirebook.sort()      #sort it
     return entirebook
 def printorderbookapi0(length=15):
@@ -208,6 +249,9 @@ class Shell(cmd.Cmd):
         for k,v in threadlist.iteritems():
             v.set()
             threads = True
+        if triggerengine.triggers():
+            triggerengine.cancel_all()
+            threads = True
         if threads:
             print "Shutting down threads..."        
 
@@ -224,6 +268,10 @@ class Shell(cmd.Cmd):
                 self.do_exit(self)
                 return
             self.cmdloop()
+        except (retrypolicy.GaveUp, retrypolicy.CircuitOpen) as e:
+            #mtgoxhmac gave up (Uncertain: an order that may be out, look at your orders)
+            print e
+            self.cmdloop()
         except:                     #catch every exception!
             traceback.print_exc()
             self.cmdloop()
@@ -305,50 +353,45 @@ class Shell(cmd.Cmd):
 
 
     def do_balancenotifier(self,args):
-        """Check your balance every 30 seconds and BEEP and print something out when you receive the funds (either btc or usd)"""
-        def bn(firstarg,notifier_stop,btc,usd):
-            while(not notifier_stop.is_set()):
-                btcnew,usdnew = bal()
-                if btcnew > btc or usdnew > usd:
-                    last = D(mtgox.get_tickerfast()['last']['value'])
-                    print '\nBalance: %s BTC + $%s USD = $%.5f @ $%.5f (Last)' % (btcnew,usdnew,(btcnew*last)+usdnew,last)
-                    for x in xrange(0,3):
-                        if os.name == 'nt':
-                            winsound.Beep(1200,1000)
-                            winsound.Beep(1800,1000)
-                        else:
-                            print '\a\a'
-                    btc,usd = btcnew,usdnew
-                notifier_stop.wait(30)
+        """BEEP and print something out when you receive funds (either btc or usd), checked on every wallet update of the stream"""
+        def bn(wallet):
+            btcnew = D(wallet.get('BTC',0))/D(1E8)
+            usdnew = D(wallet.get('USD',0))/D(1E5)
+            if btcnew > balances[0] or usdnew > balances[1]:
+                last = D(mtgox.get_tickerfast()['last']['value'])
+                print '\nBalance: %s BTC + $%s USD = $%.5f @ $%.5f (Last)' % (btcnew,usdnew,(btcnew*last)+usdnew,last)
+                for x in xrange(0,3):
+                    if os.name == 'nt':
+                        winsound.Beep(1200,1000)
+                        winsound.Beep(1800,1000)
+                    else:
+                        print '\a\a'
+            balances[:] = [btcnew,usdnew]
 
         try:
-            global notifier_stop
-            btc,usd = bal()
+            global notifier_trigger
             args = stripoffensive(args)
             args = args.split()
             if 'exit' in args:
-                print "Shutting down background thread..."
-                notifier_stop.set()
+                print "Shutting down balance notifier..."
+                triggerengine.cancel(notifier_trigger.tid)
             else:   
-                notifier_stop = threading.Event()
-                threadlist["balancenotifier"] = notifier_stop
-                notifier_thread = threading.Thread(target = bn, args=(None,notifier_stop,btc,usd))
-                notifier_thread.daemon = True
-                notifier_thread.start()
+                balances = list(bal())
+                notifier_trigger = triggerengine.add_wallet(bn, "balancenotifier")
         except Exception as e:
             traceback.print_exc()
             print "An error occurred."
             self.onecmd('help balancenotifier')
 
-
     def do_book(self,length):
         """Uses the constantly updated data from the websocket/socket.io depth/trades/ticker channels\n""" \
         """usage: book [length]"""
         try:
-            vintage = (time.time() - socketbook.fulldepth_time)
-            if vintage > 300:
-                gox.client.request_fulldepth()
+            #a provisional book is not waited for, it is shown until the fulldepth is in
+            if socketbook.refresh(300) and not socketbook.provisional:
                 request_socketbook()
+            if socketbook.provisional:
+                print "(provisional: the saved book of %d seconds ago plus the live updates since)" % (time.time() - socketbook.snapshot_time)
             length = stripoffensive(length)
             length = int(length)
 
@@ -377,56 +420,25 @@ class Shell(cmd.Cmd):
             minprice = D(raw_input("Min Price: "))
             maxprice = D(raw_input("Max Price: "))
             grouping = D(raw_input("Price Grouping: "))
-        askcumu = 0 ; bidcumu = 0
-        totalaskcumu = 0; totalbidcumu = 0
-
-        print "-"*20,"ASKS:","-"*20
-        print "Price(USD)\t  Amount(BTC)\t\tSum(Total)"
-        print "-"*45
-        reachedlastask = False ; lastprice = None
-        for ask in socketbook.asks:
-            askcumu += D(ask.volume / (1/bPrec))
-            price = D(ask.price / (1/cPrec))
-            if price > minprice and price < maxprice:
-                if price % grouping == 0:
-                    totalaskcumu += askcumu
-                    print "%10s\t%14s\t%16s" % (price,askcumu,totalaskcumu)
-                    askcumu = 0
-            else:
-                reachedlastask = True
-            if reachedlastask == True:
-                if not lastprice:
-                    lastprice = price
-                    askcumu = 0
-                totalaskcumu += askcumu         
-        print "%10s+\t%14s\t%16s" % (lastprice,askcumu,totalaskcumu) 
-
-        print "-"*20,"BIDS:","-"*20
-        print "Price(USD)\t  Amount(BTC)\t\tSum(Total)"
-        print "-"*45
-        reachedlastbid = False ; lastprice = None
-        for bid in socketbook.bids:
-            bidcumu += D(bid.volume / (1/bPrec))
-            price = D(bid.price / (1/cPrec))
-            if price > minprice and price < maxprice:
-                if price % grouping == 0:
-                    totalbidcumu += bidcumu
-                    print "%10s\t%14s\t%16s" % (price,bidcumu,totalbidcumu)
-                    bidcumu = 0
-            else:
-                reachedlastbid = True
-            if reachedlastbid == True:
-                if not lastprice:
-                    lastprice = price
-                    bidcumu = 0
-                totalbidcumu += bidcumu  
-        print "%10s-\t%14s  %16s" % (lastprice,bidcumu,totalbidcumu)
-
-
+        low = int(minprice / cPrec)
+        high = int(maxprice / cPrec)
+        width = int(grouping / cPrec)
+        for side,title in (("asks","ASKS:"),("bids","BIDS:")):
+            print "-"*20,title,"-"*20
+            print "Price(USD)\t  Amount(BTC)\t\tSum(Total)"
+            print "-"*45
+            for bucket in bookbuckets.fixed(side,width,low,high):
+                print "%10s\t%14s\t%16s" % (D(bucket.price)*cPrec,D(bucket.volume)*bPrec,D(bucket.total)*bPrec)
+            #everything beyond the range in one row, ie: "150.1+" for asks, "49.9-" for bids
+            rest = bookbuckets.beyond(side,low,high)
+            if rest:
+                print "%10s%s\t%14s\t%16s" % (D(rest.price)*cPrec,"+" if side == "asks" else "-",
+                                              D(rest.volume)*bPrec,D(rest.total)*bPrec)
 
     def do_bookrefresh(self,length):
         """Refresh a new copy of the entire order book and then run the 'book' command to print it."""
-        gox.client.request_fulldepth()
+        if not gox.client.fulldepth_pending():
+            gox.client.request_fulldepth()
         request_socketbook()
         self.onecmd('book')
 
@@ -699,23 +711,25 @@ class Shell(cmd.Cmd):
                     elif str(numorder) in orderlist:
                         cancel = True
                     if cancel == True:
+                        #the cancel would look like a fill to the when fulfil triggers
+                        for wid,when in whenlist.items():
+                            if when.get('oid') == order['oid'] and triggerengine.cancel(wid):
+                                print 'Removed dependent when command'
+                        tracker.cancel_requested(order['oid'])
                         result = mtgox.cancel_one(order['oid'])
                         if result:
                             numcancelled += 1
-                            for wid,when in enumerate(whenlist):
-                                if 'oid' in when and when['oid'] == order['oid']:
-                                    when['stop'].set()
-                                    print 'Removed dependent when command'
         except Exception as e:
             print e
 
     def do_cancelall(self,args):
         """Cancel every single order you have on the books"""
-        mtgox.cancel_all()
-        for wid,when in enumerate(whenlist):
-            if 'oid' in when:
+        for wid,when in whenlist.items():
+            if when.get('oid') and triggerengine.cancel(wid):
                 print 'Removed dependent when command'
-                when['stop'].set()
+        for order in tracker.open_orders():
+            tracker.cancel_requested(order.oid)
+        mtgox.cancel_all()
 
     def do_depth(self,args):
         """Shortcut for the 2 depth functions in common.py\n""" \
@@ -755,7 +769,45 @@ class Shell(cmd.Cmd):
         lag = mtgox.lag()
         print "Current order lag is %r seconds. Queue length is: %s" % (lag['lag_secs'],lag['length'])
 
-    
+
+    def do_latency(self,args):
+        """Shows percentiles of the time (microseconds) from a socket frame arriving to each stage\n""" \
+        """(decode, route, book, strategy, encode, write), tick_to_trade and the ack of our calls\n""" \
+        """usage: latency                show them\n""" \
+        """       latency reset          start counting again\n""" \
+        """       latency save [file]    write them to a file (default data/latency.json)\n""" \
+        """       latency load <file>    show the ones of a saved file"""
+        args = stripoffensive(args,r'/\\_\-:').split()
+        try:
+            if not args:
+                print latency.recorder.report()
+                print "since %s" % datetime.datetime.fromtimestamp(latency.recorder.started).strftime("%Y-%m-%d %H:%M:%S")
+            elif args[0] == "reset":
+                latency.recorder.reset()
+                print "Latency histograms were reset."
+            elif args[0] == "save":
+                filename = args[1] if len(args) > 1 else os.path.join(partialpath + 'latency.json')
+                latency.recorder.export(filename)
+                print "Saved to %s" % filename
+            elif args[0] == "load" and len(args) > 1:
+                print latency.report(latency.load(args[1]))
+            else:
+                self.onecmd('help latency')
+        except (IOError, ValueError) as e:
+            print e
+
+    def do_feed(self,args):
+        """Shows the health of the streaming feeds (socketio and the websocket backup), per channel:\n""" \
+        """message count, messages/second, gaps between messages, time since the last one,\n""" \
+        """the lag MtGox reports, the skew (our clock minus the stamp of the message) and the delay\n""" \
+        """(the skew without the clock offset, see the exchange clock line at the bottom), in ms\n""" \
+        """usage: feed"""
+        print gox.feedmonitor.report()
+        print "exchange clock:", gox.feedmonitor.clock.report()
+        print "stall window %.2fs (or %g times the p99.9 gap), monitoring since %s" % (gox.feedmonitor.window, gox.feedmonitor.factor,
+            datetime.datetime.fromtimestamp(gox.feedmonitor.started).strftime("%Y-%m-%d %H:%M:%S"))
+
+
     def do_obip(self, args):
         """Calculate the "order book implied price", by finding the weighted\n""" \
         """average price of coins <width> BTC up and down from the spread.\n""" \
@@ -805,33 +857,32 @@ class Shell(cmd.Cmd):
         """Print a list of all your open orders, including pending and lacking enough funds"""
         try:
             args = stripoffensive(args)
-            orders = mtgox.get_orders()['orders']
-            orders = sorted(orders, key=lambda x: float(x['price']))
+            if not tracker.synced.wait(30):
+                print "The order list has not been downloaded yet."
+                return
             buytotal,selltotal = 0,0
             numbuys,numsells = 0,0
             amtbuys,amtsells = 0,0
             buyavg,sellavg = 0,0
             numorder = 0
-            for order in orders:
-                ordertype="Sell" if order['type'] == 1 else "Buy"
+            for order in tracker.open_orders():
+                ordertype="Sell" if order.side == 'ask' else "Buy"
                 numorder += 1
-                if order['status'] == 1:
-                    OPX = 'O'
-                elif order['status'] == 2:
+                if order.state == ordertracker.PENDING or order.status in (2,'invalid'):
                     OPX = 'P'
-                elif order['status'] == 0:
-                    OPX = 'X'
-                else:
+                elif order.state == ordertracker.PARTIAL:
                     OPX = '|'
-                print '%3s = %4s %s $%9s @ %12s BTC %s' % (numorder,ordertype,OPX,order['price'],order['amount'],order['oid'])
-                if order['type'] == 2:
-                    buytotal += D(order['price'])*D(order['amount'])
+                else:
+                    OPX = 'O'
+                print '%3s = %4s %s $%9s @ %12s BTC %s' % (numorder,ordertype,OPX,order.price,order.remaining,order.oid)
+                if order.side == 'bid':
+                    buytotal += order.price*order.remaining
                     numbuys += D('1')
-                    amtbuys += D(order['amount'])
-                elif order['type'] == 1:
-                    selltotal += D(order['price'])*D(order['amount'])
+                    amtbuys += order.remaining
+                else:
+                    selltotal += order.price*order.remaining
                     numsells += D('1')
-                    amtsells += D(order['amount'])
+                    amtsells += order.remaining
             if amtbuys:
                 buyavg = D(buytotal/amtbuys).quantize(cPrec)
             if amtsells:
@@ -843,24 +894,37 @@ class Shell(cmd.Cmd):
 
 
     def do_readtickerlog(self,numlines=15):
-        """Prints the last X lines of the mtgox ticker log file"""
+        """Prints the last X records of the mtgox ticker store"""
         """Usage: readtickerlog <numlines>"""
         try:
             numlines = stripoffensive(numlines)
             numlines = int(numlines)
-            with open(os.path.join(partialpath + 'mtgox_ticker.txt'),'r') as f:
-                s = tail(f,numlines)
-            print s
-            l = s.splitlines()
-            for x in l: pass
-            j = json.loads(x)
-            tickertime = j['time']
-            print "Last ticker was:",datetime.datetime.fromtimestamp(tickertime).strftime("%Y-%m-%d %H:%M:%S")
+            ticks = tickers.tail(numlines)
+            for t in ticks:
+                print "%s  bid: %.5f  ask: %.5f  last: %.5f  vol: %.8f" % (datetime.datetime.fromtimestamp(t.stamp/1E6).strftime("%Y-%m-%d %H:%M:%S"),
+                    t.bid/1E5, t.ask/1E5, t.last/1E5, t.volume/1E8)
+            if ticks:
+                print "Last ticker was:",datetime.datetime.fromtimestamp(ticks[-1].stamp/1E6).strftime("%Y-%m-%d %H:%M:%S")
             print "Current time is:",datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         except ValueError as e:
             self.onecmd('help readtickerlog')
 
 
+    def do_tickerohlc(self,args):
+        """Prints open/high/low/close candles of the last price from the ticker store"""
+        """Usage: tickerohlc <hours back> <minutes per candle>"""
+        try:
+            args = stripoffensive(args)
+            hours, minutes = floatify(args.split())
+            end = tickerstore.now()
+            start = end - int(hours*3600*1E6)
+            for c in tickers.ohlc(start, end, int(minutes*60*1E6)):
+                print "%s  O: %.5f  H: %.5f  L: %.5f  C: %.5f  vol: %.8f" % (datetime.datetime.fromtimestamp(c.stamp/1E6).strftime("%Y-%m-%d %H:%M"),
+                    c.open/1E5, c.high/1E5, c.low/1E5, c.close/1E5, c.volume/1E8)
+        except ValueError as e:
+            self.onecmd('help tickerohlc')
+
+
     def do_readtradehist24h(self,args):
         """reading trade history data from a file and gathering stats on it"""
         import tradehistory
@@ -885,53 +949,39 @@ class Shell(cmd.Cmd):
       #Finished. Works.
         """Usage: stoploss <amount of position> <avg position price> <percent willing to accept>\n""" \
         """   ie: stoploss 13.88512098 136.50 95"""
-        def stoplossbot(firstarg,stop_event,amount,price,percent):
+        def sold(oid):
+            response = mtgox.get_ask_history(oid)
+            if not(response["result"] == "error"):
+                avgprice = response['return']['avg_cost']['display']
+                print "\n%s Sold with stop-loss @of c %s\n" % (oid,avgprice)
+        def stoplossbot(last):
+            order = mtgox.order_new('ask',amount,protection=False)
             try:
-                found = False
-                percent = percent / D('100')
-                while(not stop_event.is_set()):
-                    last = D(socketbook.ask)/D(1E5)
-                    if last < price*percent:
-                        order = mtgox.order_new('ask',amount,protection=False)
-                        lag = mtgox.lag()['lag_secs']
-                        while found == False:
-                            stop_event.wait(lag)
-                            response = mtgox.get_ask_history(order['data'])
-                            if not(response["result"] == "error"):
-                                found = True
-                        avgprice = response['return']['avg_cost']['display']
-                        print "\n%s Sold with stop-loss @of c %s\n" % (order['data'],avgprice)
-                        stop_event.set()
-                    stop_event.wait(2)
+                triggerengine.add_fulfil(order['data'], sold, "stoploss order %s" % order['data'])
             except Exception as e:
-                try:    #DEBUGGING ONLY
-                    print "Order was: ", order, "Result was: ", result
-                except:
-                    traceback.print_exc()
-                    print "An error occurred."
-                    self.onecmd('help stoploss')
+                print "Order was: ", order
+                traceback.print_exc()
 
         try:
-            global stopbot_stop
+            global stoploss_trigger
             args = stripoffensive(args)
             args = args.split()
-            newargs = tuple(decimalify(args))
             if 'exit' in args:
-                print "Shutting down background thread..."
-                stopbot_stop.set()
+                print "Shutting down stop-loss..."
+                triggerengine.cancel(stoploss_trigger.tid)
             else:
-                stopbot_stop = threading.Event()
-                threadlist["stopbot"] = stopbot_stop
-                args = (None,stopbot_stop) + newargs
-                stopbot_thread = threading.Thread(target = stoplossbot, args=args)
-                stopbot_thread.daemon = True
-                stopbot_thread.start()
+                amount,price,percent = tuple(decimalify(args))
+                percent = percent / D('100')
+                stoploss_trigger = triggerengine.add_price("ask", "<", scaleint(price*percent,5), stoplossbot,
+                                                           "stoploss %s BTC below $%s" % (amount,price*percent))
         except Exception as e:
             traceback.print_exc()
             print "An error occurred."
             self.onecmd('help stoploss')
 
 
+
+
     def do_ticker(self,arg):
         """Print the entire ticker out or use one of the following options:\n""" \
         """usage: ticker [buy|sell|last|high|low|vol|vwap|avg] """
@@ -1005,72 +1055,77 @@ class Shell(cmd.Cmd):
             json.dump(eth,f)
             f.close()
             print "Finished."
+        added = tradearchive.TradeArchive("mtgox").append(tradearchive.from_mtgox(eth["data"]))
+        print "%s new trades were added to the trade archive." % added
 
 
     def do_updown(self,args):
         """Logs ticker to file, spits out an alert and beeps if last price is above or below the range given\n""" \
         """Range window is modified and readjusted\n""" \
-        """NOTE: RUNS AS A BACKGROUND PROCESS!!!!!!\n""" \
+        """NOTE: RUNS IN THE BACKGROUND (on every trade of the stream)!!!!!!\n""" \
         """usage: updown <low> <high>\n""" \
         """Shutdown: updown exit  """
-        def tickeralert(firstarg,tickeralert_stop):
-            try:
-                low, high = floatify(args.split())
-            except Exception as e:
-                print "You need to give a high and low range: low high"
-            #Log lastprice to the ticker log file
-            with open(os.path.join(partialpath + 'mtgox_ticker.txt'),'a') as f:
-                while(not tickeralert_stop.is_set()):
-                    ticker = mtgox.get_tickerfast()
-                    last = float(ticker['last']['value'])
-                    text = json.dumps({"time":time.time(),"lastprice":last})
-                    f.write(text)
-                    f.write("\n")
-                    f.flush()
-                    if last > low and last < high:
-                        #last falls between given variance range, keep tracking
-                        pass
-                    elif last >= high:
-                        print "ALERT!! Ticker has risen above range %s-%s. Price is now: %s" % (low,high,last)
-                        for x in range(2,25):           #ascending beeps
-                            if os.name == 'nt':
-                                winsound.Beep(x*100,90)  #frequency(Hz),duration(ms)
-                            else:
-                                print '\a\a\a\a\a\a'
-                        low = high - 0.5
-                        high = low + 3
-                        #decideto()
-                        #lowsell = low*(1+txfee*2)
-                        #spread('mtgox',mtgox,'sell', 1, lowsell, lowsell+1, 3)
-                        print "New range is: %s-%s" % (low,high)
-                    elif last == low or last == high:
-                        print "ALERT!! Ticker is exactly on the boundary of %s" % (last)
-                    else:
-                        print "ALERT!! Ticker has fallen below range %s-%s. Price is now: %s" % (low,high,last)
-                        for x in range(25,2,-1):        #descending beeps
-                            if os.name == 'nt':
-                                winsound.Beep(x*100,90)  #frequency(Hz),duration(ms)
-                            else:
-                                print '\a\a\a\a\a\a'
-                        high = low + 1
-                        low = high -3
-                        #decideto()
-                        #spread('mtgox',mtgox,'buy', 1, low+1, high-1, 5)
-                        print "New range is: %s-%s" % (low,high)
-                    tickeralert_stop.wait(40)
+        def logprice(last):
+            #Log lastprice to the ticker store
+            tickerrecorder.record(scaleint(last,5))
+        def arm(low,high):
+            updown_triggers[:] = [triggerengine.add_price("last", ">", scaleint(high,5), risen, "updown above %s" % high),
+                                  triggerengine.add_price("last", "<", scaleint(low,5), fallen, "updown below %s" % low)]
+            updown_range[:] = [low,high]
+        def risen(last_int):
+            low,high = updown_range
+            for t in updown_triggers:
+                triggerengine.cancel(t.tid)
+            last = last_int/1E5
+            logprice(last)
+            print "ALERT!! Ticker has risen above range %s-%s. Price is now: %s" % (low,high,last)
+            for x in range(2,25):           #ascending beeps
+                if os.name == 'nt':
+                    winsound.Beep(x*100,90)  #frequency(Hz),duration(ms)
+                else:
+                    print '\a\a\a\a\a\a'
+            low = high - 0.5
+            high = low + 3
+            #decideto()
+            #lowsell = low*(1+txfee*2)
+            #spread('mtgox',mtgox,'sell', 1, lowsell, lowsell+1, 3)
+            print "New range is: %s-%s" % (low,high)
+            arm(low,high)
+        def fallen(last_int):
+            low,high = updown_range
+            for t in updown_triggers:
+                triggerengine.cancel(t.tid)
+            last = last_int/1E5
+            logprice(last)
+            print "ALERT!! Ticker has fallen below range %s-%s. Price is now: %s" % (low,high,last)
+            for x in range(25,2,-1):        #descending beeps
+                if os.name == 'nt':
+                    winsound.Beep(x*100,90)  #frequency(Hz),duration(ms)
+                else:
+                    print '\a\a\a\a\a\a'
+            high = low + 1
+            low = high -3
+            #decideto()
+            #spread('mtgox',mtgox,'buy', 1, low+1, high-1, 5)
+            print "New range is: %s-%s" % (low,high)
+            arm(low,high)
 
         try:
-            global tickeralert_stop
             args = stripoffensive(args)
             if args == 'exit':
-                print "Shutting down background thread..."
-                tickeralert_stop.set()
+                print "Shutting down updown..."
+                for t in updown_triggers:
+                    triggerengine.cancel(t.tid)
             else:
-                tickeralert_stop = threading.Event()
-                threadlist["tickeralert"] = tickeralert_stop
-                tickeralert_thread = threading.Thread(target = tickeralert, args=(None,tickeralert_stop))
-                tickeralert_thread.daemon = True
-                tickeralert_thread.start()
+                try:
+                    low, high = floatify(args.split())
+                except Exception as e:
+                    print "You need to give a high and low range: low high"
+                    return
+                for t in updown_triggers:
+                    triggerengine.cancel(t.tid)
+                logprice(float(mtgox.get_tickerfast()['last']['value']))
+                arm(low,high)
         except Exception as e:
             traceback.print_exc()
             print "An error occurred."
@@ -1083,96 +1138,67 @@ class Shell(cmd.Cmd):
         """(cancel a dependent command): when cancel (#DEP)\n""" \
         """(cancel all dependent commands): when cancel\n""" \
         """(list dependent commands): when"""
-        #dependent test function 1 
-        def test_askbidlast(askbidlast,oper,usd,*args):
-            breach = False; value = None; message = ""
+        #the current value, from the stream if it has sent one yet
+        def current(askbidlast):
+            if triggerengine.last[askbidlast] is not None:
+                return D(triggerengine.last[askbidlast])/D(1E5)
             ticker = mtgox.get_tickerfast()
             key={"ask":"sell","bid":"buy","last":"last"}
-            usd = D(usd)
-            value = D(ticker[key[askbidlast]]['value'])
-            if oper == '<' and value < usd: 
-                breach = True
-            elif oper == '>' and value > usd: 
-                breach = True
-            command = ' '.join(args)
-            if breach:
-                message = "Dependent action: Ticker breach: %s %s (threshold %s %s): Executing %s" % (askbidlast,value,oper,usd,command)
-            return (breach,command,message)
-        #dependent test function 2
-        def test_fulfill(fulfill,oid,*args):
-            breach = True; message = ""
-            whenlist[wid]['oid'] = oid
-            orders = mtgox.get_orders()['orders']
-            orders = sorted(orders, key=lambda x: float(x['price']))
-            for order in orders:
-                if oid == order['oid']:
-                    breach = False
-            command = ' '.join(args)
-            if breach:
-                message = "Dependent action: Order fulfilled: %s: Executing %s" % (oid,command)
-            return (breach,command,message)
-
-        #thread function
-        def when_bot(firstarg,wid,stop_event,test,delay,*args):
-            try:
-                while not stop_event.is_set():
-                    (breach, command,message) = test(*args)
-                    if breach:
-                        print message
-                        self.onecmd(command)
-                        stop_event.set()
-                    if not stop_event.is_set():
-                        stop_event.wait(delay)
-            except Exception as e:
-                traceback.print_exc()
-                print "An error occurred in the thread."
-                self.onecmd('help when')
-            del whenlist[wid]
+            return D(ticker[key[askbidlast]]['value'])
+        #runs the command once the trigger fires
+        def execute(message,command,convert=None):
+            def action(value):
+                if convert:
+                    value = convert(value)
+                print message % value
+                self.onecmd(command)
+            return action
 
         #main function body
         try:
-            global when_stop
             args = stripoffensive(args,"<>\-")
             args = args.split()
             if len(args) == 0:
-                for wid,when in enumerate(whenlist):
-                    print '%d: %s' % (wid, when['command'])
+                for t in triggerengine.triggers():
+                    if t.tid in whenlist:
+                        print '%d: %s' % (t.tid, whenlist[t.tid]['command'])
             elif 'exit' in args[0] or 'cancel' in args[0] and len(args) == 1:
-                for wid,when in enumerate(whenlist):
-                    print 'Cancelled: %d: %s' % (wid, when['command'])
-                    when['stop'].set()
+                for wid,when in sorted(whenlist.items()):
+                    if triggerengine.cancel(wid):
+                        print 'Cancelled: %d: %s' % (wid, when['command'])
+                whenlist.clear()
             elif 'cancel' in args[0] and len(args) == 2:
                 cwid = int(args[1])
-                when = whenlist[cwid]
-                print 'Cancelled: %d: %s' % (cwid, when['command'])
-                when['stop'].set()
+                if triggerengine.cancel(cwid):
+                    print 'Cancelled: %d: %s' % (cwid, whenlist.pop(cwid)['command'])
             else:
+                oid = None
                 if args[0] in ('ask','bid','last'):
-                    test = test_askbidlast
-                    delay = 2
+                    askbidlast,oper,usd = args[0],args[1],D(args[2])
+                    command = ' '.join(args[3:])
+                    value = current(askbidlast)
+                    breach = (oper == '<' and value < usd) or (oper == '>' and value > usd)
+                    message = "Dependent action: Ticker breach: %s %%s (threshold %s %s): Executing %s" % (askbidlast,oper,usd,command)
+                    action = execute(message, command, lambda value: D(value)/D(1E5))
                 elif args[0] in ('fulfil','fulfill'): 
-                    test = test_fulfill
-                    delay = 30
+                    oid = args[1]
+                    command = ' '.join(args[2:])
+                    tracker.synced.wait(30)
+                    breach = tracker.get(oid) is None or not tracker.get(oid).live()
+                    message = "Dependent action: Order fulfilled: %s: Executing " + command
+                    action = execute(message, command)
 
-                (breach,command,message) = test(*args)
                 if breach:
                     print 'Error: Dependency is already breached! (or order not found)' 
                     anyway = prompt("Execute command anyway?",False)
                     if anyway:
                         self.onecmd(command)
                 else:
-                    whenbot_stop = threading.Event()
-                    threadlist["whenbot"] = whenbot_stop
-                    wid = len(whenlist)
-                    targs = (None,wid,whenbot_stop,test,delay) + tuple(args)
-                    when_thread = threading.Thread(target = when_bot, args=targs)
-                    when_thread.daemon = True
-                    when_thread.start()
-                    whenlist.append({
-                        'command': ' '.join(args),
-                        'tid': when_thread,
-                        'stop': whenbot_stop
-                    })
+                    if oid is None:
+                        trigger = triggerengine.add_price(askbidlast, oper, scaleint(usd,5), action, ' '.join(args))
+                    else:
+                        trigger = triggerengine.add_fulfil(oid, action, ' '.join(args))
+                    whenlist[trigger.tid] = {'command': ' '.join(args), 'oid': oid}
 
         except Exception as e:
             traceback.print_exc()
@@ -1212,3 +1238,4 @@ class Shell(cmd.Cmd):
 
 if __name__ == '__main__':
     Shell().cmdloop()
+    gox.stop()          #saves the book snapshot
@@ -4,6 +4,7 @@
 
 
 import mtgoxhmac
+import retrypolicy
 import cmd
 
 mtgox = mtgoxhmac.Client()
@@ -17,6 +18,12 @@ class Shell(cmd.Cmd):
     #print 'Last Mt.Gox Open order: ', mtgox.last_order()
     #print mtgox.get_info()
     prompt = '(buy|sell volume price) '
+    def onecmd(self, line):
+        try:
+            return cmd.Cmd.onecmd(self, line)
+        except (retrypolicy.GaveUp, retrypolicy.CircuitOpen) as e:
+            #Uncertain (a GaveUp) means the order may be out: check with 'orders'
+            print e
     def do_sell(self, arg):
          volume, price = arg.split()
          volume = float(volume)
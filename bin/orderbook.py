@@ -22,27 +22,27 @@ if os.name == 'nt':
 from book import *
 from common import *
 import depthparser
+import asynclog
 import mtgox_prof7bitapi
 
 class LogWriter():
-    """connects to gox.signal_debug and logs it all to the logfile"""
+    """connects to gox.signal_debug and logs it all to the logfile. The
+    socket thread only queues the message, it is written in the background
+    (see lib/asynclog.py)"""
     def __init__(self, gox):
         self.gox = gox
-        logging.basicConfig(filename='orderbook.log'
-                           ,filemode='a'
-                           ,format='%(asctime)s:%(levelname)s %(message)s'
-                           ,level=logging.DEBUG
-                           )
-        console_logger = logging.getLogger('')
+        self.log = asynclog.AsyncLog('orderbook.log')
+        root_logger = logging.getLogger('')
+        root_logger.setLevel(logging.DEBUG)
+        root_logger.addHandler(asynclog.AsyncHandler(self.log))
         console = logging.StreamHandler()
         console.setLevel(logging.INFO)
-        console_logger.addHandler(console)        
+        root_logger.addHandler(console)        
         self.gox.signal_debug.connect(self.slot_debug)
 
     def close(self):
         """stop logging"""
-        #not needed
-        pass
+        self.log.close()
 
     # pylint: disable=R0201
     def slot_debug(self, sender, (msg)):
@@ -50,32 +50,42 @@ class LogWriter():
         if "https://data.mtgox.com/api/2/money/order/lag" in msg:
             return
         else:
-            logging.debug("%s:%s", sender.__class__.__name__, msg)       #change this to .info to see the messages on screen.
+            self.log.debug(sender.__class__.__name__, "%s:%s", sender.__class__.__name__, msg)
 
 
+# data partial path directory
+fullpath = os.path.dirname(os.path.realpath(__file__))
+if os.name == 'nt':
+    partialpath=os.path.join(fullpath + '\\..\\data\\')
+else:
+    partialpath=os.path.join(fullpath + '/../data/')
+
 config = mtgox_prof7bitapi.GoxConfig()
 secret = mtgox_prof7bitapi.Secret()
 #secret.decrypt(mtgox.enc_password)
 gox = mtgox_prof7bitapi.Gox(secret, config)
 logwriter = LogWriter(gox)
+socketbook = gox.orderbook
+#the book of the last run is shown until the fulldepth is downloaded
+socketbook.load_snapshot(os.path.join(partialpath + 'mtgox_book.snap'))
+socketbook.checkpoint(os.path.join(partialpath + 'mtgox_book.snap'))
 gox.start()
 print "Starting to download fulldepth from mtgox....",
-socketbook = gox.orderbook
-while socketbook.fulldepth_downloaded == False:
-    time.sleep(0.1)
-print "Finished."
+while not socketbook.wait(provisional=True, timeout=1):
+    socketbook.refresh(0)       #the first request failed, ask again
+print "Finished." if not socketbook.provisional else "Showing the saved book until then."
 
 
 while True:
     try:
         vintage = (time.time() - socketbook.fulldepth_time)
-        if vintage > 240:
+        #a provisional book is shown while its fulldepth downloads
+        if socketbook.refresh(240) and not socketbook.provisional:
             print "Starting to download fulldepth from mtgox....",
-            gox.client.request_fulldepth()
-            while socketbook.fulldepth_downloaded == False:
+            while gox.client.fulldepth_pending():
                 time.sleep(0.1)
-            print "Finished."
-        elif vintage > 60:
+            print "Finished." if socketbook.fulldepth_time >= gox.client.fulldepth_started else "Failed."
+        elif vintage > 60 and not socketbook.provisional:
             gox.client.request_smalldepth()
         print ""
         printOrderBooks(socketbook.asks,socketbook.bids,20)
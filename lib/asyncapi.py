@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# asyncapi.py
+# Runs the (blocking) REST client calls concurrently: every call made
+# through an AsyncClient goes to a shared pool of worker threads and
+# returns a Future right away. The calls share the keep-alive connections
+# of httppool; signed calls still get their nonces in the order they are
+# sent (see the sendlock of each client).
+#
+#   btce = AsyncClient(btceapi.Client())
+#   futures = [btce.depth(pair) for pair in pairs]
+#   depths = gather(futures)
+#
+# The normal clients stay exactly as they are, this only wraps them.
+
+import Queue
+import sys
+import threading
+
+
+class Future(object):
+    """the result of a call that is still running"""
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """wait for the call and return what it returned (or raise what it
+        raised). RuntimeError if it is not done within timeout seconds."""
+        if not self._done.wait(timeout):
+            raise RuntimeError("call did not finish within %s seconds" % timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError("call did not finish within %s seconds" % timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, func):
+        """func(future) once the call is done (right away if it already is)"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+
+class Executor(object):
+    """a fixed number of daemon worker threads running submitted calls.
+    A call must not wait for another Future of the same executor, with
+    every worker doing that nothing would be left to run them."""
+    def __init__(self, workers=8):
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+
+    def submit(self, func, *args, **kwargs):
+        if len(self._threads) < self.workers:
+            self._start()
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+
+#shared by every AsyncClient unless they get their own
+default_executor = Executor()
+
+
+def gather(futures, timeout=None):
+    """wait for all futures, returns their results in the same order.
+    The first exception found is raised."""
+    return [f.result(timeout) for f in futures]
+
+
+class AsyncClient(object):
+    """Usage: mtgox = AsyncClient(mtgoxhmac.Client())
+        ticker = mtgox.get_ticker()     #a Future
+        print ticker.result()
+    Every method of the wrapped client returns a Future, other attributes
+    (cPrec, bPrec...) are passed through. .sync is the wrapped client."""
+    def __init__(self, client, executor=None):
+        self.sync = client
+        self.executor = executor or default_executor
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            return self.executor.submit(attr, *args, **kwargs)
+        call.__name__ = name
+        return call
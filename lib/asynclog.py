@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# asynclog.py
+# Logging that costs the calling thread (the socket receive thread, the
+# bots) next to nothing: a call only appends a tuple to a deque, nothing is
+# formatted, locked or written. A background thread takes everything that
+# piled up every <interval> seconds, formats it and writes it to the file in
+# one go, rotating the file when it gets bigger than <maxbytes>.
+#
+#   log = AsyncLog("goxtool.log")
+#   log.debug("Gox", "got %d orders", n)        #formatted later, on the writer
+#   log.write('{"lastprice": 120.5}')           #a ready made line
+#
+# Formats:
+#   text      "%(asctime)s:%(levelname)s %(message)s" (any template using
+#             asctime, levelname, name and message)
+#   compact   one tab separated line per record: unix time, level, name,
+#             message. Smaller and easy to parse again.
+#
+# AsyncHandler plugs an AsyncLog into the logging module, capture() sends
+# everything one thread prints to a log instead of the screen (without
+# swapping sys.stdout for the other threads).
+
+import collections
+import logging
+import os
+import sys
+import thread
+import threading
+import time
+
+DEBUG = "DEBUG"
+INFO = "INFO"
+WARNING = "WARNING"
+ERROR = "ERROR"
+
+_LEVELS = {DEBUG: 10, INFO: 20, WARNING: 30, ERROR: 40}
+
+
+class AsyncLog(object):
+    """Usage: log = AsyncLog("bot.log", maxbytes=10*1024*1024, backups=5)
+        log.info("bot", "bought %s @ %s", amount, price)
+        log.close()             #writes what is left"""
+    def __init__(self, path, template="%(asctime)s:%(levelname)s %(message)s", datefmt=None,
+                 compact=False, maxbytes=10*1024*1024, backups=5, interval=0.2,
+                 maxqueue=100000, level=DEBUG, mode='a'):
+        self.path = path
+        self.template = template
+        self.datefmt = datefmt
+        self.compact = compact
+        self.maxbytes = maxbytes        #0 never rotates
+        self.backups = backups
+        self.interval = interval
+        self.maxqueue = maxqueue
+        self.level = _LEVELS[level]
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0                #records lost because the writer fell behind
+        self._queue = collections.deque()
+        self._drains = 0
+        self._file = open(path, mode)
+        self._stop = threading.Event()
+        self._flushed = threading.Condition(threading.Lock())
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    #the hot path: one length check and one append
+    def log(self, level, name, msg, args=()):
+        if _LEVELS[level] < self.level:
+            return
+        if len(self._queue) >= self.maxqueue:
+            self.dropped += 1
+            return
+        self._queue.append((time.time(), level, name, msg, args))
+        self.enqueued += 1
+
+    def debug(self, name, msg, *args):
+        self.log(DEBUG, name, msg, args)
+
+    def info(self, name, msg, *args):
+        self.log(INFO, name, msg, args)
+
+    def warning(self, name, msg, *args):
+        self.log(WARNING, name, msg, args)
+
+    def error(self, name, msg, *args):
+        self.log(ERROR, name, msg, args)
+
+    def write(self, line):
+        """a line that is written as it is"""
+        self._queue.append((None, None, None, line, ()))
+        self.enqueued += 1
+
+    def _format(self, record):
+        created, level, name, msg, args = record
+        if args:
+            try:
+                msg = msg % args
+            except (TypeError, ValueError):
+                msg = "%s %r" % (msg, args)
+        if created is None:
+            return "%s\n" % msg
+        if self.compact:
+            msg = str(msg).replace("\t", " ").replace("\n", "\\n")
+            return "%.3f\t%s\t%s\t%s\n" % (created, level, name, msg)
+        if self.datefmt:
+            asctime = time.strftime(self.datefmt, time.localtime(created))
+        else:
+            asctime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created)) + ",%03d" % (created % 1 * 1000)
+        return self.template % {"asctime": asctime, "levelname": level, "name": name, "message": msg} + "\n"
+
+    def _drain(self):
+        lines = []
+        queue = self._queue
+        while queue:
+            try:
+                lines.append(self._format(queue.popleft()))
+            except IndexError:
+                break
+            except Exception as e:
+                lines.append("asynclog: could not format a record: %s\n" % e)
+        if lines:
+            self._file.write("".join(lines))
+            self._file.flush()
+            self.written += len(lines)
+            if self.maxbytes and self._file.tell() > self.maxbytes:
+                self._rotate()
+        with self._flushed:
+            self._drains += 1
+            self._flushed.notify_all()
+
+    def _rotate(self):
+        """bot.log -> bot.log.1 -> bot.log.2 ... up to <backups>"""
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = "%s.%d" % (self.path, i)
+            if os.path.exists(older):
+                newer = "%s.%d" % (self.path, i + 1)
+                if os.path.exists(newer):
+                    os.remove(newer)
+                os.rename(older, newer)
+        if self.backups:
+            first = self.path + ".1"
+            if os.path.exists(first):
+                os.remove(first)
+            os.rename(self.path, first)
+        self._file = open(self.path, 'w')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._drain()
+        self._drain()
+
+    def flush(self, timeout=5):
+        """wait until everything logged so far is written"""
+        deadline = time.time() + timeout
+        with self._flushed:
+            drains = self._drains
+            while (self._queue or self._drains <= drains) and time.time() < deadline:
+                self._flushed.wait(self.interval)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._file.close()
+
+
+class AsyncHandler(logging.Handler):
+    """Usage: logging.getLogger('').addHandler(AsyncHandler(log))
+    the record's message is only formatted on the writer thread"""
+    def __init__(self, asynclog, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.asynclog = asynclog
+
+    def emit(self, record):
+        self.asynclog.log(record.levelname if record.levelname in _LEVELS else INFO,
+                          record.name, record.msg, record.args or ())
+
+
+class _ThreadRouter(object):
+    """stands in for sys.stdout: what a captured thread prints goes to its
+    log, everybody else still prints to the screen. print a, b calls
+    write() for every item and separator, so a thread's text is kept until
+    its line is complete and then logged as one record."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.routes = {}
+        self.pending = {}       #thread id -> start of a line not ended yet
+
+    def write(self, text):
+        ident = thread.get_ident()
+        log = self.routes.get(ident)
+        if log is None:
+            self.stream.write(text)
+            return
+        text = self.pending.pop(ident, "") + text
+        lines = text.split("\n")
+        if lines[-1]:
+            self.pending[ident] = lines[-1]
+        for line in lines[:-1]:
+            self._emit(log, line)
+
+    def _emit(self, log, line):
+        line = line.rstrip()
+        if line:
+            log.debug("STDOUT", line)
+
+    def release(self, ident):
+        """stop capturing a thread, logging what is left of its last line"""
+        log = self.routes.pop(ident, None)
+        rest = self.pending.pop(ident, "")
+        if log is not None:
+            self._emit(log, rest)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def capture(log):
+    """from now on, print statements of the calling thread go to log"""
+    if not isinstance(sys.stdout, _ThreadRouter):
+        sys.stdout = _ThreadRouter(sys.stdout)
+    sys.stdout.routes[thread.get_ident()] = log
+
+def release():
+    """print to the screen again"""
+    if isinstance(sys.stdout, _ThreadRouter):
+        sys.stdout.release(thread.get_ident())
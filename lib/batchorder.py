@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# batchorder.py
+# Sends many orders (a spread ladder) or many cancels at once instead of
+# one round trip after the other. Used by common.spread and the cancel_all
+# of the mtgox, bitstamp and bitfloor clients.
+#
+# At most <workers> calls are in flight at the same time. They go over the
+# keep-alive connections of httppool; the clients sign and send one request
+# at a time with increasing nonces (see their sendlock) and only wait for
+# the responses in parallel. Sent in order on different connections they can
+# still be handled out of order, and the exchange rejects the one with the
+# lower nonce. A rejected nonce means the call was not carried out, so those
+# calls are made again one at a time once the others are done; if one is
+# rejected again it is reported like any other error. mtgoxhmac takes its
+# tokens from the shared rate limiter on its own, for other clients pass a
+# ratelimit bucket.
+#
+# A run returns a Results list (.elapsed: wall clock seconds of the run,
+# .renonced: calls made again after a nonce error) with a Result for every
+# call, in the order the calls were passed in:
+#     index    position in the batch
+#     args     the arguments the call was made with
+#     ok       False if it raised or returned nothing/an error
+#     result   whatever the client returned
+#     error    the exception or error message
+#     elapsed  seconds the call took
+
+import collections
+import random
+import threading
+import time
+import Queue
+from decimal import Decimal as D
+
+Result = collections.namedtuple('Result', 'index args ok result error elapsed')
+
+
+class Results(list):
+    """the Results of one run"""
+    elapsed = 0                 #wall clock seconds
+    renonced = 0                #calls made again after a nonce error
+
+
+def _failed(result):
+    """the clients return None, False or a dict with "error" on failure"""
+    if not result:
+        return "no result"
+    if isinstance(result, dict) and "error" in result:
+        return result["error"]
+    return None
+
+
+def _nonce_error(error):
+    """the exchange rejected the nonce (the call did nothing)"""
+    if error is None:
+        return False
+    return "nonce" in ("%s %s" % (error, getattr(error, "body", ""))).lower()
+
+
+class BatchEngine(object):
+    """Usage: engine = BatchEngine(workers=4)
+        results = engine.run(client.order_new, [(side, amount, price), ...])
+        print "%d orders in %.2fs" % (len(results), results.elapsed)"""
+    def __init__(self, workers=4, bucket=None):
+        self.workers = workers
+        self.bucket = bucket            #optional ratelimit.TokenBucket, for every run
+
+    def _call(self, func, index, args, bucket):
+        if bucket is not None:
+            bucket.acquire()
+        start = time.time()
+        try:
+            result = func(*args)
+            error = _failed(result)
+        except Exception as e:
+            result = None
+            error = e
+        return Result(index, args, error is None, result, error, time.time() - start)
+
+    def run(self, func, calls, bucket=None):
+        """call func(*args) for every args tuple in calls, returns the
+        Results once they are all done. bucket (a ratelimit.TokenBucket)
+        overrides the engine's one for this run."""
+        start = time.time()
+        bucket = bucket or self.bucket
+        calls = list(calls)
+        results = Results([None] * len(calls))
+        work = Queue.Queue()
+        for index, args in enumerate(calls):
+            work.put((index, args))
+
+        def worker():
+            while True:
+                try:
+                    index, args = work.get_nowait()
+                except Queue.Empty:
+                    return
+                results[index] = self._call(func, index, args, bucket)
+
+        threads = []
+        for i in xrange(min(self.workers, len(calls))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        #one after the other, every nonce arrives after the last one
+        for result in list(results):
+            if not result.ok and _nonce_error(result.error):
+                results[result.index] = self._call(func, result.index, result.args, bucket)
+                results.renonced += 1
+        results.elapsed = time.time() - start
+        return results
+
+    def place(self, order_new, orders, bucket=None):
+        """orders is a list of (side, amount, price)"""
+        return self.run(order_new, orders, bucket)
+
+    def cancel(self, order_cancel, ids, bucket=None):
+        return self.run(order_cancel, [(oid,) for oid in ids], bucket)
+
+
+def ladder(volume, price_lower, price_upper, chunks, cPrec, bPrec, dorandom=''):
+    """split volume into <chunks> orders from price_lower towards price_upper,
+    as [(amount, price),...] of Decimals (what common.spread always did)"""
+    orders = []
+    randomnesstotal = 0
+    loop_price = D(str(price_lower))
+    price_range = D(str(price_upper)) - D(str(price_lower))
+    price_chunk = D(price_range/ D(chunks)).quantize(cPrec)
+    chunk_volume = D(D(volume) / D(chunks)).quantize(bPrec)
+    for x in range (0, int(chunks)):
+        randomchunk = chunk_volume
+        if dorandom.lower()=='random':
+            if chunks > 1:
+                if x+1 == int(chunks):
+                    randomchunk -= randomnesstotal
+                else:
+                    randomness = D((random.random()/100) + (random.random()/100)).quantize(bPrec)
+                    randomnesstotal += randomness
+                    randomchunk += randomness
+        orders.append((randomchunk, loop_price))
+        loop_price += price_chunk
+    return orders
+
+
+#one engine for the interactive clients
+engine = BatchEngine()
@@ -4,6 +4,7 @@ import base64
 import urllib
 import httplib
 import time
+import threading
 import json
 import json_ascii
 import copy
@@ -11,6 +12,10 @@ import decimal
 from decimal import Decimal as D
 import os
 import unlock_api_key
+import httppool
+import nonces
+import batchorder
+import ratelimit
 
 
 config = {
@@ -20,7 +25,7 @@ config = {
     "version": 1
     }
 
-HTTPConn = httplib.HTTPSConnection
+HTTPConn = httplib.HTTPSConnection  #kept for old callers, requests go through httppool
 
 class Client(object):
     def __init__(self,encpassword=""):
@@ -29,6 +34,10 @@ class Client(object):
         self._inc = D('0.01')   # (the currency precision) TODO: get from bitfloor(can't yet)
         self.cPrec = D('0.01')
         self.bPrec = D('0.00001')
+        self.sendlock = threading.RLock()   #see _send_post
+        self.nonces = nonces.allocator("bitfloor", floor=nonces.microseconds)
+        #the batches of orders/cancels (lib/batchorder.py) are paced by it
+        self.batchbucket = ratelimit.limiter("bitfloor", ratelimit.BITFLOOR)["order"]
 
     def book(self, level=1):
         url = '/book/L{1}/{0}'.format(self._product_id, level)
@@ -80,9 +89,9 @@ class Client(object):
 
     def cancel_all(self):
         orders = self.orders()
-        for order in orders:
-            x = self.order_cancel(order['order_id'])
-            print x
+        results = batchorder.engine.cancel(self.order_cancel, [order['order_id'] for order in orders], self.batchbucket)
+        for r in results:
+            print r.result if r.result is not None else r.error
         if orders:
             print "All Orders have been Cancelled!!!!!"
         else:
@@ -102,41 +111,43 @@ class Client(object):
     def _send_get(self, url, payload={}):
         try:
             body = urllib.urlencode(payload)
-            conn = HTTPConn(config['host'], config['data_port'])
-            conn.request("GET", url, body)
-            resp = conn.getresponse()
-            s = resp.read()
-            conn.close()
+            _, _, s = httppool.pool.request("GET", "https://%s:%d%s" % (config['host'], config['data_port'], url), body)
             return json.loads(s, object_hook=json_ascii.decode_dict)
         except Exception as e:
             print e
 
+    def nonce(self):
+        """microsecond time, but always more than the last one handed out
+        by any bitfloor client on this machine"""
+        return self.nonces.next()
+
     def _send_post(self, url, payload={}):
         try:
-            payload = copy.copy(payload) # avoid modifying the original dict
-
-            # add some stuff to the payload
-            payload['nonce'] = int(time.time()*1e6)
-
-            body = urllib.urlencode(payload)
-
-            sig = hmac.new(base64.b64decode(self._secret), body, hashlib.sha512).digest()
-            sig_b64 = base64.b64encode(sig)
-
-            headers = {
-                'bitfloor-key': self._key,
-                'bitfloor-sign': sig_b64,
-                'bitfloor-passphrase': self._passphrase,
-                'bitfloor-version': config['version'],
-                'Content-Type': 'application/x-www-form-urlencoded',
-                'Content-Length': len(body)
-            }
-
-            conn = HTTPConn(config['host'], config['order_port'])
-            conn.request("POST", url, body, headers)
-            resp = conn.getresponse()
-            s = resp.read()
-            conn.close()
+            def sign():
+                #called by httppool right before sending, under self.sendlock,
+                #so the nonces reach bitfloor in increasing order
+                signed = copy.copy(payload) # avoid modifying the original dict
+
+                # add some stuff to the payload
+                signed['nonce'] = self.nonce()
+
+                body = urllib.urlencode(signed)
+
+                sig = hmac.new(base64.b64decode(self._secret), body, hashlib.sha512).digest()
+                sig_b64 = base64.b64encode(sig)
+
+                headers = {
+                    'bitfloor-key': self._key,
+                    'bitfloor-sign': sig_b64,
+                    'bitfloor-passphrase': self._passphrase,
+                    'bitfloor-version': config['version'],
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'Content-Length': len(body)
+                }
+                return body, headers
+
+            _, _, s = httppool.pool.request("POST", "https://%s:%d%s" % (config['host'], config['order_port'], url),
+                                            sign=sign, signlock=self.sendlock)
             return json.loads(s, object_hook=json_ascii.decode_dict)
         except Exception as e:
             print e
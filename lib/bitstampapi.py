@@ -12,6 +12,9 @@ import datetime
 import unlock_api_key
 import io
 import gzip
+import httppool
+import batchorder
+import ratelimit
 
         
 APIURL="https://www.bitstamp.net/api/"
@@ -24,6 +27,8 @@ class Client:
         
         self.cPrec = D('0.01')
         self.bPrec = D('0.00000001')
+        #the batches of orders/cancels (lib/batchorder.py) are paced by it
+        self.batchbucket = ratelimit.limiter("bitstamp", ratelimit.BITSTAMP)["request"]
 
     def get(self,url,params=None):
         url = APIURL + url
@@ -32,7 +37,7 @@ class Client:
             url = url + '?' + params    
         req = urllib2.Request(url)      #GET
         req.add_header('Accept-encoding', 'gzip')       
-        response = urllib2.urlopen(req)
+        response = httppool.urlopen(req)
         if response.info().get('Content-Encoding') == 'gzip':
             buf = io.BytesIO(response.read())
             response = gzip.GzipFile(fileobj=buf)
@@ -50,7 +55,7 @@ class Client:
         postdata = urllib.urlencode(params)
         req = urllib2.Request(url,postdata)         #POST
         req.add_header('Accept-encoding', 'gzip')       
-        response = urllib2.urlopen(req)
+        response = httppool.urlopen(req)
         if response.info().get('Content-Encoding') == 'gzip':
             buf = io.BytesIO(response.read())
             response = gzip.GzipFile(fileobj=buf)
@@ -72,7 +77,7 @@ class Client:
         params = {"group":ordergrouping}    #group orders with the same price (0 - false; 1 - true). Default: 1
         orderbook = self.get(url,params) 
         from book import Book
-        entirebook = Book.parse(orderbook)
+        entirebook = Book.parse(orderbook,cPrec=self.cPrec,bPrec=self.bPrec)   #integer mode
         entirebook.sort()
         return entirebook       #Returns a sorted Book class object,containing entirebook.bids and entirebook.asks
 
@@ -126,9 +131,9 @@ class Client:
     def cancel_all(self):
         error = False
         orders = self.open_orders()
-        for order in orders:
-            x = self.cancel_order(order['id'])
-            if x == True:
+        results = batchorder.engine.cancel(self.cancel_order, [order['id'] for order in orders], self.batchbucket)
+        for order, r in zip(orders, results):
+            if r.result == True:
                 print "Order %s has been Cancelled." % order['id']
             else:
                 print "Error: Order %s not cancelled." % order['id']
@@ -14,9 +14,69 @@ class Order(object):
         alist=[self.price,self.volume]
         return alist[index]
     
+
+def scaleint(value, places):
+    """convert a price/volume as given by an exchange (string, float or int)
+    straight to an integer scaled by 10**places, ie: ('47.1',2) -> 4710.
+    Extra digits are rounded half-even, just like quantize() did."""
+    text = str(value).strip()
+    if 'e' in text or 'E' in text:
+        return int(D(text).scaleb(places).to_integral_value())
+    negative = text.startswith('-')
+    text = text.lstrip('+-')
+    whole, _, frac = text.partition('.')
+    result = int(whole or '0') * 10**places + int(frac[:places].ljust(places, '0') or '0')
+    rest = frac[places:]
+    if rest and rest > '5' + '0' * (len(rest) - 1):
+        result += 1
+    elif rest and rest == '5' + '0' * (len(rest) - 1) and result & 1:
+        result += 1
+    return -result if negative else result
+
+def decimalplaces(prec):
+    """number of decimals of a precision like cPrec/bPrec (D('0.01') -> 2)"""
+    return -D(prec).as_tuple().exponent
+
+
+class IntOrder(object):
+    """an order kept as scaled integers (price_int = price/cPrec,
+    volume_int = volume/bPrec). .price and .volume are Decimal views that are
+    only made when something actually displays them."""
+    __slots__ = ('price_int', 'volume_int', 'cPrec', 'bPrec', '_price', '_volume')
+    def __init__(self, price_int, volume_int, cPrec, bPrec):
+        self.price_int = price_int
+        self.volume_int = volume_int
+        self.cPrec = cPrec
+        self.bPrec = bPrec
+        self._price = None
+        self._volume = None
+    @property
+    def price(self):
+        if self._price is None:
+            self._price = D(self.price_int) * self.cPrec
+        return self._price
+    @property
+    def volume(self):
+        if self._volume is None:
+            self._volume = D(self.volume_int) * self.bPrec
+        return self._volume
+    def add(self, volume_int):
+        self.volume_int += volume_int
+        self._volume = None
+    def __repr__(self):
+        return str([self.price,self.volume])
+    def __getitem__(self,index):
+        alist=[self.price,self.volume]
+        return alist[index]
+
+
 class Book(object):
     @classmethod
-    def parse(cls, d, isbitfloor=False,goxfulldepth=False):
+    def parse(cls, d, isbitfloor=False,goxfulldepth=False,cPrec=None,bPrec=None):
+        """Pass the exchange's cPrec and bPrec to get a Book of IntOrders
+        (integer mode), otherwise every price and volume becomes a Decimal"""
+        if cPrec is not None and bPrec is not None:
+            return cls.parse_int(d, cPrec, bPrec, goxfulldepth)
         def parse_side(arr):
             orders = []
             for a in arr:                       #iterate over the array
@@ -45,15 +105,54 @@ class Book(object):
         asks = parse_side(d['asks'])
         return cls(bids, asks)
 
+    @classmethod
+    def parse_int(cls, d, cPrec, bPrec, goxfulldepth=False):
+        """integer mode: every price/volume goes straight to an int scaled
+        by the exchange's precision, no Decimal is made while parsing"""
+        cplaces = decimalplaces(cPrec)
+        bplaces = decimalplaces(bPrec)
+        #mtgox already sends the integers in its own scale (1E5 USD, 1E8 BTC)
+        gotints = goxfulldepth and cplaces == 5 and bplaces == 8
+        def parse_side(arr):
+            orders = []
+            for a in arr:
+                if gotints:
+                    orders.append(IntOrder(int(a['price_int']), int(a['amount_int']), cPrec, bPrec))
+                elif goxfulldepth:
+                    orders.append(IntOrder(scaleint(a['price'], cplaces), scaleint(a['amount'], bplaces), cPrec, bPrec))
+                else:
+                    orders.append(IntOrder(scaleint(a[0], cplaces), scaleint(a[1], bplaces), cPrec, bPrec))
+            return orders
+        book = cls(parse_side(d['bids']), parse_side(d['asks']))
+        book.cPrec = cPrec
+        book.bPrec = bPrec
+        return book
+
     def __init__(self, bids, asks):
         self.bids = bids
         self.asks = asks
+        self.cPrec = None       #set when the book holds IntOrders
+        self.bPrec = None
 
     def sort(self):
+        if self.cPrec is not None:
+            self.bids.sort(key=lambda o: o.price_int, reverse=True)
+            self.asks.sort(key=lambda o: o.price_int)
+            return
         self.bids.sort(key=lambda o: o.price, reverse=True)
         self.asks.sort(key=lambda o: o.price)
 
+    def spread(self):
+        """lowest ask minus highest bid (of a sorted book), or None if a side is empty"""
+        if not self.asks or not self.bids:
+            return None
+        if self.cPrec is not None:
+            return D(self.asks[0].price_int - self.bids[0].price_int) * self.cPrec
+        return self.asks[0].price - self.bids[0].price
+
     def flatten(self, increment):
+        if self.cPrec is not None:
+            return self._flatten_int(increment)
         def floor_inc(n):
             return (D(str(n))/D(increment)).quantize(D('1'), rounding=decimal.ROUND_DOWN)*D(increment)
         def ceil_inc(n):
@@ -81,7 +180,35 @@ class Book(object):
         self.bids = bids.values()
         self.asks = asks.values()
 
+    def _flatten_int(self, increment):
+        step = scaleint(increment, decimalplaces(self.cPrec))
+        bids = {}
+        asks = {}
+
+        def add(d, price, volume):
+            o = d.get(price)
+            if o is None:
+                d[price] = IntOrder(price, volume, self.cPrec, self.bPrec)
+            else:
+                o.add(volume)
+
+        for o in self.bids:
+            add(bids, o.price_int // step * step, o.volume_int)
+        for o in self.asks:
+            add(asks, -(-o.price_int // step) * step, o.volume_int)
+
+        self.bids = bids.values()
+        self.asks = asks.values()
+
+    def _ints(self, o):
+        """price_int, volume_int of any order in this book's scale"""
+        if isinstance(o, IntOrder) and o.cPrec == self.cPrec and o.bPrec == self.bPrec:
+            return o.price_int, o.volume_int
+        return scaleint(o.price, decimalplaces(self.cPrec)), scaleint(o.volume, decimalplaces(self.bPrec))
+
     def subtract(self, other):
+        if self.cPrec is not None:
+            return self._subtract_int(other)
         bids = {}
         asks = {}
         for o in self.bids:
@@ -105,3 +232,25 @@ class Book(object):
 
         self.bids = bids.values()
         self.asks = asks.values()
+
+    def _subtract_int(self, other):
+        bids = dict((o.price_int, o) for o in self.bids)
+        asks = dict((o.price_int, o) for o in self.asks)
+
+        def subtract_volume(d, o):
+            price, volume = self._ints(o)
+            existing = d.get(price)
+            if existing is not None:
+                existing.add(-volume)
+            else:
+                d[price] = IntOrder(price, -volume, self.cPrec, self.bPrec)
+
+        # remove order volumes book
+        if other:
+            for o in other.bids:
+                subtract_volume(bids, o)
+            for o in other.asks:
+                subtract_volume(asks, o)
+
+        self.bids = bids.values()
+        self.asks = asks.values()
@@ -6,45 +6,80 @@
 import sys
 import os
 import httplib
+import socket
 import urllib
 import urllib2
+import urlparse
 import requests
 import json
 import json_ascii
 import hashlib
 import hmac
 import time
+import threading
 import unlock_api_key
+import httppool
+import nonces
+import retrypolicy
 
 from common import UserError,ServerError
 
+#one keep-alive session (requests pools the connections) instead of a new
+#connection per call, the urllib2 parts go through httppool
+session = requests.Session()
+
+def _post(url, **kwargs):
+    """session.post, with the HTTP errors raised as urllib2.HTTPError so
+    retrypolicy can tell them apart"""
+    try:
+        r = session.post(url, timeout=30, **kwargs)
+    except requests.Timeout as e:
+        raise socket.timeout(str(e))
+    except requests.RequestException as e:
+        raise IOError(str(e))
+    if r.status_code != requests.codes.ok:
+        print "Caught HTTP Error %s." % r.status_code
+        e = urllib2.HTTPError(url, r.status_code, r.reason, r.headers, None)
+        e.body = r.text
+        raise e
+    return r
+
+#private methods that must not be carried out twice
+NOT_IDEMPOTENT = ("Trade", "WithdrawCoin")
+
 class Client:
     def __init__(self, enc_password=""):
         #unlock the encrypted API key file
         self.key,self.secret,_ = unlock_api_key.unlock("btc-e")
+        #shared with every thread and process using the key (lib/nonces.py),
+        #continues from an existing ..\data\nonce_state_btce
+        self.nonces = nonces.allocator("btce", legacy='nonce_state_btce')
+        #private requests one at a time, so the nonces arrive in order even
+        #when they are made from several threads (asyncapi). Only held while
+        #a request is out, not while a retry waits
+        self.sendlock = threading.Lock()
+        #backoff, deadline and the btc-e.com circuit breaker of every call
+        self.policy = retrypolicy.default
 
 
-    #must already have this nonce file in ..\data\
     def nonce_generator(self):
-        fullpath = os.path.dirname(os.path.realpath(__file__))
-        partialpath=os.path.join(fullpath + '\\..\\data\\')
-
-        fd = open(os.path.join(partialpath + 'nonce_state_btce'),'r')
-        nonce = int(fd.read())
-        fd.close()
-        while (True):
-            nonce = nonce+1
-            fd = open(os.path.join(partialpath + 'nonce_state_btce'),'w')
-            fd.write(str(nonce))
-            fd.close()
-            yield nonce
+        return self.nonces
 
 
     def api_request(self,method, misc_params = {}):
-        nonce = self.nonce_generator()
-        # method name and nonce go into the POST parameters
+        """one private call, retried by self.policy. Trade is never sent
+        again once it may have reached btc-e (retrypolicy.Uncertain).
+        Raises retrypolicy.GaveUp/CircuitOpen when btc-e keeps failing."""
+        def attempt():
+            with self.sendlock:
+                return self._api_request(method, misc_params)
+        return self.policy.call("btc-e.com", attempt, idempotent=method not in NOT_IDEMPOTENT)
+
+    def _api_request(self,method, misc_params = {}):
+        # method name and nonce go into the POST parameters, a retry
+        # needs a new nonce
         params = {"method": method,
-                  "nonce": nonce.next()}
+                  "nonce": self.nonces.next()}
         #Update params
         params.update(misc_params)
         # Hash the params string to produce the Sign header value
@@ -56,70 +91,29 @@ class Client:
                    "Key":self.key,
                    "Sign":sign}
         #NEW CODE using Requests lib
-        while True:
-            url = 'https://btc-e.com/tapi'
-            r = requests.post(url,data=params,headers=headers)
-            if r.status_code == '502':
-                print "Caught 502 Error(Bad Gateway)."
-            elif r.status_code == requests.codes.ok:
-                try:
-                    rj = r.json()
-                    if rj['return']:
-                        return json.loads(r.text, object_hook=json_ascii.decode_dict)
-                    if rj['success'] == 0:
-                        print ("API returned error: " + rj['error'])
-                except Exception as e:
-                    print "JSON Error or non-JSON. %s" % e
-                    try:
-                        print r.text
-                    except:
-                        print "Not able to print the response body for later debugging of the error."
-                        print ("Unexpected error: " + str(sys.exc_info()[0]))
-            else:
-                print "Caught HTTP Error %s." % r.status_code
-            time.sleep(5)
-            print "Retrying connection..."
+        r = _post('https://btc-e.com/tapi', data=params, headers=headers)
+        rj = json.loads(r.text, object_hook=json_ascii.decode_dict)
+        if rj.get('success') == 0:
+            print ("API returned error: " + rj['error'])
+            if "nonce" in rj['error']:
+                #turned down without doing anything, fine to retry
+                raise retrypolicy.Retryable(retrypolicy.REFUSED, rj['error'])
+        return rj
 
 
     def pubapi_request(self,pair, type):
         #NEW CODE using Requests lib
-        while True:
-            try:
-                r = requests.post('https://btc-e.com/api/2/' + pair + '/' + type)
-                return json.loads(r.text, object_hook=json_ascii.decode_dict)
-                break
-            except r.status_code == '404':
-                print "Caught URL Error, sleeping..."
-                time.sleep(3)
-                print "Retrying connection"
-                continue
-            except r.status_code != requests.codes.ok:
-                print "Caught HTTP Error, sleeping..."
-                time.sleep(3)
-                print "Retrying connection now"
-                continue        
-            except IOError as e:
-                print "IO Error. %s" % e
-                print r.url
-                print r.text
+        def attempt():
+            r = _post('https://btc-e.com/api/2/' + pair + '/' + type)
+            return json.loads(r.text, object_hook=json_ascii.decode_dict)
+        return self.policy.call("btc-e.com", attempt)
 
     def parsePublicApi(self,url):
-        '''public api parse method, returns dict, sleeps and retries on url/http errors'''
-        while True:
-            try:
-                request = urllib2.Request(url)
-                response = json.loads(urllib2.urlopen(request).read())
-                break
-            except urllib2.URLError:
-                print "Caught URL Error, sleeping..."
-                time.sleep(3)
-                print "Retrying connection"
-                continue
-            except urllib2.HTTPError:
-                print "Caught HTTP Error, sleeping..."
-                time.sleep(3)
-                print "Retrying connection now"
-                continue
+        '''public api parse method, returns dict, backs off and retries on url/http errors'''
+        def attempt():
+            request = urllib2.Request(url)
+            return json.loads(httppool.urlopen(request).read())
+        return self.policy.call(urlparse.urlparse(url).hostname, attempt)
       
     def ticker(self,pair):
         return self.pubapi_request(pair, "ticker")['ticker']
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# clocksync.py
+# The offset between the clock of the exchange and ours. MtGox stamps its
+# messages with its own time in microseconds (the "now" of a ticker or depth
+# message, the tid of a trade), so every message is a one-way sample:
+#     our monotonic time when it arrived - its stamp = offset + network delay
+# The delay is never negative and is close to its minimum for some of the
+# messages, so the smallest of these differences in a while is the offset
+# (plus the smallest delay, which no one-way measurement can tell apart).
+#
+# The samples are min-filtered per bucket (10s); a line fitted through the
+# minima of the last buckets (5 minutes) gives the offset at any moment and
+# the drift of the two clocks against each other. How far the minima are
+# from the line is the error bound of the estimate.
+#
+#   clocksync.clock.sample(stamp)           #exchange seconds, on arrival
+#   clocksync.clock.to_local(stamp)         #-> our monotonic seconds
+#   clocksync.clock.delay(stamp)            #how late a message is, beyond the smallest delay
+#   clocksync.clock.error                   #+- seconds
+#
+# Our side is latency.monotonic (no steps when the wall clock is set).
+
+import collections
+import threading
+
+import latency
+
+
+class ClockSync(object):
+    """Usage: clock = ClockSync(bucket=10, buckets=30)
+        clock.sample(int(msg["ticker"]["now"]) / 1E6)
+        clock.to_local(exchange_seconds)    #monotonic
+        clock.offset(), clock.drift, clock.error"""
+    def __init__(self, bucket=10.0, buckets=30):
+        self.bucket = bucket            #seconds per min-filter bucket
+        self.lock = threading.Lock()
+        self.minima = collections.deque(maxlen=buckets)     #[local, difference] of the smallest sample per bucket
+        self.samples = 0
+        self._current = None            #bucket number of minima[-1]
+        self._base = 0.0                #the fit: offset(t) = _base + drift * (t - _at)
+        self._at = 0.0
+        self.drift = 0.0                #seconds per second (*1E6 = ppm)
+        self.error = None               #seconds, None until there are 2 buckets
+
+    def sample(self, stamp, local=None):
+        """a message stamped <stamp> (exchange seconds) arrived at <local>
+        (monotonic, default now)"""
+        if local is None:
+            local = latency.monotonic()
+        difference = local - stamp
+        number = int(local // self.bucket)
+        with self.lock:
+            self.samples += 1
+            if number == self._current:
+                smallest = self.minima[-1]
+                if difference < smallest[1]:
+                    smallest[0], smallest[1] = local, difference
+                    self._fit()
+            else:
+                self._current = number
+                self.minima.append([local, difference])
+                self._fit()
+
+    def _fit(self):
+        """least squares line through the bucket minima"""
+        count = len(self.minima)
+        if count == 1:
+            self._at, self._base = self.minima[0]
+            self.drift = 0.0
+            self.error = None
+            return
+        mean_t = sum(t for t, d in self.minima) / count
+        mean_d = sum(d for t, d in self.minima) / count
+        var = sum((t - mean_t) ** 2 for t, d in self.minima)
+        self.drift = sum((t - mean_t) * (d - mean_d) for t, d in self.minima) / var if var else 0.0
+        self._at, self._base = mean_t, mean_d
+        #the line runs through the middle of the minima, but the smallest
+        #delay is at or below all of them: move it down to the lowest one
+        self._base += min(d - self._line(t) for t, d in self.minima)
+        self.error = max(d - self._line(t) for t, d in self.minima)
+
+    def _line(self, local):
+        return self._base + self.drift * (local - self._at)
+
+    def synced(self):
+        """True once the estimate has an error bound"""
+        return self.error is not None
+
+    def offset(self, local=None):
+        """our monotonic time minus the exchange's at <local> (default now),
+        None before the first sample"""
+        if not self.minima:
+            return None
+        if local is None:
+            local = latency.monotonic()
+        with self.lock:
+            return self._line(local)
+
+    def to_local(self, stamp):
+        """the monotonic time of exchange time <stamp> (seconds). Before
+        the first sample it is the time of now."""
+        with self.lock:
+            if not self.minima:
+                return latency.monotonic()
+            #local = stamp + offset(local), solved for local
+            return (stamp + self._base - self.drift * self._at) / (1 - self.drift)
+
+    def to_exchange(self, local=None):
+        """the exchange time (seconds) of monotonic time <local> (default now)"""
+        if local is None:
+            local = latency.monotonic()
+        offset = self.offset(local)
+        return None if offset is None else local - offset
+
+    def delay(self, stamp, local=None):
+        """how much later than the fastest messages one stamped <stamp>
+        arrived at <local> (default now), seconds"""
+        if local is None:
+            local = latency.monotonic()
+        offset = self.offset(local)
+        return None if offset is None else local - stamp - offset
+
+    def report(self):
+        if not self.minima:
+            return "no exchange time stamps yet"
+        offset = self.offset()
+        return ("offset %+.6fs (local - exchange, includes the smallest delay)  error %s  drift %+.1f ppm"
+                "\n%d samples, %d buckets of %gs" % (offset,
+                "+-%.6fs" % self.error if self.error is not None else "unknown",
+                self.drift * 1E6, self.samples, len(self.minima), self.bucket))
+
+
+#the exchange clock of the process, Gox samples the MtGox stamps into it
+clock = ClockSync()
@@ -14,6 +14,9 @@ from decimal import Decimal as D
 import random
 import re
 
+import batchorder
+import ttlcache
+
 
 class UserError(Exception):
     def __init__(self, errmsg):
@@ -29,20 +32,21 @@ class ServerError(Exception):
 
         
 fullpath = os.path.dirname(os.path.realpath(__file__))
-partialpath=os.path.join(fullpath + '\\..\\data\\')
+if os.name == 'nt':
+    partialpath=os.path.join(fullpath + '\\..\\data\\')
+else:
+    partialpath=os.path.join(fullpath + '/../data/')
+
+#the fulldepth is cached in memory (already parsed) and in mtgox_fulldepth.txt,
+#whose first line says when it was downloaded
+ttlcache.public.add_disk("fulldepth", os.path.join(partialpath + "mtgox_fulldepth.txt"))
 
-#write the FULL depth to a log file
+#write the FULL depth to a log file (the cache's disk tier writes mtgox_fulldepth.txt)
 def writedepth(mtgox):
-    with open(os.path.join(partialpath + "mtgox_fulldepth.txt"),'w') as f:
-        print "Starting to download fulldepth from mtgox....",
-        fulldepth = mtgox.get_fulldepth()
-        depthvintage = str(time.time())
-        f.write(depthvintage)
-        f.write('\n')
-        json.dump(fulldepth,f)
-        f.close()
-        print "Finished."
-    return depthvintage,fulldepth
+    print "Starting to download fulldepth from mtgox....",
+    vintage,fulldepth = ttlcache.public.get_vintage("fulldepth", mtgox.fetch_fulldepth, 0)
+    print "Finished."
+    return str(vintage),fulldepth
 def readdepth():            
     with open(os.path.join(partialpath + "mtgox_fulldepth.txt"),'r') as f:
         everything = f.readlines()
@@ -53,9 +57,15 @@ def readdepth():
 def updatedepthdata(mtgox,maxage=120):
     global depthvintage
     global fulldepth
-    depthvintage,fulldepth = readdepth()
-    if (time.time() - float(depthvintage)) > maxage:   # don't fetch from gox more often than every 2 min
-        depthvintage,fulldepth = writedepth(mtgox)
+    def download():
+        print "Starting to download fulldepth from mtgox....",
+        data = mtgox.fetch_fulldepth()
+        print "Finished."
+        return data
+    # don't fetch from gox more often than every 2 min. The parsed depth is kept in memory,
+    # only the first line of mtgox_fulldepth.txt is read to check its age
+    vintage,fulldepth = ttlcache.public.get_vintage("fulldepth", download, maxage)
+    depthvintage = str(vintage)
     return depthvintage,fulldepth
 
 def movavg(trades):
@@ -140,23 +150,29 @@ def stddev(x):
 #calculate and print the total BTC between price A and B
 #match any order to the opposite site of the order book (ie: if buying find a seller) - market order
 #given the amount of BTC and price range check to see if it can be filled as a market order
+def depthlevels(bookside,ismtgox=False):
+    """integer (price,volume) pairs of a book side plus the divisors back to
+    display units. Works on book.py integer mode (IntOrder), the socket book
+    (ismtgox, already integers 1E5/1E8) and plain Decimal books (divisor 1)"""
+    if ismtgox:
+        return ((order.price,order.volume) for order in bookside),D(100000),D(100000000)
+    if len(bookside) and hasattr(bookside[0],'price_int'):
+        first = bookside[0]
+        return ((order.price_int,order.volume_int) for order in bookside),1/first.cPrec,1/first.bPrec
+    return ((order.price,order.volume) for order in bookside),D(1),D(1)
+
 def depthsumrange (bookside,amount,lowest=1,highest=2000,ismtgox=False):
     """Usage is: bookside(Book object) amount lowest(optional) highest(optional)"""
     totalBTC,totalprice = (0,0)
-    if ismtgox:
-        cdiv = D(1E5)
-        bdiv = D(1E8)
-    else:
-        cdiv = D(1)
-        bdiv = D(1)
+    levels,cdiv,bdiv = depthlevels(bookside,ismtgox)
     lowest *= cdiv
     highest *= cdiv
 
-    for order in bookside:
-        if order.price >= lowest and order.price <= highest:
-            totalBTC+=order.volume
-            totalprice+=order.volume * order.price
-    word = "IS" if amount <= totalBTC else "is NOT"
+    for price,volume in levels:
+        if price >= lowest and price <= highest:
+            totalBTC+=volume
+            totalprice+=volume * price
+    word = "IS" if amount <= totalBTC/bdiv else "is NOT"
     print "%s BTC %s available." % (amount,word),
     print 'There are %s BTC total between $%s and $%s' % (totalBTC/bdiv,lowest/cdiv,highest/cdiv)
     return totalBTC/bdiv,totalprice/(cdiv*bdiv)
@@ -167,24 +183,19 @@ def depthsumrange (bookside,amount,lowest=1,highest=2000,ismtgox=False):
 def depthprice (bookside,amount,lowest,highest,ismtgox=False):
     """Usage is: bookside(Book object) amount lowest highest"""
     totalBTC, totalprice, weightedavgprice = (0,0,0)
-    if ismtgox:
-        cdiv = D(1E5)
-        bdiv = D(1E8)
-    else:
-        cdiv = D(1)
-        bdiv = D(1)
+    levels,cdiv,bdiv = depthlevels(bookside,ismtgox)
     lowest *= cdiv
     highest *= cdiv
     amount *= bdiv
 
-    for order in bookside:
-        if order.price >= lowest and order.price <= highest:
-            print "order.price %s / order.volume %s " % (order.price,order.volume)
+    for price,volume in levels:
+        if price >= lowest and price <= highest:
+            print "order.price %s / order.volume %s " % (price/cdiv,volume/bdiv)
             if totalBTC < amount:
-                totalBTC+=order.volume
-                totalprice+=order.volume * order.price
+                totalBTC+=volume
+                totalprice+=volume * price
             if totalBTC >= amount:
-                totalprice-=order.price*(totalBTC-amount)
+                totalprice-=price*(totalBTC-amount)
                 totalBTC=amount
                 weightedavgprice=totalprice/totalBTC
                 break
@@ -229,44 +240,37 @@ def spread(exchangename,exchangeobject, side, volume, price_lower, price_upper=1
     """ie:   sell 6.4 40 41 128 = buys 6.4 BTC between $40 to $41 using 128 chunks"""
     """Simple trade also allowed: (buy/sell) amount price"""
     """Added in some optional randomness to it"""
+    """The chunks are sent a few at a time by lib/batchorder.py"""
     orderids = []
     sidedict = {0:"Buy",1:"Sell","bid":"Buy","ask":"Sell"}
     mapdict = {"bitfloor":"order_id","mtgox":"data","bitstamp":"id"}
-    randomnesstotal = 0
-    loop_price = D(str(price_lower))
-    price_range = D(str(price_upper)) - D(str(price_lower))
-    bPrec = exchangeobject.bPrec
-    cPrec = exchangeobject.cPrec
-    price_chunk = D(price_range/ D(chunks)).quantize(cPrec)
-    chunk_volume = D(D(volume) / D(chunks)).quantize(bPrec)
-    for x in range (0, int(chunks)):
-        randomchunk = chunk_volume
-        if dorandom.lower()=='random':
-            if chunks > 1:
-                if x+1 == int(chunks):
-                    randomchunk -= randomnesstotal
-                else:
-                    randomness = D((random.random()/100) + (random.random()/100)).quantize(bPrec)
-                    randomnesstotal += randomness
-                    randomchunk += randomness
+    chunks = batchorder.ladder(volume, price_lower, price_upper, chunks,
+                               exchangeobject.cPrec, exchangeobject.bPrec, dorandom)
+    order_new = exchangeobject.order_new
+    if exchangename == "mtgox":
+        #mtgox asks before every order >100 BTC, the chunks go out from several
+        #threads at once so ask here once for all of them instead
+        big = [amount for amount, price in chunks if amount > D('100.0')]
+        if big and not prompt("You are about to %s %s chunks of >100 BTC." % (sidedict[side].lower(), len(big)), True):
+            return orderids
+        order_new = lambda typ, amount, price: exchangeobject.order_new(typ, amount, price, protection=False)
+    results = batchorder.engine.place(order_new,
+                                      [(side, amount, price) for amount, price in chunks],
+                                      getattr(exchangeobject, "batchbucket", None))
+    for r in results:
+        _, randomchunk, loop_price = r.args
+        if r.ok:
+            orderids.append(r.result[mapdict[exchangename]])
         if silent == False:
-            print '%sing... Chunk #%s = %s BTC @ $%s' % (sidedict[side],x+1,randomchunk,loop_price)
-        result = exchangeobject.order_new(side, randomchunk, loop_price)  
-        if result:
-            if not("error" in result):
-                orderids.append(result[mapdict[exchangename]])
-        else:
-            return
-        if silent == False:
-            if result:
-                if not("error" in result):
-                    print "Order submitted. orderID is: %s" % result[mapdict[exchangename]]
-                elif "error" in result:
-                    print "Order was submitted but failed because: %s" % result["error"]
+            print '%sing... Chunk #%s = %s BTC @ $%s' % (sidedict[side],r.index+1,randomchunk,loop_price)
+            if r.ok:
+                print "Order submitted. orderID is: %s" % r.result[mapdict[exchangename]]
+            elif isinstance(r.result, dict) and "error" in r.result:
+                print "Order was submitted but failed because: %s" % r.result["error"]
             else:
                 print "Order failed."
-
-        loop_price += price_chunk
+    if silent == False and len(results) > 1:
+        print "%s of %s orders placed in %.2f seconds" % (len(orderids), len(results), results.elapsed)
 
     return orderids
         
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# consolidatedbook.py
+# One order book merged from every exchange we trade on (MtGox, Bitstamp,
+# Bitfloor, BTC-e). Used by bin/consolidated_book.py
+#
+# Every venue's levels are normalised from its own precision (cPrec/bPrec,
+# or the MtGox 1E5/1E8 integers) into one fixed-point scale, the MtGox one:
+#     price * 1E5, volume * 1E8
+# Per side the book keeps a sorted list of price keys (bids negated so both
+# sides walk from the best price) and for every price the volume per venue.
+# A source refresh only touches the levels that actually changed:
+#   best_bid()/best_ask()   O(1)
+#   a changed level         O(log n) to find it, a new or emptied price also
+#                           moves the keys after it (list insert/delete, a
+#                           memmove, O(n) but cheap for a few thousand levels)
+#   volume_to(), depth()    O(log n): the volume and price*volume per level
+#                           are kept in Fenwick trees (prefix sums) over an
+#                           index of the prices, a changed level is an
+#                           O(log n) update of both. Emptied prices keep
+#                           their slot, a price that is new to the index
+#                           has the trees rebuilt (compacted) over the
+#                           current prices, O(n), on the next query.
+
+import bisect
+import collections
+import threading
+import time
+import traceback
+import logging
+
+from book import scaleint, decimalplaces
+
+PRICE_PLACES = 5
+VOLUME_PLACES = 8
+PRICE_SCALE = 10 ** PRICE_PLACES
+VOLUME_SCALE = 10 ** VOLUME_PLACES
+
+#price/volume are ints in the common scale, venues is {venue: volume}
+Level = collections.namedtuple('Level', 'price volume venues')
+#how far into the book an amount goes: the last price touched, the
+#volume actually available (can be less than asked for) and its cost
+#in price*volume units (PRICE_SCALE*VOLUME_SCALE)
+Fill = collections.namedtuple('Fill', 'price volume cost')
+
+
+def _scaler(places, common):
+    """function converting an int with <places> decimals to the common scale"""
+    if places <= common:
+        factor = 10 ** (common - places)
+        return lambda n: n * factor
+    divisor = 10 ** (places - common)
+    return lambda n: n // divisor
+
+
+class _Fenwick(object):
+    """prefix sums over a fixed number of slots (a Fenwick tree),
+    add() and sum() are O(log n)"""
+    def __init__(self, values):
+        tree = [0]
+        tree.extend(values)
+        n = len(tree) - 1
+        for i in xrange(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+        self.top = 1
+        while self.top * 2 <= n:
+            self.top *= 2
+
+    def add(self, i, delta):
+        """add delta to slot i (0 based)"""
+        tree = self.tree
+        n = len(tree)
+        i += 1
+        while i < n:
+            tree[i] += delta
+            i += i & -i
+
+    def sum(self, i):
+        """sum of the first i slots"""
+        tree = self.tree
+        total = 0
+        while i:
+            total += tree[i]
+            i &= i - 1
+        return total
+
+    def search(self, amount):
+        """the number of leading slots whose sum stays below amount, ie: the
+        (0 based) slot where the running sum reaches amount"""
+        tree = self.tree
+        n = len(tree) - 1
+        pos = 0
+        step = self.top
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] < amount:
+                pos = nxt
+                amount -= tree[nxt]
+            step >>= 1
+        return pos
+
+
+class _Side(object):
+    """one side of the consolidated book"""
+    def __init__(self, descending):
+        self.sign = -1 if descending else 1
+        self.keys = []          #sign*price, ascending = best first
+        self.volume = {}        #key -> total volume of all venues
+        self.venues = {}        #key -> {venue: volume}
+        self._index = []        #keys the trees have a slot for, emptied ones stay
+        self._vol = _Fenwick([])
+        self._cost = _Fenwick([])   #price*volume
+        self._stale = False     #a key without a slot was added, rebuild
+
+    def set(self, venue, price, volume):
+        """set the volume one venue has at a price (0 removes it)"""
+        key = price * self.sign
+        venues = self.venues.get(key)
+        old = venues.get(venue, 0) if venues else 0
+        if volume == old:
+            return
+        i = bisect.bisect_left(self.keys, key)
+        if venues is None:
+            self.keys.insert(i, key)
+            venues = self.venues[key] = {}
+        if volume:
+            venues[venue] = volume
+        else:
+            del venues[venue]
+        if venues:
+            self.volume[key] = self.volume.get(key, 0) - old + volume
+        else:
+            del self.keys[i]
+            del self.venues[key]
+            del self.volume[key]
+        if self._stale:
+            return
+        slot = bisect.bisect_left(self._index, key)
+        if slot < len(self._index) and self._index[slot] == key:
+            delta = volume - old
+            self._vol.add(slot, delta)
+            self._cost.add(slot, price * delta)
+        else:
+            self._stale = True
+
+    def _trees(self):
+        """rebuild the trees over the current keys once new prices came in"""
+        if not self._stale:
+            return
+        sign = self.sign
+        volume = self.volume
+        self._index = list(self.keys)
+        self._vol = _Fenwick([volume[key] for key in self._index])
+        self._cost = _Fenwick([key * sign * volume[key] for key in self._index])
+        self._stale = False
+
+    def best(self):
+        if not self.keys:
+            return None
+        key = self.keys[0]
+        return Level(key * self.sign, self.volume[key], dict(self.venues[key]))
+
+    def level(self, i):
+        key = self.keys[i]
+        return Level(key * self.sign, self.volume[key], dict(self.venues[key]))
+
+    def volume_to(self, price):
+        """total volume from the best price up to and including price"""
+        self._trees()
+        return self._vol.sum(bisect.bisect_right(self._index, price * self.sign))
+
+    def depth(self, amount):
+        """walk the book until amount is filled"""
+        self._trees()
+        if not self.keys:
+            return Fill(None, 0, 0)
+        n = len(self._index)
+        total = self._vol.sum(n)
+        if amount > total:
+            return Fill(self.keys[-1] * self.sign, total, self._cost.sum(n))
+        if amount <= 0:
+            return Fill(self.keys[0] * self.sign, amount, 0)
+        slot = self._vol.search(amount)
+        price = self._index[slot] * self.sign
+        before = self._vol.sum(slot)
+        cost = self._cost.sum(slot)
+        return Fill(price, amount, cost + price * (amount - before))
+
+    def venue_levels(self, venue):
+        """{price: volume} of one venue on this side"""
+        sign = self.sign
+        return dict((key * sign, venues[venue]) for key, venues in self.venues.iteritems()
+                    if venue in venues)
+
+
+class ConsolidatedBook(object):
+    """Usage: cbook = ConsolidatedBook()
+        cbook.update_book("bitstamp", bitstamp.entirebook())
+        cbook.update_orderbook("mtgox", gox.orderbook)
+        print cbook.best_bid(), cbook.best_ask()
+    All prices/volumes going in and out are ints in the common scale,
+    use price()/volume() to turn them into floats for display."""
+    def __init__(self):
+        self.bids = _Side(True)
+        self.asks = _Side(False)
+        self.lock = threading.RLock()
+        self.version = 0                #bumped on every update that changed something
+        self.updated = {}               #venue -> time of its last update
+        self._levels = {}               #venue -> ({bid price:vol}, {ask price:vol})
+
+    def _side(self, side):
+        return self.bids if side in ("bids", "bid") else self.asks
+
+    #### updates
+
+    def update(self, venue, bids, asks, cPrec, bPrec):
+        """replace everything a venue has in the book with new levels.
+        bids/asks are iterables of (price_int, volume_int) in the venue's own
+        precision. Only the levels that differ from the venue's previous
+        update are touched. Returns the number of levels changed."""
+        pscale = _scaler(decimalplaces(cPrec), PRICE_PLACES)
+        vscale = _scaler(decimalplaces(bPrec), VOLUME_PLACES)
+        new = []
+        for levels in (bids, asks):
+            merged = {}
+            for price, volume in levels:
+                price = pscale(price)
+                merged[price] = merged.get(price, 0) + vscale(volume)
+            new.append(merged)
+        with self.lock:
+            old = self._levels.get(venue, ({}, {}))
+            changed = 0
+            for side, before, after in ((self.bids, old[0], new[0]), (self.asks, old[1], new[1])):
+                for price in before:
+                    if price not in after:
+                        side.set(venue, price, 0)
+                        changed += 1
+                for price, volume in after.iteritems():
+                    if before.get(price) != volume:
+                        side.set(venue, price, volume)
+                        changed += 1
+            self._levels[venue] = (new[0], new[1])
+            self.updated[venue] = time.time()
+            if changed:
+                self.version += 1
+        return changed
+
+    def set_level(self, venue, side, price, volume):
+        """incremental update of a single level, price/volume already in the
+        common scale (ie: straight from MtGox's signal_depth)"""
+        with self.lock:
+            levels = self._levels.setdefault(venue, ({}, {}))[0 if side in ("bids", "bid") else 1]
+            if volume > 0:
+                levels[price] = volume
+            else:
+                volume = 0
+                levels.pop(price, None)
+            self._side(side).set(venue, price, volume)
+            self.updated[venue] = time.time()
+            self.version += 1
+
+    def remove(self, venue):
+        """take a venue out of the book completely"""
+        with self.lock:
+            bids, asks = self._levels.pop(venue, ({}, {}))
+            for price in bids:
+                self.bids.set(venue, price, 0)
+            for price in asks:
+                self.asks.set(venue, price, 0)
+            self.updated.pop(venue, None)
+            self.version += 1
+
+    def update_book(self, venue, book):
+        """update from a book.Book, in integer mode or with Decimal orders"""
+        if book.cPrec is not None:
+            return self.update(venue, [(o.price_int, o.volume_int) for o in book.bids],
+                               [(o.price_int, o.volume_int) for o in book.asks],
+                               book.cPrec, book.bPrec)
+        return self.update(venue, [(scaleint(o.price, PRICE_PLACES), scaleint(o.volume, VOLUME_PLACES)) for o in book.bids],
+                           [(scaleint(o.price, PRICE_PLACES), scaleint(o.volume, VOLUME_PLACES)) for o in book.asks],
+                           '0.00001', '0.00000001')
+
+    def update_orderbook(self, venue, orderbook, lock=None):
+        """update from the live mtgox_prof7bitapi OrderBook (MtGox ints).
+        Pass Signal._lock as lock when the socket thread is running."""
+        lock = lock or self.lock
+        with lock:
+            bids = [(o.price, o.volume) for o in orderbook.bids]
+            asks = [(o.price, o.volume) for o in orderbook.asks]
+        return self.update(venue, bids, asks, '0.00001', '0.00000001')
+
+    def update_depth(self, venue, depth, cPrec, bPrec):
+        """update from a plain {'bids':[[price,amount],..],'asks':..} depth
+        (btc-e, bitfloor L2) rounded to cPrec/bPrec"""
+        cplaces = decimalplaces(cPrec)
+        bplaces = decimalplaces(bPrec)
+        return self.update(venue, [(scaleint(l[0], cplaces), scaleint(l[1], bplaces)) for l in depth['bids']],
+                           [(scaleint(l[0], cplaces), scaleint(l[1], bplaces)) for l in depth['asks']],
+                           cPrec, bPrec)
+
+    def slot_depth(self, venue):
+        """return a slot for Gox.signal_depth that keeps one venue updated
+        level by level. Signal only holds weak references, keep it alive:
+            slot = cbook.slot_depth("mtgox")
+            gox.signal_depth.connect(slot)"""
+        def slot(dummy_sender, data):
+            (typ, price, dummy_voldiff, total_vol) = data
+            self.set_level(venue, "asks" if typ == "ask" else "bids", price, total_vol)
+        return slot
+
+    #### queries
+
+    def best_bid(self):
+        with self.lock:
+            return self.bids.best()
+
+    def best_ask(self):
+        with self.lock:
+            return self.asks.best()
+
+    def bbo(self):
+        """(best bid, best ask) across all venues, each a Level or None"""
+        with self.lock:
+            return self.bids.best(), self.asks.best()
+
+    def spread(self):
+        with self.lock:
+            bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return ask.price - bid.price
+
+    def volume_to(self, side, price):
+        """consolidated volume from the best price through price"""
+        with self.lock:
+            return self._side(side).volume_to(price)
+
+    def depth(self, side, amount):
+        """Fill(price, volume, cost) of taking amount off one side
+        ("asks" to buy, "bids" to sell) across all venues"""
+        with self.lock:
+            return self._side(side).depth(amount)
+
+    def levels(self, side, count=15):
+        """the best count Levels of one side"""
+        with self.lock:
+            s = self._side(side)
+            return [s.level(i) for i in xrange(min(count, len(s.keys)))]
+
+    def venue_levels(self, venue, side):
+        with self.lock:
+            return self._side(side).venue_levels(venue)
+
+
+def price(n):
+    return n / 1E5
+
+def volume(n):
+    return n / 1E8
+
+
+class Poller(object):
+    """Usage: poller = Poller(cbook)
+        poller.add("bitstamp", bitstamp.entirebook, 10)
+        poller.start()
+    refreshes every source in its own thread every <interval> seconds.
+    fetch() returns a book.Book, it is merged with update_book."""
+    def __init__(self, cbook):
+        self.cbook = cbook
+        self.sources = []
+        self._stop = threading.Event()
+        self._threads = []
+
+    def add(self, venue, fetch, interval):
+        self.sources.append((venue, fetch, interval))
+
+    def start(self):
+        for venue, fetch, interval in self.sources:
+            thread = threading.Thread(target=self._run, args=(venue, fetch, interval))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, venue, fetch, interval):
+        while not self._stop.is_set():
+            try:
+                self.cbook.update_book(venue, fetch())
+            except Exception:
+                logging.error(traceback.format_exc())
+            self._stop.wait(interval)
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from bisect import bisect_left, bisect_right
 import cjson
 import sys
 import time
 
+import pricebuckets
+
 class InputError(Exception):
     def __init__(self, message, arg=None, kind=None):
         if arg:
@@ -14,6 +17,9 @@ class InputError(Exception):
             self.arg = u""
         Exception.__init__(self, message)
 
+class MtGoxError(Exception):
+    pass
+
 class JsonParser:
     @staticmethod
     def parse(obj, force = False):
@@ -30,6 +36,34 @@ class JsonParser:
         u"Build json-strings from object(s)."
         return cjson.encode(obj)
 
+class _PriceColumn(object):
+    u"Read-only view of the integer prices of a list of orders, so bisect" \
+    u" can search the depth-table without converting all of it."
+    def __init__(self, orders):
+        self.orders = orders
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __getitem__(self, i):
+        return int(self.orders[i][u"price_int"])
+
+def _reverse(seq):
+    u"Reverse an xrange of indexes."
+    if len(seq) < 2:
+        return seq
+    step = seq[1] - seq[0]
+    return xrange(seq[-1], seq[0] - step, -step)
+
+def _head(seq, n):
+    u"First n indexes of an xrange."
+    if n >= len(seq):
+        return seq
+    if n < 2:
+        return xrange(seq[0], seq[0] + 1) if n else xrange(0)
+    step = seq[1] - seq[0]
+    return xrange(seq[0], seq[0] + n * step, step)
+
 class DepthParser(object):
     def __init__(self, currencyDecimals, args = []):
         self._cPrec = Decimal(1) / 10 ** currencyDecimals
@@ -223,9 +257,10 @@ class DepthParser(object):
         for side in self.__sides:
             # Parse sides independently
             orders = json[side]
+            prices = _PriceColumn(orders)
             # Read lowest and highest price of orders on current side
-            lowest  = int(orders[0][u"price_int"])
-            highest = int(orders[-1][u"price_int"])
+            lowest  = prices[0]
+            highest = prices[-1]
             # Convert minimum and maximum price from arguments to int
             #  and check if any orders are within that range.
             if oMinPrice == None: minPrice = None
@@ -257,83 +292,94 @@ class DepthParser(object):
                      maxValue,
                      cumulate,
                      iv )):
+                # From here on orders are only referenced by their index in
+                #  the table, lowest price first. Nothing is copied or
+                #  converted until we know which rows will be returned.
+                seq      = xrange(len(orders))
+                rows     = None
+                stripped = False
                 if any((minPrice, maxPrice)):
-                    # Get generator yielding orders within given pricerange.
+                    # Get indexes of orders within given pricerange.
                     if minPrice == None: minPrice = lowest
                     if maxPrice == None: maxPrice = highest
-                    orders = self._stripRange(
-                        orders,
+                    seq = self._stripRange(
+                        orders, prices,
                         side,
                         minPrice,
                         maxPrice
                         )
+                    stripped = True
                 if any((maxAmount, maxValue)):
                     # Filter orders from price and out, only keeping those
                     #  that have either lower value or amount (cumulated).
-                    orders = self._processList(
-                        orders, side,
+                    #  When stepping, only the cut-off is needed.
+                    seq, rows = self._processList(
+                        orders, seq, side,
+                        flip      = not stripped,
                         precision = cPrec,
                         cumulate  = False if steps else cumulate,
                         maxAmount = maxAmount,
                         maxValue  = maxValue,
-                        iv        = False if steps else iv
+                        iv        = False if steps else iv,
+                        build     = not steps
                         )
+                    stripped = False
                 elif not steps and any((iv, cumulate)):
                     # If no other option is set except possibly min-/maxPrice,
                     #  add value-item to orders and/or cumulate list.
-                    orders = self._processList(
-                        orders, side,
+                    seq, rows = self._processList(
+                        orders, seq, side,
+                        flip      = not stripped,
                         precision = cPrec,
                         cumulate  = cumulate,
                         iv        = iv
                         )
                 if steps:
-                    if any((maxAmount, maxValue, minPrice, maxPrice)) and orders:
+                    if any((maxAmount, maxValue, minPrice, maxPrice)):
                         # Slice list into <steps> slices and then merge
                         #  them into one order per slice.
-                        if any((maxAmount, maxValue)):
-                            if side == "asks":
-                                min = int( orders[0]["price_int"])
-                                max = int(orders[-1]["price_int"])
+                        rows = []
+                        if len(seq):
+                            if any((maxAmount, maxValue)):
+                                if side == "asks":
+                                    min = prices[seq[0]]
+                                    max = prices[seq[-1]]
+                                else:
+                                    min = prices[seq[-1]]
+                                    max = prices[seq[0]]
                             else:
-                                min = int(orders[-1]["price_int"])
-                                max = int( orders[0]["price_int"])
-                        else:
-                            min = minPrice
-                            max = maxPrice
-                        orders = self._stepList(
-                            orders, side,
-                            min, max
-                            )
+                                min = minPrice
+                                max = maxPrice
+                            rows = self._stepList(
+                                orders, seq, side,
+                                min, max,
+                                flip = not stripped
+                                )
                         # Flip back orderlist and resturn
-                        if side == "bids":
-                            try:
-                                # Reverse list from processList
-                                orders = reversed(orders)
-                            except TypeError:
-                                # Reverse generator from stripRange
-                                orders = list(orders)
-                                orders.reverse()
+                        if side == "bids": rows.reverse()
                     else:
                         # Grab speciefied amount of orders closest to price.
                         if side == "asks":
-                            orders = orders[:steps]
+                            seq = xrange(*slice(None, steps).indices(len(seq)))
                         else:
-                            orders = orders[steps*-1:]
+                            seq = xrange(*slice(steps*-1, None).indices(len(seq)))
                         if cumulate or iv:
                             # Iterate and sum previous orders
-                            orders = self._processList(
-                                orders, side,
+                            seq, rows = self._processList(
+                                orders, seq, side,
                                 precision = cPrec,
                                 cumulate  = cumulate,
                                 iv        = iv
                                 )
                             # Flip back orderlist and resturn
-                            if side == "bids": orders = reversed(orders)
+                            if side == "bids": rows.reverse()
+                        else:
+                            rows = [orders[i] for i in seq]
                 else:
                     # Flip back orderlist and resturn
-                    if not isinstance(orders, list): orders = list(orders)
-                    if side == "bids": orders = reversed(orders)
+                    if rows is None: rows = [orders[i] for i in seq]
+                    if side == "bids": rows.reverse()
+                orders = rows
             table[side] = list(orders)
         json = {
                 "return":table,
@@ -401,177 +447,111 @@ class DepthParser(object):
                     orders.append(order)
             return orders if side == "ask" else reversed(orders)
 
-    def _stepList(self, orders, side, min, max):
-        u"Slice a big list of orders and merge each slice to one order," + \
-        u" lists of bids needs to be reversed when passed as argument."
+    def _flip(self, first, last):
+        u"Bids are walked from the highest price down. Lists of bids always" \
+        u" used to be checked for that by comparing their first and last" \
+        u" order-dicts, which is kept so results stay the same."
+        return last < first
+
+    def _stepList(self, orders, seq, side, low, high, flip = True):
+        u"Slice a big list of orders and merge each slice to one order." \
+        u" The slicing itself is done by pricebuckets.walk."
+        if side == "bids" and flip and len(seq):
+            # Reverse if not allready done (output of processList, the rows
+            #  there have had their amounts rewritten by _manipulateOrder)
+            touched = lambda i: self._manipulateOrder(
+                dict(orders[i]),
+                amount_int = int(orders[i][u"amount_int"]),
+                precision  = self._cPrec
+                )
+            if self._flip(touched(seq[0]), touched(seq[-1])):
+                seq = _reverse(seq)
+        # Integer columns of the orders to walk
+        P = [int(orders[i][u"price_int"]) for i in seq]
+        A = [int(orders[i][u"amount_int"]) for i in seq]
+        S = [int(orders[i][u"stamp"]) for i in seq]
+        buckets = pricebuckets.walk(P, A, self.steps, low, high,
+                                    descending = side == "bids")
         stepList = list()
-        if side == "asks":
-            stepSize = (max - min) / self.steps
-            # Price increases for each ask
-            stepEnd = min + stepSize
-            withinStep = lambda orderPrice: orderPrice <= stepEnd
-        else:
-            # Reverse if not allready done (roughly tuple/list, not generator)
-            if hasattr(orders, "__getitem__"):
-                if orders[-1] < orders[0]:
-                    orders = reversed(orders)
-            # Price decreases for each bid
-            stepSize = (max - min) * -1 / self.steps
-            withinStep = lambda orderPrice: orderPrice >= stepEnd
-            stepEnd = max + stepSize
-        if self.iv:
-            # Values included in orders
-            calcStep = lambda amount, orderAmount, orderPrice, value: \
-                ( amount + orderAmount , value + (orderAmount * orderPrice) )
-        else:
-            # Don't include value
-            calcStep = lambda amount, orderAmount, orderPrice, value: \
-                ( amount + orderAmount, False )
-        amount,value,stamp = 0,0,0
-        for order in orders:
-            orderPrice  = int(order["price_int"])
-            orderAmount = int(order["amount_int"])
-            orderStamp  = int(order["stamp"])
-            if withinStep(orderPrice):
-                # Return total amount and value of step
-                amount, value = calcStep(amount, orderAmount, orderPrice, value)
-                price         = orderPrice
-                # Replace stamp if this one is newer
-                if stamp < orderStamp: stamp = orderStamp
+        totalV = 0
+        for bucket in buckets:
+            # Values are only summed when asked for
+            if self.iv:
+                value   = sum(P[k] * A[k] for k in xrange(bucket.start, bucket.end))
+                totalV += value
             else:
-                stepList.append(
-                    self._manipulateOrder(
-                        dict(),
-                        price_int  = price,
-                        amount_int = amount,
-                        stamp      = stamp,
-                        precision  = self._cPrec,
-                        iv         = value
-                        )
-                    )
-                # Set Amount,Value,Stamp to this order's values
-                if not self.cumulate:
-                    amount, value = calcStep(0, orderAmount, orderPrice, 0)
-                stamp = orderStamp
-                # Set next step end
-                stepEnd += stepSize
-        else:
-            if withinStep(price):
-                # Add step if orders has been parsed since last step was added
-                stepList.append(
-                    self._manipulateOrder(
-                        dict(),
-                        price_int  = price,
-                        amount_int = amount,
-                        stamp      = stamp,
-                        precision  = self._cPrec,
-                        iv         = value
-                        )
+                value   = False
+            stepList.append(
+                self._manipulateOrder(
+                    dict(),
+                    price_int  = bucket.price,
+                    amount_int = bucket.total if self.cumulate else bucket.volume,
+                    stamp      = max(S[bucket.start:bucket.end]),
+                    precision  = self._cPrec,
+                    iv         = totalV if self.cumulate else value
                     )
+                )
         return stepList
 
-    def _stripRange(self, orders, side, minPrice, maxPrice):
-        u"Strip list of all orders outside of the range between minPrice" + \
-        u" and maxPrice. All generator-objects is treated like they're"   + \
-        u" allready reversed when parsing bids."
+    def _stripRange(self, orders, prices, side, minPrice, maxPrice):
+        u"Return indexes of all orders within the range between minPrice" + \
+        u" and maxPrice, found by bisecting the (ascending) table."   + \
+        u" Bids are returned from the highest price down."
         if side == "asks":
-            # Allow all orders above minPrice
-            withinRange = lambda price: int(price) >= minPrice
-            # Break when iteration has reached order above maxPrice
-            breakPoint  = lambda price: int(price) >  maxPrice
-        else:
-            if hasattr(orders, "__getitem__"):
-                if orders[-1] < orders[0]:
-                    orders = reversed(orders)
-            # Allow all orders below maxPrice
-            withinRange = lambda price: int(price) <= maxPrice
-            # Break when iteration has reached order below minPrice
-            breakPoint  = lambda price: int(price) <  minPrice
-        # Iterate over list,
-        #  Asks: Low  -> High
-        #  Bids: High -> Low
-        for order in orders:
-            if withinRange(order[u"price_int"]):
-                if breakPoint(order[u"price_int"]):
-                    break
-                else:
-                    yield order
+            #  Asks: Low  -> High
+            return xrange(bisect_left(prices, minPrice),
+                          bisect_right(prices, maxPrice))
+        if self._flip(orders[0], orders[-1]):
+            #  Bids: High -> Low
+            return xrange(bisect_right(prices, maxPrice) - 1,
+                          bisect_left(prices, minPrice) - 1, -1)
+        # Table was not reversed, bids below minPrice end the walk at once
+        if prices[0] < minPrice:
+            return xrange(0)
+        return xrange(0, bisect_right(prices, maxPrice))
 
     def _processList(self,
-            orders, side,
+            orders, seq, side,
+            flip      = True,
             cumulate  = False,
             precision = None,
             maxAmount = False,
             maxValue  = False,
-            iv        = False):
-        u"Iterates over orders. Adds value and/or cumulate amounts. If list" + \
-        u" is a generator it is bids being parsed the generator needs to"    + \
-        u" contain a reversed list."
-        latestStamp = 0
+            iv        = False,
+            build     = True):
+        u"Iterates over the orders at the indexes in seq. Adds value and/or"  + \
+        u" cumulate amounts. Returns the indexes that were kept and, unless"  + \
+        u" build is False, the rewritten orders."
         totalA  = 0
         totalV  = 0
-        current = []
-        # Reverse bid-orders if not allready done or if object is a generator.
-        if side == "bids" and hasattr(orders, "__getitem__"):
-            if orders[1] < orders[0]:
-                orders = reversed(orders)
-        # Set up lambdas to get rid of some code when iterating over orders.
-        if iv:
-            # Generated orders will Include Values, ->
-            if cumulate:
-                # -> and also be cumulated.
-                lambda_add = lambda order, amount, totalA, value, totalV: \
-                    self._manipulateOrder(
-                        order,
-                        amount_int = totalA,
-                        precision  = precision,
-                        iv         = totalV
-                        )
-            else:
-                # -> but will not be cumulated.
-                lambda_add = lambda order, amount, totalA, value, totalV: \
-                    self._manipulateOrder(
-                        order,
-                        amount_int = amount,
-                        precision  = precision,
-                        iv         = value
-                        )
-        else:
-            # Generated orders will not include values, ->
-            if cumulate:
-                # -> but will be cumulated.
-                lambda_add = lambda order, amount, totalA, value, totalV: \
-                    self._manipulateOrder(
-                        order,
-                        amount_int = totalA,
-                        precision  = precision
-                        )
-            else:
-                # -> neither will they be cumulated.
-                lambda_add = lambda order, amount, totalA, value, totalV: \
-                    self._manipulateOrder(
-                        order,
-                        amount_int = amount,
-                        precision  = precision
-                        )
-        for order in orders:
+        kept    = 0
+        current = [] if build else None
+        # Reverse bid-orders if not allready done.
+        if side == "bids" and flip:
+            if self._flip(orders[seq[0]], orders[seq[1]]):
+                seq = _reverse(seq)
+        for i in seq:
             # Read each order, decrementing by price if bids
             if maxAmount and totalA > maxAmount: break
             if maxValue and totalV > maxValue: break
+            order  = orders[i]
             amount = int(order[u"amount_int"])
-            price  = int(order[u"price_int"])
-            stamp  = int(order[u"stamp"])
-            value   = amount * price
+            value  = amount * int(order[u"price_int"])
             # Increase total amount and total value in currency
             totalA += amount
             totalV += value
-            if stamp < latestStamp:
-                latestStamp = stamp
-            # Generate new order and append to (current) orders
-            order   = lambda_add(order, amount, totalA, value, totalV)
-            current.append(order)
-        self.latestStamp = latestStamp
-        return current
+            kept   += 1
+            if build:
+                # Generate new order and append to (current) orders
+                current.append(
+                    self._manipulateOrder(
+                        order,
+                        amount_int = totalA if cumulate else amount,
+                        precision  = precision,
+                        iv         = (totalV if cumulate else value) if iv else False
+                        )
+                    )
+        return _head(seq, kept), current
 
     def _manipulateOrder(self, order,
             price_int  = False,
@@ -580,34 +560,34 @@ class DepthParser(object):
             precision  = False,
             iv         = False):
         u"Update existing order with new data such as price, amount or value."
-        bPrec = Decimal("0.00000001")
+        u" Integers are scaled by formatting them as exact decimal strings," \
+        u" which gives the same floats as the Decimal arithmetic did."
         if not any([price_int, amount_int, stamp, precision, iv]):
             return order
+        if precision:
+            places = -precision.as_tuple().exponent
         if price_int:
             # Converting price integer to decimal with proper length
             if precision:
-                # Converting amount integer to decimal with proper length
-                price = Decimal(price_int) * precision
-                price = price.quantize(precision)
                 # Saving as float for cjson encoding
-                order["price"]     = float(price)
+                order["price"]     = float("%de-%d" % (price_int, places))
                 order["price_int"] = price_int
             else:
                 raise AttributeError("precision")
         if amount_int:
             # Converting amount integer to decimal with proper length
-            amount = Decimal(amount_int) * bPrec
-            amount = amount.quantize(bPrec)
             # Saving as float for cjson encoding
-            order["amount"]     = float(amount)
+            order["amount"]     = float("%de-8" % amount_int)
             order["amount_int"] = str(amount_int)
         if stamp:
             # Replacing stamp
             order["stamp"] = str(stamp)
         if iv:
-            # Adds BTC value in currency to result
-            value = iv * precision * bPrec
-            value = value.quantize(precision)
-            order["value"]     = float(value)
+            # Adds BTC value in currency to result, rounded half-even to
+            #  the precision of the currency
+            value, rest = divmod(iv, 100000000)
+            if rest * 2 > 100000000 or (rest * 2 == 100000000 and value & 1):
+                value += 1
+            order["value"]     = float("%de-%d" % (value, places))
             order["value_int"] = int(iv)
-        return order
\ No newline at end of file
+        return order
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# feedmonitor.py
+# How healthy is the stream of a client? Every decoded message is counted
+# per feed (the client it came from) and per channel (depth, trade, ticker,
+# lag, result...):
+#     rate        messages per second over the last second
+#     gap         the time between two messages, as a moving average and a
+#                 histogram
+#     lag         what the exchange reports as its own lag (private=lag)
+#     skew        our clock minus the "now" stamp of the message, how old
+#                 a message is when it gets here (includes any clock offset)
+#     delay       the same without the clock offset, when a clocksync.ClockSync
+#                 is given: how much later than the fastest messages it came
+#
+# A checker thread looks at the watched feeds every <check> seconds. A feed
+# or channel is stalled when it is silent for longer than
+#     max(window, factor * the 99.9th percentile of its gaps)
+# so a busy depth channel is noticed after half a second and a quiet trade
+# channel only when it is quiet for much longer than it ever was. The
+# messages come at random (a 5 msg/s channel has a gap of over a second
+# every few minutes), a threshold on the average gap would fire on those.
+# A whole feed calls on_stall(feed, None, 1, silent) first and on_stall(feed,
+# None, 2, silent) every <escalate> seconds after that while it stays silent
+# (first try something cheap like a resubscribe, then reconnect). A channel
+# calls on_stall(feed, channel, 1, silent) once. on_recover(feed, channel,
+# silent) is called when RECOVER messages came since the stall, one stray
+# message does not end it.
+#
+#   monitor = FeedMonitor(window=0.5, clock=clocksync.clock)
+#   monitor.watch("socketio", on_stall, on_recover, channels=("depth", "ticker"))
+#   monitor.start()
+#   monitor.received("socketio", msg)   #for every decoded message
+#   print monitor.report()
+
+import threading
+import time
+
+import latency
+
+EWMA = 0.05                     #weight of a new gap in the average gap
+MINCOUNT = 20                   #messages before the gaps are trusted
+PERCENTILE = 99.9               #of the gaps, times factor is the stall limit
+REFRESH = 32                    #messages between two updates of the limit
+RECOVER = 3                     #messages after a stall before it is over
+
+
+class Channel(object):
+    """the numbers of one channel (or of a whole feed)"""
+    __slots__ = ('count', 'first', 'last', 'gap', 'gaps', 'rate', 'rate_start', 'rate_count',
+                 'lag', 'skew', 'skew_avg', 'skew_min', 'skew_max', 'delay', 'delay_max', 'stalled',
+                 'stalled_at', 'long_gap', 'long_gap_count')
+    def __init__(self):
+        self.count = 0
+        self.first = self.last = None   #monotonic
+        self.gap = None                 #average gap, seconds
+        self.gaps = latency.Histogram() #microseconds
+        self.rate = 0.0
+        self.rate_start = None
+        self.rate_count = 0
+        self.lag = None                 #seconds
+        self.skew = self.skew_avg = self.skew_min = self.skew_max = None   #seconds
+        self.delay = self.delay_max = None      #seconds
+        self.stalled = 0                #stall level, 0 while it is fine
+        self.stalled_at = 0             #count when it stalled
+        self.long_gap = None            #PERCENTILE of the gaps, seconds
+        self.long_gap_count = 0         #count when long_gap was updated
+
+    def arrived(self, now):
+        if self.last is None:
+            self.first = self.rate_start = now
+        else:
+            gap = now - self.last
+            self.gap = gap if self.gap is None else self.gap + EWMA * (gap - self.gap)
+            if not self.stalled:        #a stall would raise the limit of the next one
+                self.gaps.record(gap * 1E6)
+        self.last = now
+        self.count += 1
+        self.rate_count += 1
+        if now - self.rate_start >= 1.0:
+            self.rate = self.rate_count / (now - self.rate_start)
+            self.rate_start, self.rate_count = now, 0
+
+    def skewed(self, skew):
+        self.skew = skew
+        if self.skew_avg is None:
+            self.skew_avg = self.skew_min = self.skew_max = skew
+        else:
+            self.skew_avg += EWMA * (skew - self.skew_avg)
+            if skew < self.skew_min:
+                self.skew_min = skew
+            elif skew > self.skew_max:
+                self.skew_max = skew
+
+    def delayed(self, delay):
+        self.delay = delay
+        if self.delay_max is None or delay > self.delay_max:
+            self.delay_max = delay
+
+    def current_rate(self, now):
+        """the rate, or what it has dropped to when nothing came for a while"""
+        if self.rate_start is None:
+            return 0.0
+        if now - self.rate_start >= 2.0:
+            return self.rate_count / (now - self.rate_start)
+        return self.rate
+
+    def limit(self, window, factor, escalate):
+        """how long it may be silent before it counts as stalled"""
+        if self.count < MINCOUNT or self.gap is None:
+            return max(window, escalate)
+        if self.long_gap is None or self.count - self.long_gap_count >= REFRESH:
+            self.long_gap = self.gaps.percentile(PERCENTILE) / 1E6
+            self.long_gap_count = self.count
+        return max(window, factor * self.long_gap)
+
+    def stall(self, level):
+        if not self.stalled:
+            self.stalled_at = self.count
+        self.stalled = level
+
+    def recovered(self):
+        """enough messages came since the stall"""
+        return self.count - self.stalled_at >= RECOVER
+
+
+class Feed(object):
+    def __init__(self, name):
+        self.name = name
+        self.total = Channel()
+        self.channels = {}
+        self.watched = None             #(on_stall, on_recover, channels, active) when watched
+        self.since = latency.monotonic()        #silence is counted from here before the first message
+        self.escalated = 0              #when the last level 2 was called
+
+
+class FeedMonitor(object):
+    """Usage: monitor = FeedMonitor(window=0.5, factor=4.0, escalate=10, clock=clocksync.clock)
+        monitor.watch("socketio", on_stall, on_recover)
+        monitor.start()
+        monitor.received("socketio", msg)
+        monitor.report()"""
+    def __init__(self, window=0.5, factor=4.0, check=0.1, escalate=10.0, log=None, clock=None):
+        self.window = window            #shortest silence that is a stall, seconds
+        self.factor = factor            #...or this many times the long gaps (PERCENTILE)
+        self.check = check              #seconds between two checks
+        self.escalate = escalate        #seconds between the levels of a feed stall
+        self.log = log
+        self.clock = clock              #a ClockSync, gets the stamps of the messages
+        self.lock = threading.Lock()
+        self.feeds = {}
+        self.started = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _feed(self, name):
+        feed = self.feeds.get(name)
+        if feed is None:
+            feed = self.feeds[name] = Feed(name)
+        return feed
+
+    def received(self, name, msg):
+        """count a decoded message of feed <name>"""
+        now = latency.monotonic()
+        if msg.get("op") == "private":
+            channel = msg.get("private", "private")
+        else:
+            channel = msg.get("op", "?")
+        with self.lock:
+            feed = self._feed(name)
+            feed.total.arrived(now)
+            stats = feed.channels.get(channel)
+            if stats is None:
+                stats = feed.channels[channel] = Channel()
+            stats.arrived(now)
+            try:
+                if channel == "lag":
+                    stats.lag = msg["lag"]["age"] / 1E6
+                    return
+                elif channel in ("ticker", "depth"):
+                    stamp = int(msg[channel]["now"]) / 1E6
+                elif channel == "trade":
+                    stamp = int(msg["trade"]["tid"]) / 1E6      #the tid is the time of the trade in microseconds
+                else:
+                    return
+            except (KeyError, TypeError, ValueError):
+                return
+            stats.skewed(time.time() - stamp)
+        if self.clock is not None:
+            self.clock.sample(stamp, now)
+            delay = self.clock.delay(stamp, now)
+            with self.lock:
+                stats.delayed(delay)
+
+    def watch(self, name, on_stall, on_recover=None, channels=("depth", "ticker", "trade"), active=None):
+        """call on_stall(name, channel, level, silent) when the feed (channel
+        None) or one of the channels stalls, on_recover(name, channel, silent)
+        when it is back. Only checked while active() is True."""
+        with self.lock:
+            feed = self._feed(name)
+            feed.watched = (on_stall, on_recover, channels, active)
+            feed.since = latency.monotonic()
+
+    def restarted(self, name):
+        """the feed was (re)connected: its silence counts from now"""
+        with self.lock:
+            self._feed(name).since = latency.monotonic()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.check):
+            try:
+                self.check_feeds()
+            except Exception as exc:
+                if self.log:
+                    self.log("feedmonitor:", exc.__class__.__name__, exc)
+
+    def check_feeds(self, now=None):
+        """one round of the checker thread: call the stall/recover functions
+        of the watched feeds"""
+        if now is None:
+            now = latency.monotonic()
+        calls = []
+        with self.lock:
+            for feed in self.feeds.itervalues():
+                if feed.watched is None:
+                    continue
+                on_stall, on_recover, channels, active = feed.watched
+                if active is not None and not active():
+                    continue
+                #the whole feed
+                total = feed.total
+                last = max(total.last, feed.since)
+                silent = now - last
+                if silent > total.limit(self.window, self.factor, self.escalate):
+                    if not total.stalled:
+                        total.stall(1)
+                        feed.escalated = now
+                        calls.append((on_stall, (feed.name, None, 1, silent)))
+                    elif now - feed.escalated >= self.escalate:
+                        total.stall(2)
+                        feed.escalated = now
+                        calls.append((on_stall, (feed.name, None, 2, silent)))
+                    continue        #the channels of a silent feed are silent too
+                if total.stalled:
+                    if total.last < feed.since or not total.recovered():
+                        continue
+                    total.stalled = 0
+                    if on_recover:
+                        calls.append((on_recover, (feed.name, None, silent)))
+                #each channel
+                for channel in channels:
+                    stats = feed.channels.get(channel)
+                    if stats is None or stats.count < MINCOUNT:
+                        continue
+                    silent = now - max(stats.last, feed.since)
+                    if silent > stats.limit(self.window, self.factor, self.escalate):
+                        if not stats.stalled:
+                            stats.stall(1)
+                            calls.append((on_stall, (feed.name, channel, 1, silent)))
+                    elif stats.stalled and stats.recovered():
+                        stats.stalled = 0
+                        if on_recover:
+                            calls.append((on_recover, (feed.name, channel, silent)))
+        #called without the lock, they may take a while (reconnect)
+        for function, args in calls:
+            if self.log:
+                self.log("feed %s%s %s after %.3fs" % (args[0], "" if args[1] is None else "/" + args[1],
+                         "stalled (level %d)" % args[2] if len(args) == 4 else "recovered", args[-1]))
+            function(*args)
+
+    def stats(self):
+        """{feed: {channel: {...}}} with the numbers of every feed, the whole
+        feed under the channel "*"; times in seconds"""
+        now = latency.monotonic()
+        result = {}
+        with self.lock:
+            for feed in self.feeds.itervalues():
+                channels = result[feed.name] = {}
+                for channel, stats in [("*", feed.total)] + sorted(feed.channels.items()):
+                    channels[channel] = {
+                        "count": stats.count,
+                        "rate": stats.current_rate(now),
+                        "gap": stats.gap,
+                        "gap_p50": stats.gaps.percentile(50) / 1E6 if stats.gaps.count else None,
+                        "gap_p99": stats.gaps.percentile(99) / 1E6 if stats.gaps.count else None,
+                        "gap_max": stats.gaps.max / 1E6 if stats.gaps.count else None,
+                        "silent": now - stats.last if stats.last is not None else None,
+                        "lag": stats.lag,
+                        "skew": stats.skew, "skew_avg": stats.skew_avg,
+                        "skew_min": stats.skew_min, "skew_max": stats.skew_max,
+                        "delay": stats.delay, "delay_max": stats.delay_max,
+                        "stalled": stats.stalled}
+        return result
+
+    def report(self):
+        """the table of all feeds and channels, times in milliseconds"""
+        def ms(value):
+            return "%9.1f" % (value * 1E3) if value is not None else "%9s" % "-"
+        lines = ["%-22s %8s %7s %s" % ("feed/channel", "count", "msg/s", " ".join("%9s" % title for title in
+                 ("gap avg", "gap p50", "gap p99", "gap max", "silent", "lag", "skew", "delay", "delay max")))]
+        stats = self.stats()
+        for name in sorted(stats):
+            for channel in sorted(stats[name]):
+                s = stats[name][channel]
+                lines.append("%-22s %8d %7.1f %s%s" % (name if channel == "*" else "  " + channel, s["count"], s["rate"],
+                             " ".join(ms(s[key]) for key in ("gap", "gap_p50", "gap_p99", "gap_max", "silent", "lag",
+                                                              "skew", "delay", "delay_max")),
+                             "  STALLED" if s["stalled"] else ""))
+        return "\n".join(lines)
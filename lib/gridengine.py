@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# gridengine.py
+# The liquidbot grid, driven by order events instead of polling. A ladder
+# of buys below and sells above a center price, every <interval> (a
+# fraction, 0.01 = 1%) apart. When an order of the grid fills, the order on
+# the other side of it goes out right away (a filled buy at level i becomes
+# a sell at i+1, a filled sell at i becomes a buy at i-1) and both sides are
+# topped up to <pairs> orders again.
+#
+# The events come from a venue adapter:
+#   GoxVenue       the MtGox streaming API (signal_userorder)
+#   BitfloorVenue  REST only, a Reconciler with a short interval stands in
+#                  for the stream
+# Every venue also gets a Reconciler with a long interval: the REST list of
+# open orders is compared with the grid now and then, as a safety net for
+# events that were lost (socket reconnects and the like).
+#
+# A venue has place(side, price, amount) returning the order id (or None
+# when the id comes later through assign()), cancel(oid) and open_orders()
+# returning the ids of our open orders. filled(oid) is optional, without it
+# every order that disappears without being cancelled by the engine counts
+# as filled. filled() returns None when it can not tell (the exchange did
+# not answer), the order is then left for the next reconcile. The fills go to a lib/ledger.py Ledger when one is given.
+# When place() raises, the level is freed again and tried once more <retry>
+# seconds later (or the grid topped up if the level is taken by then).
+
+import threading
+import time
+import traceback
+from decimal import Decimal as D
+
+import asyncapi
+from book import scaleint
+
+
+def _print(message):
+    print message
+
+
+class GridEngine(object):
+    """Usage: grid = GridEngine(venue, D('120'), interval=D('0.01'), pairs=3, amount=D('0.1'))
+        venue.connect(grid)
+        grid.start()        #places the grid
+        ...
+        grid.stop()         #cancels it"""
+    def __init__(self, venue, center, interval, pairs, amount, cPrec=D('0.00001'),
+                 executor=None, log=_print, ledger=None, retry=5.0):
+        self.venue = venue
+        self.center = D(center)
+        self.interval = D(interval)
+        self.pairs = pairs
+        self.amount = D(amount)
+        self.cPrec = cPrec
+        self.executor = executor or asyncapi.default_executor
+        self.log = log
+        self.ledger = ledger
+        self.retry = retry          #seconds after a failed placement before the grid is topped up
+        self.lock = threading.RLock()
+        self.orders = {}            #index -> {"id":oid or None, "type":"buy"/"sell", "price":D, "updated":time}
+        self.byoid = {}             #oid -> index
+        self.pending = {}           #("buy"/"sell", price) -> index, sent but no oid yet
+        self.stopped = False
+        self.fills = 0
+        self.reaction = None        #seconds from the last fill event to its replacement being sent
+
+    def position(self, index):
+        return (self.center * (1 + self.interval) ** index).quantize(self.cPrec)
+
+    def start(self):
+        self.stopped = False
+        for i in range(1, self.pairs + 1):
+            self.place(-i, "buy")
+            self.place(i, "sell")
+
+    def stop(self):
+        """cancel every order of the grid and forget it (the removed events
+        of the cancels are ignored then)"""
+        with self.lock:
+            self.stopped = True
+            oids = self.byoid.keys()
+            self.orders.clear()
+            self.byoid.clear()
+            self.pending.clear()
+        for oid in oids:
+            self.venue.cancel(oid)
+
+    def place(self, index, side, event_time=None):
+        """send the order of level index (in the background). Nothing is
+        sent if the level already has an order."""
+        price = self.position(index)
+        with self.lock:
+            if self.stopped or index in self.orders:
+                return None
+            self.orders[index] = {"id": None, "type": side, "price": price, "updated": time.time()}
+            self.pending[(side, price)] = index
+        def send():
+            if event_time is not None:
+                self.reaction = time.time() - event_time
+            oid = self.venue.place(side, price, self.amount)
+            if oid is not None:
+                self.assign(side, price, oid)
+        future = self.executor.submit(send)
+        future.add_done_callback(lambda future: self._failed(future, index, side, price))
+        return future
+
+    def _failed(self, future, index, side, price):
+        """a placement that raised leaves its level free for the next try"""
+        exc = future.exception()
+        if exc is None:
+            return
+        self.log("grid: placing the %s order @ %s failed: %s" % (side, price, exc))
+        with self.lock:
+            if self.pending.get((side, price)) == index:
+                del self.pending[(side, price)]
+                order = self.orders.get(index)
+                if order is not None and order["id"] is None:
+                    del self.orders[index]
+        timer = threading.Timer(self.retry, self._replace, (index, side))
+        timer.daemon = True
+        timer.start()
+
+    def _replace(self, index, side):
+        """try the level of a failed placement again, or top the grid up
+        when something else took the level meanwhile"""
+        with self.lock:
+            if self.stopped:
+                return
+            if self.place(index, side) is None:
+                self.refill()
+
+    def assign(self, side, price, oid):
+        """the order sent for (side, price) got its id. False if the engine
+        is not waiting for such an order (not one of ours)."""
+        with self.lock:
+            index = self.pending.pop((side, D(price)), None)
+            if index is None:
+                return False
+            self.orders[index]["id"] = oid
+            self.orders[index]["updated"] = time.time()
+            self.byoid[oid] = index
+            return True
+
+    def removed(self, oid, filled=True):
+        """oid is gone from the venue: filled, or cancelled if not filled"""
+        event_time = time.time()
+        with self.lock:
+            index = self.byoid.pop(oid, None)
+            if index is None:
+                return
+            order = self.orders.pop(index)
+            if not filled:
+                self.log("grid: %s order %s @ %s was cancelled" % (order["type"], oid, order["price"]))
+                self.refill()
+                return
+            self.fills += 1
+            self.log("grid: %s order %s @ %s filled" % (order["type"], oid, order["price"]))
+            if order["type"] == "buy":
+                self.place(index + 1, "sell", event_time)
+            else:
+                self.place(index - 1, "buy", event_time)
+            self.refill()
+            if self.ledger is not None:
+                self.ledger.fill(order["type"], self.amount, order["price"], oid=oid, stamp=event_time)
+
+    def refill(self):
+        """top both sides up to <pairs> orders again"""
+        with self.lock:
+            num_buys = sum(1 for o in self.orders.itervalues() if o["type"] == "buy")
+            num_sells = len(self.orders) - num_buys
+            if not self.orders:
+                return
+            if num_buys < self.pairs:
+                low_index = min(self.orders.keys())
+                if num_buys == 0:
+                    # No buy orders left, so leave a gap
+                    low_index -= 1
+                for i in range(1, self.pairs - num_buys + 1):
+                    self.place(low_index - i, "buy")
+            if num_sells < self.pairs:
+                high_index = max(self.orders.keys())
+                if num_sells == 0:
+                    # No sell orders left, so leave a gap
+                    high_index += 1
+                for i in range(1, self.pairs - num_sells + 1):
+                    self.place(high_index + i, "sell")
+
+    def reconcile(self, open_ids, since=None):
+        """compare the grid with the venue's list of open order ids, every
+        order missing from it is handled as if its event had come in.
+        Orders placed or assigned after <since> (the time the list was
+        requested) can not be in it and are left alone."""
+        if since is None:
+            since = time.time()
+        open_ids = set(open_ids)
+        with self.lock:
+            missing = [oid for oid, index in self.byoid.iteritems()
+                       if oid not in open_ids and self.orders[index]["updated"] < since]
+        for oid in missing:
+            filled = True
+            if hasattr(self.venue, "filled"):
+                filled = self.venue.filled(oid)
+            if filled is None:
+                continue            #unknown, try again next time
+            self.removed(oid, filled)
+        return missing
+
+
+class Reconciler(object):
+    """Usage: safety = Reconciler(grid, interval=120)
+        safety.start()
+    Asks grid.venue for its open orders every interval seconds and hands
+    them to grid.reconcile()."""
+    def __init__(self, grid, interval=120):
+        self.grid = grid
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                since = time.time()
+                missing = self.grid.reconcile(self.grid.venue.open_orders(), since)
+                if missing:
+                    self.grid.log("grid: reconciled %d orders the events missed" % len(missing))
+            except Exception:
+                traceback.print_exc()
+
+
+class GoxVenue(object):
+    """Usage: venue = GoxVenue(gox, rest=mtgoxhmac.Client())
+        venue.connect(grid)
+    Orders go out over the socket (the ids come back in user_order
+    messages), rest is used for the open orders of the Reconciler and to
+    ask for the trades of a removed order."""
+    def __init__(self, gox, rest=None):
+        self.gox = gox
+        self.rest = rest
+        self.grid = None
+        self.cplaces = 3 if gox.currency == "JPY" else 5
+        self.executed = set()       #oids a user_order message showed (partly) executed
+
+    def connect(self, grid):
+        """subscribe grid to the order events (the Signals only hold weak
+        references, the venue has to be kept by the grid)"""
+        self.grid = grid
+        self.gox.signal_userorder.connect(self.slot_user_order)
+
+    def place(self, side, price, amount):
+        typ = "bid" if side == "buy" else "ask"
+        self.gox.order(typ, scaleint(price, self.cplaces), scaleint(amount, 8))
+        return None
+
+    def cancel(self, oid):
+        self.gox.cancel(oid)
+
+    def open_orders(self):
+        if self.rest is None:
+            return [order.oid for order in self.gox.orderbook.owns]
+        return [order["oid"] for order in self.rest.get_orders()["orders"]]
+
+    def slot_user_order(self, dummy_sender, data):
+        """Slot for signal_userorder"""
+        (price, volume, typ, oid, status) = data
+        grid = self.grid
+        if grid is None:
+            return
+        if status == "removed":
+            #filled() may ask the REST API, not on the socket thread
+            grid.executor.submit(self._removed, oid)
+            return
+        with grid.lock:
+            known = oid in grid.byoid
+        if not known:
+            side = "buy" if typ == "bid" else "sell"
+            grid.assign(side, D(price).scaleb(-self.cplaces), oid)
+        if status == "executing" or volume < scaleint(grid.amount, 8):
+            self.executed.add(oid)
+
+    def _removed(self, oid):
+        filled = self.filled(oid)
+        if filled is not None:
+            self.grid.removed(oid, filled)
+
+    def filled(self, oid):
+        """an order the user_order messages showed executing was filled.
+        Otherwise its trades are asked for by oid (None when that fails),
+        without rest it was cancelled by hand."""
+        with self.grid.lock:
+            index = self.grid.byoid.get(oid)
+            if index is None:
+                return True
+            side = self.grid.orders[index]["type"]
+        if oid in self.executed:
+            self.executed.discard(oid)
+            return True
+        if self.rest is None:
+            return False
+        try:
+            history = (self.rest.get_bid_history if side == "buy" else self.rest.get_ask_history)(oid)
+            return bool(history["return"]["trades"])
+        except Exception:
+            return None
+
+
+class BitfloorVenue(object):
+    """Usage: venue = BitfloorVenue(bitfloorapi.Client())
+    bitfloor has no order stream: run a Reconciler(grid, interval=1) as
+    the event source (one orders() call per second instead of the level 2
+    book plus order_info for every order)."""
+    def __init__(self, bitfloor):
+        self.bitfloor = bitfloor
+        self.grid = None
+
+    def connect(self, grid):
+        self.grid = grid
+
+    def place(self, side, price, amount):
+        result = self.bitfloor.order_new(0 if side == "buy" else 1, amount, price)
+        return result["order_id"]
+
+    def cancel(self, oid):
+        self.bitfloor.order_cancel(oid)
+
+    def open_orders(self):
+        return [order["order_id"] for order in self.bitfloor.orders()]
+
+    def filled(self, oid):
+        """None when order_info failed (it returns None then)"""
+        info = self.bitfloor.order_info(oid)
+        if not info or "status" not in info:
+            return None
+        return info["status"] == "filled"
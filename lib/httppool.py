@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# httppool.py
+# Shared keep-alive HTTP(S) connections for all the exchange clients.
+# Opening a new connection for every call costs a TCP and a TLS handshake
+# (several round trips to the exchange) before the request is even sent,
+# so connections are kept open per host and handed out again.
+#
+#   pool.request("POST", "https://api.bitfloor.com/order/new", body, headers)
+#       -> (status, headers, data)
+#   urlopen(urllib2.Request(...))   a drop in for urllib2.urlopen that goes
+#       through the pool and raises the same HTTPError/URLError
+#
+# Every host keeps at most <maxsize> idle connections, connections idle for
+# more than <idle> seconds are closed instead of reused, and so are idle
+# connections the server has closed meanwhile (readable before we asked).
+# A request is only sent again, once, on a new connection when a reused one
+# turns out to be stale before the server could have seen it: writing the
+# request failed with a broken pipe/reset, or (not for POST) the connection
+# closed without a single byte of answer. Never after a timeout and never a
+# POST that went out, that could be an order placed twice.
+#
+# Timeouts and SSL errors are raised by urlopen as they are (socket.timeout,
+# ssl.SSLError) like urllib2 does once it is connected, everything else as
+# urllib2.URLError.
+
+import collections
+import errno
+import httplib
+import select
+import socket
+import ssl
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from StringIO import StringIO
+
+#a write to a kept open connection the server has closed
+STALE_ERRNOS = frozenset([errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED])
+
+
+class HTTPPool(object):
+    """Usage: pool = HTTPPool(maxsize=4, idle=30)
+        status, headers, data = pool.request("GET", "https://www.bitstamp.net/api/ticker/")"""
+    def __init__(self, maxsize=4, idle=30, timeout=30, context=None):
+        self.maxsize = maxsize          #idle connections kept per host
+        self.idle = idle                #seconds before an idle connection is dropped
+        self.timeout = timeout
+        self.context = context          #ssl context for https (None = python's default)
+        self.lock = threading.Lock()
+        self._idle = {}                 #(scheme,host,port) -> deque of (connection, last used)
+        self.opened = 0                 #connections made so far
+        self.reused = 0                 #requests sent over an already open connection
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            if self.context is not None:
+                conn = httplib.HTTPSConnection(host, port, timeout=self.timeout, context=self.context)
+            else:
+                conn = httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+        conn.connect()
+        #small requests on a kept open connection must not wait for the ack
+        #of the previous packet (Nagle)
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            self.opened += 1
+        return conn
+
+    def _get(self, key):
+        """most recently used idle connection to a host, or None"""
+        now = time.time()
+        with self.lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn, used = idle.pop()
+                if now - used > self.idle:
+                    conn.close()
+                    #everything left in the deque is older still
+                    while idle:
+                        idle.pop()[0].close()
+                    break
+                if _alive(conn):
+                    self.reused += 1
+                    return conn
+                #closed by the server meanwhile
+                conn.close()
+        return None
+
+    def _put(self, key, conn):
+        with self.lock:
+            idle = self._idle.setdefault(key, collections.deque())
+            if len(idle) >= self.maxsize:
+                conn.close()
+            else:
+                idle.append((conn, time.time()))
+
+    def close(self):
+        """close every idle connection"""
+        with self.lock:
+            for idle in self._idle.itervalues():
+                while idle:
+                    idle.pop()[0].close()
+            self._idle = {}
+
+    def request(self, method, url, body=None, headers=None, timeout=None, sign=None, signlock=None):
+        """send one request, returns (status, headers, data) once the whole
+        response has been read. Connection errors raise socket.error or
+        httplib.HTTPException like httplib does.
+        sign() -> (body, extra headers) is called right before the request
+        is written, with signlock held until it is sent: requests signed
+        with increasing nonces then also go out in that order while the
+        responses are still read in parallel."""
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(headers or {})
+        headers.setdefault("Connection", "keep-alive")
+        timeout = timeout or self.timeout
+
+        conn = self._get(key)
+        reused = conn is not None
+        while True:
+            sent = False
+            try:
+                if conn is None:
+                    conn = self._connect(key)
+                conn.timeout = timeout
+                conn.sock.settimeout(timeout)
+                if sign is not None:
+                    with signlock or _nolock:
+                        body, extra = sign()
+                        conn.request(method, path, body, dict(headers, **extra))
+                else:
+                    conn.request(method, path, body, headers)
+                sent = True
+                response = conn.getresponse()
+            except (socket.error, httplib.HTTPException) as e:
+                if conn is not None:
+                    conn.close()
+                if reused and _stale(e, sent, method, sign):
+                    #the server dropped the idle connection, try a new one
+                    reused = False
+                    conn = None
+                    continue
+                raise
+            break
+        try:
+            data = response.read()
+        except:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+        return response.status, response.msg, data
+
+
+class _NoLock(object):
+    def __enter__(self):
+        pass
+    def __exit__(self, *exc):
+        return False
+
+_nolock = _NoLock()
+
+
+def _alive(conn):
+    """False when an idle connection has something to read: the server
+    closed it (or sent garbage), it must not be used again"""
+    try:
+        readable = select.select([conn.sock], [], [], 0)[0]
+    except (select.error, socket.error, ValueError, TypeError):
+        return False
+    return not readable
+
+def _stale(exc, sent, method, sign):
+    """True when a request on a reused connection failed in a way that
+    means the server never got it, so it may be sent again"""
+    if isinstance(exc, (socket.timeout, ssl.SSLError)):
+        return False
+    if not sent:
+        #writing the request failed
+        return isinstance(exc, socket.error) and exc.errno in STALE_ERRNOS
+    if method == "POST" or sign is not None:
+        #it went out, maybe the server has it
+        return False
+    #closed without a byte of answer
+    return isinstance(exc, httplib.BadStatusLine) and (exc.line in ("", "''") or
+                                                        exc.line.startswith("No status line"))
+
+pool = HTTPPool()
+
+
+def urlopen(req, data=None, timeout=None, sign=None, signlock=None):
+    """urllib2.urlopen through the shared pool. Takes a url or a
+    urllib2.Request, returns the usual response object (.read(), .info(),
+    .getcode()) and raises urllib2.HTTPError / urllib2.URLError, or
+    socket.timeout / ssl.SSLError as they are.
+    With sign (see HTTPPool.request) the request is a POST of whatever
+    sign() returns."""
+    if isinstance(req, basestring):
+        req = urllib2.Request(req)
+    if data is not None:
+        req.add_data(data)
+    url = req.get_full_url()
+    headers = dict(req.header_items())
+    body = req.get_data()
+    if body is not None or sign is not None:
+        headers.setdefault("Content-type", "application/x-www-form-urlencoded")
+    method = "POST" if sign is not None else req.get_method()
+    try:
+        status, msg, content = pool.request(method, url, body, headers, timeout, sign, signlock)
+    except (socket.timeout, ssl.SSLError):
+        raise
+    except (socket.error, httplib.HTTPException) as e:
+        raise urllib2.URLError(e)
+    response = urllib.addinfourl(StringIO(content), msg, url, status)
+    response.msg = httplib.responses.get(status, "")
+    if status >= 400:
+        raise urllib2.HTTPError(url, status, httplib.responses.get(status, ""), msg, StringIO(content))
+    return response
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# latency.py
+# Where does the time go between a frame arriving on the MtGox socket and
+# the order it caused leaving through the same socket? The receive thread
+# starts a trace when it has read a frame and every stage it passes marks
+# the time since the stage before:
+#     decode      json.loads of the frame (Gox.slot_recv)
+#     route       finding the handler of the message (Gox._on_op_private)
+#     book        parsing it and updating the OrderBook
+#     strategy    the slots after the book, up to Gox.order()
+#     encode      building and signing the call (send_signed_call)
+#     write       the socket send
+# plus
+#     tick_to_trade   frame read -> call written, for frames that sent a call
+#     ack             call written -> its op:result arrived
+# All on a monotonic clock, in microseconds, into log-linear histograms
+# (HDR style: a bucket is at most ~3% wide, so percentiles are that exact
+# over any range of values at a fixed cost per value).
+#
+# A stage is only recorded while the thread has a trace, calls made from
+# other threads (the trigger engine, the shell) still get their ack time.
+#
+#   latency.recorder.report()           #the percentile table
+#   latency.recorder.export(filename)   #json, load() reads it back
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+#monotonic seconds: clock_gettime(CLOCK_MONOTONIC) on linux, time.clock()
+#(QueryPerformanceCounter) on windows, time.time() elsewhere
+monotonic = time.time
+if os.name == 'nt':
+    monotonic = time.clock
+elif sys.platform.startswith('linux'):
+    try:
+        import ctypes
+        import ctypes.util
+
+        class _timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        _libc = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'))
+        _clock_gettime = _libc.clock_gettime     #no argtypes, they double the cost of a call
+        #a timespec per thread: ctypes lets go of the GIL during the call, a
+        #shared one could be filled by another thread before it is read
+        _local = threading.local()
+
+        def monotonic():
+            try:
+                now, nowref = _local.now
+            except AttributeError:
+                now = _timespec()
+                nowref = ctypes.byref(now)
+                _local.now = (now, nowref)
+            _clock_gettime(1, nowref)       #CLOCK_MONOTONIC
+            return now.tv_sec + now.tv_nsec * 1e-9
+        monotonic()
+    except (ImportError, OSError, AttributeError):
+        monotonic = time.time
+
+STAGES = ("decode", "route", "book", "strategy", "encode", "write")
+TOTALS = ("tick_to_trade", "ack")
+
+SUBBITS = 6                     #64 buckets per power of two -> ~3% wide
+_HALF = 1 << (SUBBITS - 1)
+
+
+class Histogram(object):
+    """Usage: h = Histogram()
+        h.record(123)           #microseconds (any non negative int)
+        h.percentile(99.9)"""
+    def __init__(self):
+        self.counts = collections.defaultdict(int)      #bucket -> count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def bucket(value):
+        shift = value.bit_length() - SUBBITS
+        if shift <= 0:
+            return value
+        return shift * _HALF + (value >> shift)
+
+    @staticmethod
+    def highest(bucket):
+        """the biggest value that goes into bucket"""
+        if bucket < 2 * _HALF:
+            return bucket
+        shift = bucket // _HALF - 1
+        return ((bucket - shift * _HALF + 1) << shift) - 1
+
+    def record(self, value):
+        value = int(value) if value > 0 else 0
+        shift = value.bit_length() - SUBBITS
+        self.counts[shift * _HALF + (value >> shift) if shift > 0 else value] += 1
+        self.count += 1
+        self.total += value
+        if self.count == 1:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+
+    def mean(self):
+        return float(self.total) / self.count if self.count else None
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        wanted = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= wanted:
+                return min(self.highest(bucket), self.max)
+        return self.max
+
+    def merge(self, other):
+        for bucket, count in other.counts.iteritems():
+            self.counts[bucket] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self):
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "counts": dict((str(b), c) for b, c in self.counts.iteritems())}
+
+    @classmethod
+    def from_dict(cls, data):
+        h = cls()
+        for bucket, count in data["counts"].iteritems():
+            h.counts[int(bucket)] = count
+        h.count, h.total, h.min, h.max = data["count"], data["total"], data["min"], data["max"]
+        return h
+
+
+class Recorder(object):
+    """Usage: recorder.begin()          #a frame was read
+        recorder.mark("decode")         #...each stage
+        recorder.end()
+        recorder.sent(reqid) / recorder.acked(reqid)"""
+    def __init__(self, pending=1000):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.histograms = collections.OrderedDict((name, Histogram()) for name in STAGES + TOTALS)
+        self.pending = pending
+        self._sent = collections.OrderedDict()      #reqid -> time written
+        self._local = threading.local()
+        self.started = time.time()
+
+    def begin(self):
+        if self.enabled:
+            now = monotonic()
+            self._local.trace = [now, now]
+        else:
+            self._local.trace = None
+
+    def end(self):
+        self._local.trace = None
+
+    def _record(self, name, seconds):
+        with self.lock:
+            self.histograms[name].record(seconds * 1E6)
+
+    def mark(self, stage):
+        """the current stage is done: record the time since the stage before"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return
+        now = monotonic()
+        self._record(stage, now - trace[1])
+        trace[1] = now
+        if stage == "write":
+            self._record("tick_to_trade", now - trace[0])
+
+    def sent(self, reqid):
+        """a call with this id was written, acked(reqid) will follow"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self._sent.pop(reqid, None)
+            self._sent[reqid] = monotonic()
+            while len(self._sent) > self.pending:       #the ones that never got an answer
+                self._sent.popitem(last=False)
+
+    def acked(self, reqid):
+        with self.lock:
+            written = self._sent.pop(reqid, None)
+        if written is not None:
+            self._record("ack", monotonic() - written)
+
+    def reset(self):
+        with self.lock:
+            for name in self.histograms:
+                self.histograms[name] = Histogram()
+            self._sent.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        """a copy of the histograms"""
+        with self.lock:
+            copy = collections.OrderedDict()
+            for name, h in self.histograms.iteritems():
+                copy[name] = Histogram()
+                copy[name].merge(h)
+        return copy
+
+    def report(self, histograms=None, percentiles=(50, 90, 99, 99.9)):
+        return report(histograms or self.snapshot(), percentiles)
+
+    def export(self, filename):
+        data = {"started": self.started, "exported": time.time(),
+                "histograms": collections.OrderedDict((name, h.to_dict()) for name, h in self.snapshot().iteritems())}
+        with open(filename, 'w') as f:
+            json.dump(data, f)
+
+
+def report(histograms, percentiles=(50, 90, 99, 99.9)):
+    """the table of count/min/percentiles/max per stage, in microseconds"""
+    lines = ["%-14s %8s %8s %s %8s" % ("stage (us)", "count", "min",
+             " ".join("%8s" % ("p%g" % p) for p in percentiles), "max")]
+    for name, h in histograms.iteritems():
+        if not h.count:
+            lines.append("%-14s %8d" % (name, 0))
+            continue
+        lines.append("%-14s %8d %8d %s %8d" % (name, h.count, h.min,
+                     " ".join("%8d" % h.percentile(p) for p in percentiles), h.max))
+    return "\n".join(lines)
+
+def load(filename):
+    """the histograms of a file written by export()"""
+    with open(filename, 'r') as f:
+        data = json.load(f, object_pairs_hook=collections.OrderedDict)
+    return collections.OrderedDict((name, Histogram.from_dict(h)) for name, h in data["histograms"].iteritems())
+
+
+#the one recorder of the process, mtgox_prof7bitapi stamps into it
+recorder = Recorder()
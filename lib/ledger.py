@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# ledger.py
+# The fills of a bot, written once in a fixed schema instead of every bot
+# inventing its own text format (filled.txt, successlog.txt, the pickled
+# bcbookie records) that has to be parsed back word by word.
+#
+# Every fill is appended as a fixed-size binary record:
+#     stamp (microseconds), side, amount, price, fee, oid
+# amount * 1E8, price and fee (in the quote currency) * 1E5, like the MtGox
+# integers. The file is never rewritten, only half a record left by a crash
+# in the middle of a write is cut off when it is opened. Records that do not
+# decode (a side other than buy/sell) are skipped and counted in .rejected.
+#
+# Each fill also updates the running totals right away: position, average
+# cost, realised P&L and fees (unrealised P&L needs a price: unrealised(last)),
+# and the totals of the period (bucket) it falls into. A summary of any time
+# range only adds up the buckets in it, the fills are not looked at again.
+# Opening a ledger replays its file once to get the totals back.
+#
+#   ledger = Ledger(partialpath + 'ledger_liquidbot.led')
+#   ledger.fill("buy", D('1'), D('120.5'), fee=D('0.72'), oid=oid)
+#   ledger.position, ledger.avgcost, ledger.realised, ledger.unrealised(last)
+#   ledger.summary(start, end)          #one Period for the range
+#   ledger.periods(start, end, 86400)   #a Period per day
+
+import bisect
+import collections
+import os
+import struct
+import threading
+import time
+from decimal import Decimal as D
+
+BUY = 1
+SELL = 2
+SIDES = {"buy": BUY, "bid": BUY, BUY: BUY,
+         "sell": SELL, "ask": SELL, SELL: SELL}
+
+#stamp, side, amount_int, price_int, fee_int, oid
+RECORD = struct.Struct('<qBqqq40s')
+
+Fill = collections.namedtuple('Fill', 'stamp side amount price fee oid')
+
+_AMOUNT = D('0.00000001')
+_PRICE = D('0.00001')
+
+
+def _side(side):
+    try:
+        return SIDES[side]
+    except KeyError:
+        raise ValueError("side must be buy/bid or sell/ask, not %r" % (side,))
+
+
+class Period(object):
+    """the totals of the fills in one bucket (or a range of buckets)"""
+    __slots__ = ('start', 'fills', 'bought', 'sold', 'buy_value', 'sell_value', 'fees', 'realised')
+    def __init__(self, start):
+        self.start = start
+        self.fills = 0
+        self.bought = self.sold = D(0)
+        self.buy_value = self.sell_value = D(0)
+        self.fees = self.realised = D(0)
+
+    def add(self, other):
+        self.fills += other.fills
+        self.bought += other.bought
+        self.sold += other.sold
+        self.buy_value += other.buy_value
+        self.sell_value += other.sell_value
+        self.fees += other.fees
+        self.realised += other.realised
+
+    def net(self):
+        return self.realised - self.fees
+
+    def __repr__(self):
+        return "<Period %s: %d fills, bought %s for %s, sold %s for %s, realised %s, fees %s>" % (
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(self.start)), self.fills, self.bought,
+            self.buy_value, self.sold, self.sell_value, self.realised, self.fees)
+
+
+class Ledger(object):
+    """Usage: ledger = Ledger("ledger_bot.led", bucket=3600)
+        ledger.fill("sell", amount, price, fee, oid)
+        print ledger.position, ledger.avgcost, ledger.realised, ledger.fees
+        ledger.summary(time.time() - 86400)"""
+    def __init__(self, path, bucket=3600):
+        self.path = path
+        self.bucket = bucket            #seconds per bucket, summaries have this resolution
+        self.lock = threading.Lock()
+        self.position = D(0)            #BTC, negative when short
+        self.avgcost = D(0)             #average price paid for the position
+        self.realised = D(0)
+        self.fees = D(0)
+        self.count = 0
+        self.rejected = 0               #records in the file that did not decode
+        self.buckets = {}               #bucket start (unix seconds) -> Period
+        self._starts = []               #sorted keys of buckets
+        self._repair()
+        self._replay()
+        self._file = open(path, 'ab')
+
+    def _repair(self):
+        """cut off half a record left by a crash in the middle of a write,
+        the next one would be appended out of step with all the others"""
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size % RECORD.size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(size - size % RECORD.size)
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for offset in xrange(0, len(data) - len(data) % RECORD.size, RECORD.size):
+            try:
+                fill = self._decode(RECORD.unpack_from(data, offset))
+            except ValueError:
+                self.rejected += 1
+                continue
+            self._apply(fill)
+
+    def _decode(self, values):
+        """a Fill from the unpacked record, ValueError if it is not one"""
+        stamp, side, amount, price, fee, oid = values
+        if side not in (BUY, SELL):
+            raise ValueError("bad side %d in a ledger record" % side)
+        return Fill(stamp, side, D(amount) / 100000000, D(price) / 100000, D(fee) / 100000,
+                    oid.rstrip('\0'))
+
+    def fill(self, side, amount, price, fee=0, oid="", stamp=None):
+        """record a fill (amount and price as Decimals or strings), returns
+        the realised P&L of it"""
+        if stamp is None:
+            stamp = time.time()
+        record = Fill(int(stamp * 1000000), _side(side), D(str(amount)).quantize(_AMOUNT),
+                      D(str(price)).quantize(_PRICE), D(str(fee)).quantize(_PRICE), str(oid)[:40])
+        with self.lock:
+            self._file.write(RECORD.pack(record.stamp, record.side, int(record.amount * 100000000),
+                                         int(record.price * 100000), int(record.fee * 100000), record.oid))
+            self._file.flush()
+            return self._apply(record)
+
+    def _apply(self, fill):
+        """update the running totals with one fill"""
+        amount = fill.amount if fill.side == BUY else -fill.amount
+        realised = D(0)
+        if self.position and (self.position > 0) != (amount > 0):
+            #(partly) closes the position at the average cost
+            closed = min(abs(amount), abs(self.position))
+            realised = (fill.price - self.avgcost) * closed * (1 if self.position > 0 else -1)
+            self.position += closed if amount > 0 else -closed
+            amount += -closed if amount > 0 else closed
+            if not self.position:
+                self.avgcost = D(0)
+        if amount:
+            #opens or adds to the position
+            self.avgcost = (self.avgcost * abs(self.position) + fill.price * abs(amount)) / (abs(self.position) + abs(amount))
+            self.position += amount
+        self.realised += realised
+        self.fees += fill.fee
+        self.count += 1
+
+        start = fill.stamp // 1000000 // self.bucket * self.bucket
+        period = self.buckets.get(start)
+        if period is None:
+            period = self.buckets[start] = Period(start)
+            bisect.insort(self._starts, start)
+        period.fills += 1
+        if fill.side == BUY:
+            period.bought += fill.amount
+            period.buy_value += fill.amount * fill.price
+        else:
+            period.sold += fill.amount
+            period.sell_value += fill.amount * fill.price
+        period.fees += fill.fee
+        period.realised += realised
+        return realised
+
+    def unrealised(self, price):
+        """P&L of the open position at <price>"""
+        return (D(str(price)) - self.avgcost) * self.position
+
+    def summary(self, start=None, end=None):
+        """one Period with the totals of the buckets from start up to end
+        (unix seconds, rounded to the bucket)"""
+        total = Period(start or 0)
+        with self.lock:
+            for key in self._range(start, end):
+                total.add(self.buckets[key])
+        return total
+
+    def periods(self, start=None, end=None, width=None):
+        """a Period for every <width> seconds (a multiple of the bucket)
+        between start and end that had fills"""
+        width = width or self.bucket
+        result = collections.OrderedDict()
+        with self.lock:
+            for key in self._range(start, end):
+                group = key // width * width
+                if group not in result:
+                    result[group] = Period(group)
+                result[group].add(self.buckets[key])
+        return result.values()
+
+    def _range(self, start, end):
+        first = 0 if start is None else bisect.bisect_left(self._starts, start // self.bucket * self.bucket)
+        last = len(self._starts) if end is None else bisect.bisect_left(self._starts, end)
+        return self._starts[first:last]
+
+    def fills(self, start=None, end=None):
+        """read the fills back from the file (this one does read them all)"""
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for offset in xrange(0, len(data) - len(data) % RECORD.size, RECORD.size):
+            try:
+                fill = self._decode(RECORD.unpack_from(data, offset))
+            except ValueError:
+                continue
+            if (start is None or fill.stamp >= start * 1000000) and (end is None or fill.stamp < end * 1000000):
+                yield fill
+
+    def close(self):
+        with self.lock:
+            self._file.close()
@@ -1,8 +1,10 @@
 import liquidbot_mtgox
+import gridengine
 from time import sleep
 import sys
 from urllib2 import URLError
 from datetime import datetime
+from decimal import Decimal as D
 
 import settings
 
@@ -13,7 +15,7 @@ def timestamp_string():
 class ExchangeInterface:
     def __init__(self, dry_run=False):
         self.dry_run = dry_run
-        self.mtgox = mtgox.MtGox()
+        self.mtgox = liquidbot_mtgox.MtGox()
         self.USD_DECIMAL_PLACES = 5
 
     def authenticate(self, login, password):
@@ -93,6 +95,20 @@ class ExchangeInterface:
 
         return order_id
 
+    #the venue interface of gridengine
+    def place(self, side, price, amount):
+        return self.place_order(float(price), float(amount), side)
+
+    def cancel(self, oid):
+        if self.dry_run:
+            return
+        for order in self.get_trade_data()["orders"]:
+            if order["id"] == oid:
+                self.mtgox.cancel(oid, 2 if order["type"] == "buy" else 1)
+
+    def open_orders(self):
+        return [order["id"] for order in self.get_trade_data()["orders"]]
+
 class OrderManager:
     def __init__(self):
         self.exchange = ExchangeInterface(settings.DRY_RUN)
@@ -102,7 +118,6 @@ class OrderManager:
 
     def reset(self):
         self.exchange.cancel_all_orders()
-        self.orders = {}
 
         ticker = self.exchange.get_ticker()
         self.start_position = ticker["last"]
@@ -111,6 +126,13 @@ class OrderManager:
         self.start_usd = trade_data["usd"]
         print timestamp_string(), "BTC:", self.start_btc, "  USD:", self.start_usd
 
+        #the grid places the replacement for a filled order as soon as the
+        #fill is seen, see lib/gridengine.py
+        self.grid = gridengine.GridEngine(self.exchange, str(self.start_position), str(settings.INTERVAL),
+                                          settings.ORDER_PAIRS, str(settings.ORDER_volume),
+                                          cPrec=D(10) ** -self.exchange.USD_DECIMAL_PLACES,
+                                          log=self.log_fill)
+
         # Sanity check:
         if self.get_position(-1) >= ticker["sell"] or self.get_position(1) <= ticker["buy"]:
             print self.start_position
@@ -118,72 +140,39 @@ class OrderManager:
             print "Sanity check failed, exchange data is screwy"
             exit()
 
-        for i in range(1, settings.ORDER_PAIRS + 1):
-            self.place_order(-i, "buy")
-            self.place_order(i, "sell")
-
         if settings.DRY_RUN:
+            #show the grid it would place, the orders of grid.start() go out
+            #in the background and must not be sent at all
+            for i in range(1, settings.ORDER_PAIRS + 1):
+                self.exchange.place_order(self.get_position(-i), settings.ORDER_volume, "buy")
+                self.exchange.place_order(self.get_position(i), settings.ORDER_volume, "sell")
             exit()
 
+        self.grid.start()
+
     def get_position(self, index):
-        return round(self.start_position * (1+settings.INTERVAL)**index, self.exchange.USD_DECIMAL_PLACES)
+        return float(self.grid.position(index))
 
-    def place_order(self, index, order_type):
-        position = self.get_position(index)
-        order_id = self.exchange.place_order(position, settings.ORDER_volume, order_type)
-        self.orders[index] = {"id": order_id, "type": order_type}
+    def log_fill(self, message):
+        print timestamp_string(), message
 
-    def check_orders(self):
+    def print_status(self):
         trade_data = self.exchange.get_trade_data()
-        order_ids = [o["id"] for o in trade_data["orders"]]
-        old_orders = self.orders.copy()
-        print_status = False
-
-        for index, order in old_orders.iteritems():
-            if order["id"] not in order_ids:
-                print "Order filled, id:", order["id"]
-                del self.orders[index]
-                if order["type"] == "buy":
-                    self.place_order(index + 1, "sell")
-                else:
-                    self.place_order(index - 1, "buy")
-                print_status = True
-
-        num_buys = 0
-        num_sells = 0
-
-        for order in self.orders.itervalues():
-            if order["type"] == "buy":
-                num_buys += 1
-            else:
-                num_sells += 1
-
-        if num_buys < settings.ORDER_PAIRS:
-            low_index = min(self.orders.keys())
-            if num_buys == 0:
-                # No buy orders left, so leave a gap
-                low_index -= 1
-            for i in range(1, settings.ORDER_PAIRS - num_buys + 1):
-                self.place_order(low_index-i, "buy")
-
-        if num_sells < settings.ORDER_PAIRS:
-            high_index = max(self.orders.keys())
-            if num_sells == 0:
-                # No sell orders left, so leave a gap
-                high_index += 1
-            for i in range(1, settings.ORDER_PAIRS - num_sells + 1):
-                self.place_order(high_index+i, "sell")
-
-        if print_status:
-            btc = trade_data["btc"]
-            usd = trade_data["usd"]
-            print "Profit:", btc - self.start_btc, "BTC,", usd - self.start_usd, "USD   Run Time:", datetime.now() - self.start_time
-
+        btc = trade_data["btc"]
+        usd = trade_data["usd"]
+        print "Profit:", btc - self.start_btc, "BTC,", usd - self.start_usd, "USD   Run Time:", datetime.now() - self.start_time
 
     def run_loop(self):
+        #this API has no order stream: one getOrders call every few seconds
+        #stands in for it (instead of sleeping 60s between checks)
+        poller = gridengine.Reconciler(self.grid, interval=getattr(settings, "CHECK_INTERVAL", 5))
+        poller.start()
+        fills = 0
         while True:
             sleep(60)
-            self.check_orders()
+            if self.grid.fills != fills:
+                fills = self.grid.fills
+                self.print_status()
             sys.stdout.write(".")
             sys.stdout.flush()
 
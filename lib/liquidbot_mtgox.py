@@ -1,5 +1,6 @@
 import urllib, urllib2
 import json
+import httppool
 
 # https://mtgox.com/support/tradeAPI
 
@@ -177,6 +178,6 @@ class MtGox(object):
             request = urllib2.Request(url, postdata)
         else:
             request = urllib2.Request(url)
-        response = urllib2.urlopen(request, timeout=timeout)
+        response = httppool.urlopen(request, timeout=timeout)
         return json.loads(response.read())
 
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# mirror.py
+# Keeps a copy of one order book (the live MtGox socket book) on bitfloor,
+# taking into account the bitfloor orders of other people and the funds we
+# have. Used by bin/bitfloor_mirror_mtgox.py
+#
+# Everything is held in memory as integers in bitfloor's scale
+# (price / 0.01, size / 0.00001):
+#   others   bitfloor level 2 book minus our own orders, per side {price:size}
+#   ours     our open orders {order_id: (side, price, size)}
+#   funds    {'USD':int, 'BTC':int} in price*size and size units
+# The MtGox book is read directly from the live OrderBook whenever it
+# changes. Each cycle the wanted volume per level is diffed against what we
+# have there and only the levels that are off by more than the size limit
+# produce a cancel or a new order. The full bitfloor book, our order list
+# and the balances are only downloaded again every `resync` seconds.
+
+import threading
+import time
+import traceback
+import logging
+
+from book import scaleint, decimalplaces
+
+BID = 0
+ASK = 1
+
+
+class Mirror(object):
+    """Usage: mirror = Mirror(bitfloor, gox.orderbook, lock=Signal._lock)
+        gox.orderbook.signal_changed.connect(mirror.slot_changed)
+        mirror.start()"""
+    def __init__(self, bitfloor, source, lock=None, size_limit='0.01',
+                 interval=1.0, resync=60, source_cPrec='0.00001', source_bPrec='0.00000001'):
+        self.bitfloor = bitfloor
+        self.source = source            #has .bids (highest first) .asks (lowest first) of int Orders
+        self.lock = lock or threading.RLock()
+        self.interval = interval        #at most one cycle per interval seconds
+        self.resync = resync            #seconds between full downloads from bitfloor
+        self.cplaces = decimalplaces(bitfloor.cPrec)
+        self.bplaces = decimalplaces(bitfloor.bPrec)
+        self.size_limit = scaleint(size_limit, self.bplaces)
+        #divisors from the source scale down to bitfloor's
+        self.cdiv = 10 ** (decimalplaces(source_cPrec) - self.cplaces)
+        self.bdiv = 10 ** (decimalplaces(source_bPrec) - self.bplaces)
+
+        self.others = {BID: {}, ASK: {}}
+        self.ours = {}
+        self.funds = {'USD': 0, 'BTC': 0}
+        self.last_resync = 0
+        self.calls = 0                  #REST calls made in the last cycle
+
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def slot_changed(self, dummy_sender, dummy_data):
+        """connect to the source book's signal_changed"""
+        self._changed.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._changed.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._changed.wait(self.resync)
+            self._changed.clear()
+            if self._stop.is_set():
+                break
+            start = time.time()
+            try:
+                self.cycle()
+            except Exception:
+                logging.error(traceback.format_exc())
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+    #### state kept from bitfloor
+
+    def refresh(self):
+        """download bitfloor's level 2 book, our orders and the balances"""
+        orders = self.bitfloor.orders()
+        book = self.bitfloor.book(level=2)
+        accounts = self.bitfloor.accounts()
+        self.ours = {}
+        for o in orders:
+            self.ours[o['order_id']] = (o['side'], scaleint(o['price'], self.cplaces),
+                                        scaleint(o['size'], self.bplaces))
+        mine = {BID: {}, ASK: {}}
+        for side, price, size in self.ours.itervalues():
+            mine[side][price] = mine[side].get(price, 0) + size
+        for side, key in ((BID, 'bids'), (ASK, 'asks')):
+            levels = {}
+            for level in book[key]:
+                price = scaleint(level[0], self.cplaces)
+                levels[price] = scaleint(level[1], self.bplaces) - mine[side].get(price, 0)
+            self.others[side] = levels
+        for p in accounts:
+            if p['currency'] == 'USD':
+                self.funds['USD'] = scaleint(p['amount'], self.cplaces + self.bplaces)
+            elif p['currency'] == 'BTC':
+                self.funds['BTC'] = scaleint(p['amount'], self.bplaces)
+        self.last_resync = time.time()
+        self.calls += 3
+
+    #### the wanted book
+
+    def source_levels(self):
+        """the source book flattened to bitfloor's price increment:
+        bids rounded down, asks rounded up, {price:size} per side"""
+        with self.lock:
+            bids = [(o.price, o.volume) for o in self.source.bids]
+            asks = [(o.price, o.volume) for o in self.source.asks]
+        levels = {BID: {}, ASK: {}}
+        for price, volume in bids:
+            price = price // self.cdiv
+            levels[BID][price] = levels[BID].get(price, 0) + volume // self.bdiv
+        for price, volume in asks:
+            price = -(-price // self.cdiv)
+            levels[ASK][price] = levels[ASK].get(price, 0) + volume // self.bdiv
+        return levels
+
+    def wanted(self):
+        """volume we want to have at every level: the gap between the source
+        and the other people's orders, scaled down to what our funds cover"""
+        source = self.source_levels()
+        want = {}
+        for side in (BID, ASK):
+            gaps = {}
+            for price in set(source[side]) | set(self.others[side]):
+                gap = source[side].get(price, 0) - self.others[side].get(price, 0)
+                if gap > 0:
+                    gaps[price] = gap
+            if side == BID:
+                need = sum(price * size for price, size in gaps.iteritems()) * 104 // 100
+                have = self.funds['USD']
+            else:
+                need = sum(gaps.itervalues())
+                have = self.funds['BTC']
+            for price, gap in gaps.iteritems():
+                if need > have:
+                    gap = gap * have // need
+                want[side, price] = gap
+        return want
+
+    #### diff and submit
+
+    def diff(self, want):
+        """minimal list of ('cancel', order_id) and ('new', side, price, size)
+        to get from our orders to the wanted book. Levels within the size
+        limit of what we want are left alone."""
+        have = {}
+        byprice = {}
+        for oid, (side, price, size) in self.ours.iteritems():
+            have[side, price] = have.get((side, price), 0) + size
+            byprice.setdefault((side, price), []).append((size, oid))
+        cancels = []
+        news = []
+        for level in set(want) | set(have):
+            delta = want.get(level, 0) - have.get(level, 0)
+            if delta < -self.size_limit:
+                #cancel the biggest orders at this level until we are not above it
+                for size, oid in sorted(byprice[level], reverse=True):
+                    cancels.append(('cancel', oid))
+                    delta += size
+                    if delta >= 0:
+                        break
+                if delta > self.size_limit:
+                    news.append(('new', level[0], level[1], delta))
+            elif delta > self.size_limit:
+                news.append(('new', level[0], level[1], delta))
+        #cancel first which frees the funds for the new orders
+        return cancels + news
+
+    def submit(self, actions):
+        """send one cycle's cancels and new orders and apply them to our
+        local copy of the orders"""
+        for action in actions:
+            self.calls += 1
+            if action[0] == 'cancel':
+                oid = action[1]
+                side, price, size = self.ours[oid]
+                print 'cancel', 'bid' if side == BID else 'ask', price, size, oid
+                result = self.bitfloor.order_cancel(oid)
+                if result and 'order_id' in result:
+                    del self.ours[oid]
+                else:
+                    #no answer or an error, keep the order and resync on the
+                    #next cycle to see what happened to it
+                    self.last_resync = 0
+            else:
+                _, side, price, size = action
+                price_str = '%d.%0*d' % (price // 10**self.cplaces, self.cplaces, price % 10**self.cplaces)
+                size_str = '%d.%0*d' % (size // 10**self.bplaces, self.bplaces, size % 10**self.bplaces)
+                print 'bid' if side == BID else 'ask', price_str, size_str
+                result = self.bitfloor.order_new(side=side, size=size_str, price=price_str)
+                if result and 'order_id' in result:
+                    self.ours[result['order_id']] = (side, price, size)
+
+    def cycle(self):
+        """one reconciliation pass, returns the actions taken"""
+        self.calls = 0
+        if time.time() - self.last_resync > self.resync:
+            self.refresh()
+        actions = self.diff(self.wanted())
+        self.submit(actions)
+        return actions
@@ -5,8 +5,11 @@ from hashlib import sha512
 from hmac import HMAC
 import base64
 import json
+import httppool
+import nonces
 def get_nonce():
-    return int(time.time()*1000)
+    #shared with the other mtgox clients, see lib/nonces.py
+    return nonces.allocator("mtgox", floor=nonces.microseconds).next()
  
 def sign_data(secret, data):
     return base64.b64encode(str(HMAC(secret, data, sha512).digest()))
@@ -28,5 +31,5 @@ class requester:
     def perform(self, path, args):
         data, headers = self.build_query(args)
         req = urllib2.Request("https://mtgox.com/api/0/"+path, data, headers)
-        res = urllib2.urlopen(req, data)
+        res = httppool.urlopen(req, data)
         return json.load(res)
\ No newline at end of file
@@ -40,9 +40,12 @@ import inspect
 import io
 import json
 import logging
+import mmap
+import os
 import Queue
 import socket
 import ssl
+import struct
 import time
 import traceback
 import threading
@@ -50,6 +53,12 @@ import urllib
 import urllib2
 import weakref
 import websocket
+import clocksync
+import feedmonitor
+import httppool
+import latency
+import nonces
+import retrypolicy
 
 import unlock_api_key
 
@@ -99,7 +108,7 @@ def http_request(url):
     request.add_header('Accept-encoding', 'gzip')
     data = ""
     try:
-        with contextlib.closing(urllib2.urlopen(request)) as response:
+        with contextlib.closing(httppool.urlopen(request)) as response:
             if response.info().get('Content-Encoding') == 'gzip':
                 with io.BytesIO(response.read()) as buf:
                     with gzip.GzipFile(fileobj=buf) as unzipped:
@@ -162,6 +171,9 @@ class GoxConfig(SafeConfigParser):
                 ,["gox", "use_http_api", "True"]
                 ,["gox", "load_fulldepth", "True"]
                 ,["gox", "load_history", "True"]
+                ,["gox", "stall_window", "0.5"]
+                ,["gox", "stall_factor", "4"]
+                ,["gox", "stall_escalate", "10"]
                 ,["goxtool", "set_xterm_title", "True"]
                 ]
 
@@ -461,9 +473,8 @@ class BaseClient(BaseObject):
     SOCKETIO_HOST = "socketio.mtgox.com"
     WEBSOCKET_HOST = "websocket.mtgox.com"
     HTTP_HOST = "data.mtgox.com"
-
-    _last_nonce = 0
-    _nonce_lock = threading.Lock()
+    FEED = "client"                     #name of the feed in Gox.feedmonitor
+    FULLDEPTH_TIMEOUT = 60              #a fulldepth request not back by then is given up
 
     def __init__(self, gox, secret, config):
         BaseObject.__init__(self)
@@ -481,9 +492,14 @@ class BaseClient(BaseObject):
         self.config = config
 
         self.http_requests = Queue.Queue()
+        #the single http worker gives up on a request after 20 seconds (or
+        #at once while data.mtgox.com is down) and goes on with the queue
+        self.http_policy = retrypolicy.RetryPolicy(attempts=4, deadline=20, log=self.debug)
         self.socket = None
         self.connected = False
         self.created = 0
+        self.fulldepth_started = 0      #when the last fulldepth request went out
+        self._fulldepth_out = None      #...its fulldepth_started while it is out
         self._terminate = threading.Event()
         self._terminate.set()
         self._time_last_received = 0
@@ -520,13 +536,9 @@ class BaseClient(BaseObject):
     #     raise NotImplementedError()
 
     def get_nonce(self):
-        """produce a unique nonce that is guaranteed to be ever increasing"""
-        with self._nonce_lock:
-            nonce = int(time.time()*1000)
-            if nonce <= self._last_nonce:
-                nonce = self._last_nonce + 1
-            self._last_nonce = nonce
-            return nonce
+        """produce a unique nonce that is guaranteed to be ever increasing,
+        also across the other mtgox clients and processes (lib/nonces.py)"""
+        return nonces.allocator("mtgox", floor=nonces.microseconds).next()
 
     def request_order_lag(self):
         """request the current order-lag"""
@@ -537,6 +549,7 @@ class BaseClient(BaseObject):
 
     def request_fulldepth(self):
         """start the fulldepth thread"""
+        started = self.fulldepth_started = self._fulldepth_out = time.time()
 
         def fulldepth_thread():
             """request the full market depth, initialize the order book
@@ -550,9 +563,17 @@ class BaseClient(BaseObject):
                 self.signal_fulldepth(self, (json.loads(fulldepth)))
             except Exception as e:
                 self.debug("###request_fulldepth: Error:",e)
+            finally:
+                if self._fulldepth_out == started:
+                    self._fulldepth_out = None
 
         start_thread(fulldepth_thread)
 
+    def fulldepth_pending(self):
+        """True while a fulldepth request is out, for FULLDEPTH_TIMEOUT at most"""
+        started = self._fulldepth_out
+        return started is not None and time.time() - started < self.FULLDEPTH_TIMEOUT
+
 
     def request_fetchdepth(self):
         """start the fetchdepth thread"""
@@ -644,6 +665,14 @@ class BaseClient(BaseObject):
     #     client (websocket or socketio) will implement its own"""
     #     raise NotImplementedError()
 
+    def resubscribe(self, types=("depth", "ticker", "trades")):
+        """subscribe to the channels (and the account messages) again on the
+        open connection, a cheap first try when a feed stalls"""
+        for typ in types:
+            self.send(json.dumps({"op":"mtgox.subscribe", "type":typ}))
+        if self.gox._idkey:
+            self.send(json.dumps({"op":"mtgox.subscribe", "key":self.gox._idkey}))
+
     def channel_subscribe(self):
         """subscribe to the needed channels and alo initiate the
         download of the initial full market depth"""
@@ -683,7 +712,7 @@ class BaseClient(BaseObject):
             if fdtdelta > 120:
 
                 if self.config.get_bool("gox", "load_fulldepth"):
-                    if not FORCE_NO_FULLDEPTH:
+                    if not FORCE_NO_FULLDEPTH and not self.fulldepth_pending():
                         self.request_fulldepth()
 
             elif fdtdelta > 15:
@@ -695,19 +724,23 @@ class BaseClient(BaseObject):
         http api is forced, normally this is much slower)"""
         while not(self._terminate.isSet()):
             (api_endpoint, params, reqid) = self.http_requests.get(True)
+
+            #an order is never sent twice, an error answer to it is final
+            idempotent = "order/add" not in api_endpoint
+
+            def attempt():
+                answer = self.http_signed_call(api_endpoint, dict(params))
+                if answer["result"] != "success":
+                    raise retrypolicy.Retryable(retrypolicy.SERVER if idempotent else retrypolicy.FATAL, answer)
+                return answer
+
             try:
-                success = False
-                while success == False:
-                    answer = self.http_signed_call(api_endpoint, params)
-                    if answer["result"] == "success":
-                        # the fiollowing will reformat the answer in such a way
-                        # that we can pass it directly to signal_recv()
-                        # as if it had come directly from the websocket
-                        ret = {"op": "result", "id": reqid, "result": answer["data"]}
-                        self.signal_recv(self, (json.dumps(ret)))
-                        success = True
-                    else:
-                        self.debug("### Error,retrying...:", answer, reqid)                
+                answer = self.http_policy.call(self.HTTP_HOST, attempt, idempotent=idempotent)
+                # the fiollowing will reformat the answer in such a way
+                # that we can pass it directly to signal_recv()
+                # as if it had come directly from the websocket
+                ret = {"op": "result", "id": reqid, "result": answer["data"]}
+                self.signal_recv(self, (json.dumps(ret)))
             except Exception as exc:
                 self.debug("### Error,failure:", exc, api_endpoint, params, reqid)
                 
@@ -743,7 +776,7 @@ class BaseClient(BaseObject):
         url = "https://" + self.HTTP_HOST + "/api/2/" + api_endpoint
         self.debug("### (http) calling %s" % url)
         req = urllib2.Request(url, post, headers)
-        with contextlib.closing(urllib2.urlopen(req, post)) as res:
+        with contextlib.closing(httppool.urlopen(req, post)) as res:
             return json.load(res)
 
 
@@ -774,12 +807,16 @@ class BaseClient(BaseObject):
         signedcall = key.replace("-", "").decode("hex") + sign + call
 
         self.debug("### (socket) calling %s" % api_endpoint)
-        self.send(json.dumps({
+        frame = json.dumps({
             "op"      : "call",
             "call"    : base64.b64encode(signedcall),
             "id"      : reqid,
             "context" : "mtgox.com"
-        }))
+        })
+        latency.recorder.mark("encode")
+        self.send(frame)
+        latency.recorder.mark("write")
+        latency.recorder.sent(reqid)
 
     def send_order_add(self, typ, price, volume):
         """send an order"""
@@ -809,6 +846,7 @@ class BaseClient(BaseObject):
 class WebsocketClient(BaseClient):
     """this implements a connection to MtGox through the older (but faster)
     websocket protocol. Unfortuntely its just as unreliable as the socket.io."""
+    FEED = "websocket"
 
     def __init__(self, gox, secret, config):
         BaseClient.__init__(self, gox, secret, config)
@@ -834,14 +872,17 @@ class WebsocketClient(BaseClient):
                     self.debug("connected.")
                     self.connected = True
                     self.created = time.time()
+                    self.gox.feedmonitor.restarted(self.FEED)
                 self.channel_subscribe()
                 
                 self.debug("waiting for data...")
                 while not self._terminate.is_set(): #loop1 (read messages)
                     str_json = self.socket.recv()
+                    latency.recorder.begin()
                     if str_json[0] == "{":
                         self._time_last_received = time.time()
                         self.signal_recv(self, (str_json))
+                    latency.recorder.end()
 
             except Exception as exc:
                 self.connected = False
@@ -920,6 +961,7 @@ class SocketIO(websocket.WebSocket):
 class SocketIOClient(BaseClient):
     """this implements a connection to MtGox using the new socketIO protocol.
     This should replace the older plain websocket API"""
+    FEED = "socketio"
 
     def __init__(self, gox, secret, config):
         BaseClient.__init__(self, gox, secret, config)
@@ -949,6 +991,7 @@ class SocketIOClient(BaseClient):
                     self.debug("connected.")
                     self.connected = True
                     self.created = time.time()
+                    self.gox.feedmonitor.restarted(self.FEED)
                 
                 self.channel_subscribe()
                 self.socket.send("1::/mtgox")
@@ -968,8 +1011,10 @@ class SocketIOClient(BaseClient):
                     if prefix == "4::/mtgox:":
                         str_json = msg[10:]
                         if str_json[0] == "{":
+                            latency.recorder.begin()
                             self._time_last_received = time.time()
                             self.signal_recv(self, (str_json))
+                            latency.recorder.end()
 
             except Exception as exc:
                 self.connected = False
@@ -984,6 +1029,11 @@ class SocketIOClient(BaseClient):
         will then do the needed framing on top of that."""
         self._try_send_raw("4::/mtgox:" + json_str)
 
+    def resubscribe(self, types=("depth", "ticker", "trades")):
+        """join the /mtgox endpoint again before subscribing"""
+        self._try_send_raw("1::/mtgox")
+        BaseClient.resubscribe(self, types)
+
     def slot_keepalive_timer(self, _sender, _data):
         """send a keepalive, just to make sure our socket is not dead"""
         self._try_send_raw("2::")
@@ -1029,7 +1079,7 @@ class Gox(BaseObject):
         self.order_lag = 0
 #added        
         self._time_last_received = 0
-        self.LASTTICKER = time.time() - 20
+        self.LASTTICKER = latency.monotonic() - 20
         self.LASTLAG = time.time() - 20  
 
         self.config = config
@@ -1040,6 +1090,14 @@ class Gox(BaseObject):
         self.history = History(self, 60 * 15)
         self.history.signal_debug.connect(self.signal_debug)
 
+        #rates, gaps, lag and skew of each client's messages, and a stall
+        #of the socket.io feed is noticed in about half a second. The MtGox
+        #time stamps go into clocksync.clock on the way
+        self.feedmonitor = feedmonitor.FeedMonitor(
+            window=float(config.get_safe("gox", "stall_window")),
+            factor=float(config.get_safe("gox", "stall_factor")),
+            escalate=float(config.get_safe("gox", "stall_escalate")),
+            log=self.debug, clock=clocksync.clock)
 
         self.client = SocketIOClient(self, secret, config)
 #added        
@@ -1056,42 +1114,55 @@ class Gox(BaseObject):
 
         self.client.signal_fulldepth.connect(self.signal_fulldepth)
         self.client.signal_fullhistory.connect(self.signal_fullhistory)
-##New
-        self._switchclient = Timer(15)
-        self._switchclient.connect(self.slot_switchclient)
+        self.feedmonitor.watch(self.client.FEED, self.slot_stall, self.slot_recover,
+                               active=lambda: not self.client._terminate.isSet())
 
 ##Code to switch between SocketIO/websocket/HTTP ticker
-    def slot_switchclient(self, _sender, _data):
-        """find out if the socket is blank in regular intervals, and if it is, request new HTTP depth"""
-
-        silent = time.time() - self.client._time_last_received
-        if silent > 60:
-            if time.time() - self.client.created > 60:
-                self.debug("NO DATA received over SocketIO for %d seconds!!!!!! Restarting SocketIO Client" % silent)
-                self.stop()
-                time.sleep(2)
-                self.start()
-                if self.client_backup._terminate.isSet() and not self.client_backup.connected:
-                    self.debug("SocketIO is NOT sending data. Starting WebSocket client.")
-                    self.client_backup.start()
-            if time.time() - self.orderbook.fulldepth_time > 20 and not(self.client_backup.connected):
-                self.client.request_fetchdepth()
-               
-        elif silent <= 60 and not(self.client_backup._terminate.isSet()):
-            self.debug("SocketIO is actively sending data. Stopping WebSocket client.")
+    def slot_stall(self, feed, channel, level, silent):
+        """the socket.io feed (or one channel of it) went silent: resubscribe
+        first, if it stays silent start the websocket client, restart
+        socket.io and get the depth by HTTP when nothing else is coming"""
+        if channel is not None:
+            self.debug("No %s over SocketIO for %.2f seconds, resubscribing" % (channel, silent))
+            self.client.resubscribe(("trades" if channel == "trade" else channel,))
+            return
+        if level == 1:
+            self.debug("NO DATA received over SocketIO for %.2f seconds. Resubscribing." % silent)
+            self.client.resubscribe()
+            return
+        if self.client_backup._terminate.isSet() and not self.client_backup.connected:
+            self.debug("NO DATA received over SocketIO for %d seconds. Starting WebSocket client." % silent)
+            self.client_backup.start()
+        if self.client.connected and time.time() - self.client.created > self.feedmonitor.escalate:
+            self.debug("NO DATA received over SocketIO for %d seconds!!!!!! Restarting SocketIO Client" % silent)
+            self.client.stop()
+            time.sleep(2)
+            self.client.start()
+        if time.time() - self.orderbook.fulldepth_time > 20 and not(self.client_backup.connected):
+            self.client.request_fetchdepth()
+
+    def slot_recover(self, feed, channel, silent):
+        """the socket.io feed is back, the websocket client is not needed"""
+        if channel is None and not(self.client_backup._terminate.isSet()):
+            self.debug("SocketIO is actively sending data again. Stopping WebSocket client.")
             self.client_backup.stop()
 
 
     def start(self):
         """connect to MtGox and start receiving events."""
         self.client.start()
+        self.feedmonitor.start()
 
     def stop(self):
         """shutdown the client"""
+        self.feedmonitor.stop()
         self.client.stop()
+        if self.orderbook.snapshot_file:
+            self.orderbook.slot_checkpoint(None, None)
         
     def order(self, typ, price, volume):
         """place pending order. If price=0 then it will be filled at market"""
+        latency.recorder.mark("strategy")
         self.client.send_order_add(typ, price, volume)
 
     def buy(self, price, volume):
@@ -1104,6 +1175,7 @@ class Gox(BaseObject):
 
     def cancel(self, oid):
         """cancel order"""
+        latency.recorder.mark("strategy")
         self.client.send_order_cancel(oid)
 
     def cancel_by_price(self, price):
@@ -1122,13 +1194,15 @@ class Gox(BaseObject):
                 if order.oid != "":
                     self.cancel(order.oid)
 
-    def slot_recv(self, dummy_sender, data):
+    def slot_recv(self, sender, data):
         """Slot for signal_recv, handle new incoming JSON message. Decode the
         JSON string into a Python object and dispatch it to the method that
         can handle it."""
         (str_json) = data
         handler = None
         msg = json.loads(str_json)
+        latency.recorder.mark("decode")
+        self.feedmonitor.received(sender.FEED, msg)
         if "op" in msg:
             try:
                 msg_op = msg["op"]
@@ -1206,6 +1280,7 @@ class Gox(BaseObject):
             volume = int(parts[3])
             oid = result
             self.debug("### got ack for order/add:", typ, price, volume, oid)
+            latency.recorder.acked(reqid)
             self.orderbook.add_own(Order(price, volume, typ, oid, "pending"))
 
         elif "order_cancel:" in reqid:
@@ -1215,6 +1290,7 @@ class Gox(BaseObject):
             parts = reqid.split(":")
             oid = parts[1]
             self.debug("### got ack for order/cancel:", oid)
+            latency.recorder.acked(reqid)
 
         else:
             self.debug("_on_op_result() ignoring:", msg)
@@ -1231,6 +1307,7 @@ class Gox(BaseObject):
             self.debug("_on_op_private() ignoring: private=%s" % private)
 
         if handler:
+            latency.recorder.mark("route")
             handler(msg)
 
     def _on_op_private_lag(self,msg):
@@ -1247,7 +1324,7 @@ class Gox(BaseObject):
         ask = int(msg["sell"]["value_int"])
         bid = int(msg["buy"]["value_int"])
 
-        now = float(msg["now"]) / 1E6
+        now = clocksync.clock.to_local(float(msg["now"]) / 1E6)
         if now - self.LASTTICKER > 20:    #only show the ticker every 20 seconds.
             self.LASTTICKER = now
             self.debug(" tick:  bid:", int2str(bid, self.currency),"   ask:", int2str(ask, self.currency))
@@ -1376,10 +1453,24 @@ class Order:
         self.status = status
 
 
+#the book snapshot file: magic, version, currency, saved (microseconds),
+#bid, ask, number of asks, number of bids, then (price, volume) of every
+#ask (lowest first) and every bid (highest first)
+SNAPSHOT_MAGIC = "GOXB"
+SNAPSHOT_HEAD = struct.Struct('<4sB3sqqqII')
+
+
 class OrderBook(BaseObject):
     """represents the orderbook. Each Gox instance has one
     instance of OrderBook to maintain the open orders. This also
-    maintains a list of own orders belonging to this account"""
+    maintains a list of own orders belonging to this account.
+
+    A book saved with save_snapshot() (or every few minutes by
+    checkpoint()) can be loaded at the next start before the fulldepth
+    is downloaded. It is then provisional: the live depth/trade/ticker
+    messages update it as usual until the fulldepth replaces it.
+    wait(provisional=True) returns as soon as the book has anything in
+    it, wait(provisional=False) only once a fulldepth arrived"""
 
     def __init__(self, gox):
         """create a new empty orderbook and associate it with its
@@ -1410,6 +1501,21 @@ class OrderBook(BaseObject):
         self.total_bid = 0
         self.total_ask = 0
 
+        # incremented on every change, lets views of the book be cached
+        self.version = 0
+
+        self.provisional = False    # loaded from a snapshot, not verified yet
+        self.snapshot_time = 0      # when the loaded snapshot was saved
+        self.snapshot_file = None   # where checkpoint() saves it
+        self._checkpoint = None
+        self.verified = threading.Event()   # set by the first fulldepth
+
+    def _changed(self):
+        """count a new version of the book and emit signal_changed"""
+        self.version += 1
+        latency.recorder.mark("book")
+        self.signal_changed(self, ())
+
     def slot_ticker(self, dummy_sender, data):
         """Slot for signal_ticker, incoming ticker message"""
         (bid, ask) = data
@@ -1417,7 +1523,7 @@ class OrderBook(BaseObject):
         self.ask = ask
         self._repair_crossed_asks(ask)
         self._repair_crossed_bids(bid)
-        self.signal_changed(self, ())
+        self._changed()
 
     def slot_depth(self, dummy_sender, data):
         """Slot for signal_depth, process incoming depth message"""
@@ -1426,7 +1532,7 @@ class OrderBook(BaseObject):
             self._update_asks(price, total_vol)
         if typ == "bid":
             self._update_bids(price, total_vol)
-        self.signal_changed(self, ())
+        self._changed()
 
     def slot_trade(self, dummy_sender, data):
         """Slot for signal_trade event, process incoming trade messages.
@@ -1466,7 +1572,7 @@ class OrderBook(BaseObject):
                 if len(self.bids):
                     self.bid = self.bids[0].price
 
-        self.signal_changed(self, ())
+        self._changed()
 
     def slot_user_order(self, dummy_sender, data):
         """Slot for signal_userorder, process incoming user_order mesage"""
@@ -1508,7 +1614,7 @@ class OrderBook(BaseObject):
                     "status:", status)
                 self.owns.append(Order(price, volume, typ, oid, status))
 
-        self.signal_changed(self, ())
+        self._changed()
 
     def slot_fulldepth(self, dummy_sender, data):
         """Slot for signal_fulldepth, process received fulldepth data.
@@ -1519,6 +1625,7 @@ class OrderBook(BaseObject):
         self.asks = []
         self.total_ask = 0
         self.total_bid = 0
+        self.version += 1
         if "error" in depth:
             self.debug("### ", depth["error"])
             return
@@ -1535,13 +1642,111 @@ class OrderBook(BaseObject):
 
         self.bid = self.bids[0].price
         self.ask = self.asks[0].price
+        if self.provisional:
+            self.provisional = False
+            self.debug("### snapshot of %.1fs ago replaced by the full depth" % (time.time() - self.snapshot_time))
+        self.verified.set()
 #added this        
         self.fulldepth_downloaded = True
         self.fulldepth_time = time.time()
-        self.signal_changed(self, ())
+        self._changed()
         time.sleep(0.2)
         self.fulldepth_downloaded = False
 
+    def save_snapshot(self, filename):
+        """write the book to filename (through a temporary file, so there
+        is always a whole one). A provisional book is not saved again."""
+        if self.provisional or not (self.asks and self.bids):
+            return False
+        asks = list(self.asks)
+        bids = list(self.bids)
+        values = []
+        for order in asks + bids:
+            values.append(order.price)
+            values.append(order.volume)
+        data = SNAPSHOT_HEAD.pack(SNAPSHOT_MAGIC, 1, self.gox.currency, int(time.time() * 1E6),
+            self.bid, self.ask, len(asks), len(bids)) + struct.pack('<%dq' % len(values), *values)
+        temp = filename + ".tmp"
+        with open(temp, 'wb') as f:
+            f.write(data)
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temp, filename)
+        return True
+
+    def load_snapshot(self, filename, max_age=3600):
+        """fill the book from a snapshot, it is provisional until the next
+        fulldepth. Nothing is loaded (returns False) when there is no
+        snapshot, it is older than max_age seconds or of another currency."""
+        try:
+            with open(filename, 'rb') as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, EnvironmentError, ValueError):
+            return False
+        try:
+            if len(view) < SNAPSHOT_HEAD.size:
+                return False
+            (magic, version, currency, saved, bid, ask, nasks, nbids) = SNAPSHOT_HEAD.unpack_from(view, 0)
+            if magic != SNAPSHOT_MAGIC or version != 1 or currency != self.gox.currency:
+                return False
+            if time.time() - saved / 1E6 > max_age or len(view) < SNAPSHOT_HEAD.size + (nasks + nbids) * 16:
+                return False
+            values = struct.unpack_from('<%dq' % ((nasks + nbids) * 2), view, SNAPSHOT_HEAD.size)
+        finally:
+            view.close()
+        self.asks = [Order(values[i], values[i + 1], "ask") for i in xrange(0, nasks * 2, 2)]
+        self.bids = [Order(values[i], values[i + 1], "bid") for i in xrange(nasks * 2, len(values), 2)]
+        self.total_ask = sum(int2float(order.volume, "BTC") for order in self.asks)
+        self.total_bid = sum(int2float(order.volume, "BTC") * int2float(order.price, self.gox.currency) for order in self.bids)
+        self.bid = bid
+        self.ask = ask
+        self.snapshot_time = saved / 1E6
+        self.provisional = True
+        self.debug("### loaded the book snapshot of %.1fs ago: %d asks, %d bids" % (time.time() - self.snapshot_time, nasks, nbids))
+        self._changed()
+        return True
+
+    def checkpoint(self, filename, interval=300):
+        """save a snapshot to filename every <interval> seconds and when
+        Gox is stopped"""
+        self.snapshot_file = filename
+        if self._checkpoint:
+            self._checkpoint.cancel()
+        self._checkpoint = Timer(interval)
+        self._checkpoint.connect(self.slot_checkpoint)
+
+    def slot_checkpoint(self, _sender, _data):
+        """Slot for the checkpoint timer"""
+        try:
+            self.save_snapshot(self.snapshot_file)
+        except (IOError, OSError) as exc:
+            self.debug("### saving the book snapshot failed:", exc)
+
+    def refresh(self, max_age, retry=30):
+        """request a fulldepth when the book is older than max_age seconds
+        or still provisional, unless one is out already or the last one went
+        out less than retry seconds ago (and failed). True when it did."""
+        client = self.gox.client
+        if not self.provisional and time.time() - self.fulldepth_time <= max_age:
+            return False
+        if client.fulldepth_pending() or time.time() - client.fulldepth_started < retry:
+            return False
+        client.request_fulldepth()
+        return True
+
+    def wait(self, provisional=True, timeout=None):
+        """block until the book can be used: when provisional it may still
+        be the loaded snapshot, otherwise it has to come from a fulldepth.
+        Returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.verified.is_set():
+            if provisional and self.provisional:
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            self.verified.wait(0.1)     #in slices, a blocking wait would not see Ctrl+C
+        return True
+
     def _repair_crossed_bids(self, bid):
         """remove all bids that are higher that official current bid value,
         this should actually never be necessary if their feed would not
@@ -1646,7 +1851,7 @@ class OrderBook(BaseObject):
     def reset_own(self):
         """clear all own orders"""
         self.owns = []
-        self.signal_changed(self, ())
+        self._changed()
 
     def add_own(self, order):
         """add order to the list of own orders. This method is used
@@ -1684,4 +1889,4 @@ class OrderBook(BaseObject):
             if order.typ == "bid":
                 insert_dummy(self.bids, False)
 
-            self.signal_changed(self, ())
+            self._changed()
@@ -37,12 +37,21 @@ import gzip
 import io
 from decimal import Decimal as D
 import traceback
+import threading
+import httppool
+import nonces
+import ttlcache
+import ratelimit
+import batchorder
+import retrypolicy
 
 from common import UserError,ServerError,prompt
 
 CURRENCY = "USD"
 PRODUCT = "BTC"     #maybe future litecoin implementations can work off this
 PAIR = PRODUCT + CURRENCY
+#calls that must not be carried out twice (see perform)
+NOT_IDEMPOTENT = ("/money/order/add", "bitcoin/send_simple", "withdraw.php")
 
 import unlock_api_key   #comment this out and read below if you dont need authenticated commands
 
@@ -55,22 +64,14 @@ class Client:
         self.buff = ""
         self.__url_parts = "https://data.mtgox.com/api/"
         
-        self.query_now = time.time()
-        self.query_last = time.time()
-        self.query_count = 0
-        self.query_limit_per_time_slice = 40
-        self.query_time_slice = 20
-        self.query_timeout = 5
-        
-        self.order_first = 0
-        self.order_now = time.time()
-        self.order_last = time.time()
-        self.order_count = 0
-        self.order_limit_per_time_slice = 6
-        self.order_time_slice = 6
-        self.order_timeout = 0.1
-        self.order_ban = 0
-        #self.throttled = False
+        #shared by every Client, thread and process (see lib/ratelimit.py)
+        self.limiter = ratelimit.limiter("mtgox", ratelimit.MTGOX)
+        #signed requests are numbered and sent one at a time (the responses
+        #are not waited for), so the nonces reach mtgox in increasing order
+        self.sendlock = threading.RLock()
+        self.nonces = nonces.allocator("mtgox", floor=nonces.microseconds)
+        #backoff, deadline and the data.mtgox.com circuit breaker of perform()
+        self.policy = retrypolicy.default
 
         self.cPrec = D('0.00001')
         self.bPrec = D('0.00000001')
@@ -78,134 +79,102 @@ class Client:
         self.orders = []
         self.fulldepth = []
 
+    def nonce(self):
+        """microsecond time, but always more than the last one handed out
+        by any mtgox client on this machine"""
+        return str(self.nonces.next())
+
     def throttle(self,ordering=False):
-        if ordering == False:
-            self.query_now = time.time()
-            tdelta = self.query_now - self.query_last
-            if tdelta > self.query_time_slice:
-                self.query_count = 0
-                self.query_last = time.time()
-            self.query_count += 1
-            if self.query_count > self.query_limit_per_time_slice:
-                print "### Throttled ###"
-                time.sleep(self.query_timeout)    #throttle the connection
-        if ordering == True:
-            if not self.order_first:
-                self.order_first = time.time()
-            self.order_now = time.time()
-            print "Unix time is: ", self.order_now,
-            tdelta = self.order_now - self.order_last
-            if tdelta > self.order_time_slice:
-                self.order_count = 0
-                self.order_last = time.time()
-            self.order_count += 1
-            if self.order_count > self.order_limit_per_time_slice:
-                print "### Throttled ###"
-                self.order_window_length = self.order_now-self.order_first
-                time.sleep(self.order_timeout+(self.order_time_slice-self.order_window_length))    #throttle the connection
-                self.order_first = time.time()
-            else:
-                self.order_first = 0
-                self.order_last = time.time()
-            if self.order_ban:    
-                time.sleep(self.order_ban)      #wait for the ban timeout to elapse
-                self.order_ban = 0
+        bucket = self.limiter["order" if ordering else "query"]
+        if not bucket.try_acquire():
+            print "### Throttled ###"
+            bucket.acquire()
 
 
        
-    def perform(self, path, params,JSON=True,API_VERSION=0,GZIP=True,GET=False):
-        while True:
+    def perform(self, path, params,JSON=True,API_VERSION=0,GZIP=True,GET=False,deadline=None):
+        """one call to the API, retried by self.policy (see lib/retrypolicy.py).
+        Raises retrypolicy.CircuitOpen right away while data.mtgox.com keeps
+        failing, and GaveUp once the deadline (seconds) is over. Orders and
+        withdrawals are not sent again once they may have reached mtgox,
+        retrypolicy.Uncertain is raised then."""
+        if params != None:
+            if isinstance(params, dict):
+                params = params.items()
+        else:
+            params = []
+
+        if API_VERSION == 0:
+            url = self.__url_parts + '0/' + path
+        elif API_VERSION == 1: 
+            url = self.__url_parts + '1/' + path
+        else: #assuming API_VERSION 2
+            url = self.__url_parts + '2/' + path
+
+        def sign():
+            #called by httppool right before sending, under self.sendlock
+            post_data = urllib.urlencode(params + [(u'nonce',self.nonce())])
+            if API_VERSION == 2:
+                tohash = path + chr(0) + post_data          #new way to hash for API 2, includes path + NUL
+            else:
+                tohash = post_data
+            ahmac = base64.b64encode(str(hmac.new(base64.b64decode(self.secret),tohash,hashlib.sha512).digest()))
+            # header for auth-requiring operations
+            return post_data, {"Rest-Key": self.key, "Rest-Sign": ahmac}
+
+        def attempt():
             if "/money/order/add" in path:
                 self.throttle(ordering=True)
             else:
                 self.throttle()
+            # Create the request
+            req = urllib2.Request(url, None, {"User-Agent": 'genBTC-bot'})
+            # if GZIP was set, accept gzip encoding
+            if GZIP:
+                req.add_header('Accept-encoding', 'gzip')
+            # Send the request to the server and receive the response
             try:
-                nonce =  str(int(time.time()*1E6))
-                if params != None:
-                    if isinstance(params, dict):
-                        params = params.items()
-                else:
-                    params = []
-
-                params += [(u'nonce',nonce)]
-                post_data = urllib.urlencode(params)
-                ahmac = base64.b64encode(str(hmac.new(base64.b64decode(self.secret),post_data,hashlib.sha512).digest()))
-
-                if API_VERSION == 0:
-                    url = self.__url_parts + '0/' + path
-                elif API_VERSION == 1: 
-                    url = self.__url_parts + '1/' + path
-                else: #assuming API_VERSION 2
-                    url = self.__url_parts + '2/' + path
-                    api2postdatatohash = path + chr(0) + post_data          #new way to hash for API 2, includes path + NUL
-                    ahmac = base64.b64encode(str(hmac.new(base64.b64decode(self.secret),api2postdatatohash,hashlib.sha512).digest()))
-                
-                # Create header for auth-requiring operations
-                header = {
-                    "User-Agent": 'genBTC-bot',
-                    "Rest-Key": self.key,
-                    "Rest-Sign": ahmac
-                    }
-                # Create the request
-                if GET:
-                    req = urllib2.Request(url)
-                else:
-                    req = urllib2.Request(url, post_data, header)
-                # if GZIP was set, accept gzip encoding
-                if GZIP:
-                    req.add_header('Accept-encoding', 'gzip')
-                # Send the request to the server and receive the response
                 if GET:
-                    resp = urllib2.urlopen(req)
+                    resp = httppool.urlopen(req)
                 else:
-                    resp = urllib2.urlopen(req, post_data)
-                # Un-Gzip the response
-                if resp.info().get('Content-Encoding') == 'gzip':
-                    buf = io.BytesIO(resp.read())
-                    resp = gzip.GzipFile(fileobj=buf)
-                # if JSON was set, json-ify the response, or say what went wrong, otherwise return plain data
-                if JSON == True:
-                    try:
-                        data = json.load(resp,object_hook=json_ascii.decode_dict)
-                        if "error" in data:
-                            if data["error"] == "Not logged in.":
-                                print UserError(data["error"])
-                            else:
-                                print ServerError(data["error"])
-                    except ValueError as e:
-                        print "JSON Error: %s." % e
-                        continue
-                else:
-                    data = resp.read()
-                return data
-            #Try to catch a number of possible errors. 
-            #Since this is used for debugging, logging.debug() should really be used instead
+                    resp = httppool.urlopen(req, sign=sign, signlock=self.sendlock)
             except urllib2.HTTPError as e:
                 #HTTP Error ie: 500/502/503 etc
                 print 'HTTP Error %s: %s' % (e.code, e.msg)
                 print "URL: %s" % (e.filename)
-                if e.fp:
-                    datastring = e.fp.read()
-                    if "error" in datastring:
-                        if "<!DOCTYPE HTML>" in datastring:
-                            print "Error: Cloudflare - Website Currently Unavailable."
-                        elif "Order not found" in datastring:
-                            return json.loads(datastring)
-                        elif "Too many orders" in datastring:
-                            self.wait = int(datastring[datastring.find("wait")+5:datastring.find("secs")-1])
-                            self.order_ban = self.wait - self.order_timeout
-                            print "ERROR: Too many orders. Please wait %s seconds..." % self.wait
-                        else:
-                            print "Error: %s" % datastring                            
-            except urllib2.URLError as e:
-                print "URL Error:", e 
-            except ssl.SSLError as e:
-                print "SSL Error: %s." % e  #Read error timeout. (Removed timeout variable)
-            except Exception as e:
-                print "General Error: %s" % e
+                datastring = e.fp.read() if e.fp else ""
+                if "<!DOCTYPE HTML>" in datastring:
+                    raise retrypolicy.Retryable(retrypolicy.CLOUDFLARE, "Cloudflare - Website Currently Unavailable.")
+                elif "Order not found" in datastring:
+                    return json.loads(datastring)
+                elif "Too many orders" in datastring:
+                    self.wait = int(datastring[datastring.find("wait")+5:datastring.find("secs")-1])
+                    self.limiter.ban("order", self.wait)
+                    print "ERROR: Too many orders. Please wait %s seconds..." % self.wait
+                    raise retrypolicy.Retryable(retrypolicy.RATELIMIT, "Too many orders", self.wait)
+                e.body = datastring
+                raise
+            # Un-Gzip the response
+            if resp.info().get('Content-Encoding') == 'gzip':
+                buf = io.BytesIO(resp.read())
+                resp = gzip.GzipFile(fileobj=buf)
+            # if JSON was set, json-ify the response, or say what went wrong, otherwise return plain data
+            if JSON == True:
+                try:
+                    data = json.load(resp,object_hook=json_ascii.decode_dict)
+                except ValueError as e:
+                    raise retrypolicy.Retryable(retrypolicy.BADJSON, "JSON Error: %s." % e)
+                if "error" in data:
+                    if data["error"] == "Not logged in.":
+                        print UserError(data["error"])
+                    else:
+                        print ServerError(data["error"])
             else:
-            #print this before going back up to the While Loop and running this entire function over again
-                print "Retrying Connection...."
+                data = resp.read()
+            return data
+
+        idempotent = not [part for part in NOT_IDEMPOTENT if part in path]
+        return self.policy.call("data.mtgox.com", attempt, deadline, idempotent)
 
 
     def request(self, path, params,JSON=True,API_VERSION=0,GZIP=True,GET=False):
@@ -269,22 +238,27 @@ class Client:
         balance = { "usds":info[CURRENCY]["Balance"]["value"], "btcs":info[PRODUCT]["Balance"]["value"] }
         return balance
 
-    def get_ticker(self):
-        return self.request("ticker.php",None,GET=True)["ticker"]
-    def get_ticker2(self):
-        return self.request(PAIR + "/money/ticker",None,API_VERSION=2,GET=True)["data"]
-    def get_tickerfast(self):
-        return self.request(PAIR + "/money/ticker_fast",None,API_VERSION=2,GET=True)["data"]
-
-    def get_depth(self):
-        return self.request("data/getDepth.php", {"Currency":CURRENCY})
-    def get_fetchdepth(self):
-        return self.request(PAIR + "/money/depth/fetch",None,API_VERSION=2,GET=True)
-    def get_fulldepth(self):
+    #public data is shared through ttlcache.public, maxage overrides the
+    #endpoint's TTL (0 always fetches)
+    def get_ticker(self,maxage=None):
+        return ttlcache.public.get("ticker", lambda: self.request("ticker.php",None,GET=True)["ticker"], maxage)
+    def get_ticker2(self,maxage=None):
+        return ttlcache.public.get("ticker2", lambda: self.request(PAIR + "/money/ticker",None,API_VERSION=2,GET=True)["data"], maxage)
+    def get_tickerfast(self,maxage=None):
+        return ttlcache.public.get("tickerfast", lambda: self.request(PAIR + "/money/ticker_fast",None,API_VERSION=2,GET=True)["data"], maxage)
+
+    def get_depth(self,maxage=None):
+        return ttlcache.public.get("depth", lambda: self.request("data/getDepth.php", {"Currency":CURRENCY}), maxage)
+    def get_fetchdepth(self,maxage=None):
+        return ttlcache.public.get("fetchdepth", lambda: self.request(PAIR + "/money/depth/fetch",None,API_VERSION=2,GET=True), maxage)
+    def get_fulldepth(self,maxage=None):
+        return ttlcache.public.get("fulldepth", self.fetch_fulldepth, maxage)
+    def fetch_fulldepth(self):
+        #uncached
         return self.request(PAIR + "/money/depth/full",None,API_VERSION=2,GET=True)
 
-    def get_trades(self):
-        return self.request("data/getTrades.php",None,GET=True)
+    def get_trades(self,maxage=None):
+        return ttlcache.public.get("trades", lambda: self.request("data/getTrades.php",None,GET=True), maxage)
     def entire_trade_history(self):
         return self.request(PAIR + "/money/trades/fetch",None,API_VERSION=2,GET=True)
 
@@ -345,16 +319,18 @@ class Client:
 
     def cancel_all(self):
         orders = self.get_orders()
-        for order in orders['orders']:
-            typ = order['type']
-            ordertype="Sell" if typ == 1 else "Buy"
-            oid = order['oid']
-            params = {"oid":str(oid)}
-            result = self.request(PAIR + "/money/order/cancel", params, API_VERSION=2)
-            print '%s OID: %s Successfully Cancelled!' % (ordertype,oid)
+        def cancel(oid):
+            return self.request(PAIR + "/money/order/cancel", {"oid":str(oid)}, API_VERSION=2)
+        results = batchorder.engine.cancel(cancel, [order['oid'] for order in orders['orders']])
+        for order, r in zip(orders['orders'], results):
+            ordertype="Sell" if order['type'] == 1 else "Buy"
+            if r.ok:
+                print '%s OID: %s Successfully Cancelled!' % (ordertype,order['oid'])
+            else:
+                print '%s OID: %s not cancelled: %s' % (ordertype,order['oid'],r.error)
         if orders['orders']:
-            print "All Orders have been Cancelled!!!!!"
-            self.orders = result
+            print "All Orders have been Cancelled!!!!! (%.2f seconds)" % results.elapsed
+            self.get_orders()       #what is left after the batch
         else:
             print "No Orders found!!"
         return self.orders
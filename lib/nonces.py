@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# nonces.py
+# Nonces for the signed API calls, unique and increasing for every thread
+# and every process using the same API key. The last nonce handed out
+# lives in a small file in ../data/ that is mapped into memory (mmap), so
+# taking the next one is a flock() and a memory write, not a read and
+# rewrite of a file on disk.
+#
+#   allocator = nonces.allocator("mtgox", floor=nonces.microseconds)
+#   nonce = allocator.next()
+#
+# floor() gives the lowest nonce to hand out next (mtgox and bitfloor want
+# microsecond timestamps, btc-e just a counter).
+# block=N reserves N nonces at a time for this process, the shared file is
+# then only locked once every N calls. Nonces stay unique across processes
+# but only increase inside this process, so keep block=1 (the default) when
+# more than one process uses the key and the exchange wants them in order.
+
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+    import mmap
+except ImportError:     #windows: plain file, no locking between processes
+    fcntl = None
+
+fullpath = os.path.dirname(os.path.realpath(__file__))
+if os.name == 'nt':
+    partialpath=os.path.join(fullpath + '\\..\\data\\')
+else:
+    partialpath=os.path.join(fullpath + '/../data/')
+
+#magic, last nonce reserved
+STATE = struct.Struct('<4sq')
+MAGIC = 'NON1'
+
+
+def microseconds():
+    return int(time.time()*1E6)
+
+def milliseconds():
+    return int(time.time()*1E3)
+
+
+class _MappedCounter(object):
+    """the last reserved nonce in a mmapped file, changed under flock"""
+    def __init__(self, path, seed):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < STATE.size:
+                os.ftruncate(self.fd, STATE.size)
+            self.map = mmap.mmap(self.fd, STATE.size)
+            if self.map[:4] != MAGIC:
+                STATE.pack_into(self.map, 0, MAGIC, seed())
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def reserve(self, count, floor):
+        """reserve count nonces above both the last one and floor,
+        returns the first"""
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            last = STATE.unpack_from(self.map, 0)[1]
+            first = max(last, floor) + 1
+            STATE.pack_into(self.map, 0, MAGIC, first + count - 1)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return first
+
+
+class _FileCounter(object):
+    """fallback without fcntl/mmap: the number as text in a file, like
+    nonce_state_btce always was"""
+    def __init__(self, path, seed):
+        self.path = path
+        if not os.path.exists(path):
+            self._write(seed())
+
+    def _write(self, n):
+        with open(self.path, 'w') as f:
+            f.write(str(n))
+
+    def reserve(self, count, floor):
+        with open(self.path, 'r') as f:
+            last = int(f.read().strip() or 0)
+        first = max(last, floor) + 1
+        self._write(first + count - 1)
+        return first
+
+
+class NonceAllocator(object):
+    """Usage: allocator = NonceAllocator("btce", legacy="nonce_state_btce")
+        params["nonce"] = allocator.next()"""
+    def __init__(self, name, floor=None, block=1, legacy=None):
+        self.floor = floor
+        self.block = block
+        self.lock = threading.Lock()
+        self._next = 0
+        self._end = 0                   #first nonce not reserved by us
+        path = os.path.join(partialpath, 'nonce_%s' % name)
+        def seed():
+            #start where an old text nonce file (ie: nonce_state_btce) left off
+            if legacy:
+                try:
+                    with open(os.path.join(partialpath, legacy)) as f:
+                        return int(f.read().strip())
+                except (IOError, ValueError):
+                    pass
+            return 0
+        if fcntl is not None:
+            self._counter = _MappedCounter(path, seed)
+        else:
+            self._counter = _FileCounter(path, seed)
+
+    def next(self):
+        with self.lock:
+            floor = self.floor() if self.floor else 0
+            if self._next >= self._end:
+                self._next = self._counter.reserve(self.block, floor)
+                self._end = self._next + self.block
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def __iter__(self):
+        return self
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+def allocator(name, floor=None, block=1, legacy=None):
+    """the process wide NonceAllocator of one API key, made on first use"""
+    with _allocators_lock:
+        if name not in _allocators:
+            _allocators[name] = NonceAllocator(name, floor, block, legacy)
+        return _allocators[name]
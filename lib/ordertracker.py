@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# ordertracker.py
+# Keeps the state of our own orders on one exchange, so nothing has to
+# download the open order list and search through it to find out what
+# happened to an order.
+#
+# Every order goes through
+#     pending -> open -> partial -> filled / cancelled
+# driven by the events the exchange sends: the ack of an order (its oid),
+# the user_order messages of the MtGox stream and our own cancels. Orders
+# are found by oid and by the client id they were submitted with (dicts,
+# no loops).
+#
+# The REST list of open orders is only used as a periodic diff
+# (reconcile()): orders we did not know about are added, the ones that are
+# gone without an event are closed, and the remaining volume is corrected.
+# Every state change goes into the journal and to the listeners:
+#     listener(order, old_state, source)
+#
+# Prices and volumes are Decimals, sides "bid"/"ask" like the MtGox stream.
+# from_mtgox/from_bitfloor/from_bitstamp turn an entry of each client's
+# open order list into the dict reconcile() wants.
+
+import collections
+import itertools
+import threading
+import time
+import traceback
+from decimal import Decimal as D
+
+PENDING = "pending"
+OPEN = "open"
+PARTIAL = "partial"
+FILLED = "filled"
+CANCELLED = "cancelled"
+
+LIVE = frozenset([PENDING, OPEN, PARTIAL])
+
+
+class TrackedOrder(object):
+    """one of our orders. info is the last raw entry the exchange sent."""
+    __slots__ = ('oid', 'client_id', 'side', 'price', 'volume', 'remaining', 'state',
+                 'status', 'info', 'created', 'updated', 'cancel_requested')
+    def __init__(self, client_id, side, price, volume, oid=None, state=PENDING):
+        self.oid = oid
+        self.client_id = client_id
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.remaining = volume
+        self.state = state
+        self.status = ""
+        self.info = None
+        self.created = self.updated = time.time()
+        self.cancel_requested = False
+
+    def live(self):
+        return self.state in LIVE
+
+    def __repr__(self):
+        return "<%s %s %s %s @ %s (%s left) %s>" % (self.oid or self.client_id, self.state,
+            self.side, self.volume, self.price, self.remaining, self.status)
+
+
+def from_mtgox(order):
+    """an entry of mtgoxhmac.Client.get_orders()['orders']"""
+    return {"oid": order['oid'], "side": "ask" if order['type'] == 1 else "bid",
+            "price": D(str(order['price'])), "volume": D(str(order['amount'])),
+            "status": order.get('status', ""), "info": order}
+
+def from_bitfloor(order):
+    """an entry of bitfloorapi.Client.orders()"""
+    return {"oid": order['order_id'], "side": "bid" if order['side'] == 0 else "ask",
+            "price": D(str(order['price'])), "volume": D(str(order['size'])),
+            "status": order.get('status', ""), "info": order}
+
+def from_bitstamp(order):
+    """an entry of bitstampapi.Client.open_orders()"""
+    return {"oid": order['id'], "side": "bid" if order['type'] == 0 else "ask",
+            "price": D(str(order['price'])), "volume": D(str(order['amount'])),
+            "status": "", "info": order}
+
+
+class OrderTracker(object):
+    """Usage: tracker = OrderTracker("mtgox")
+        tracker.connect(gox)                            #follow the stream
+        tracker.start(fetch, from_mtgox, interval=300)  #and diff with REST now and then
+        tracker.open_orders()
+        tracker.get(oid)"""
+    def __init__(self, venue, journal=1000, keep=5000):
+        self.venue = venue
+        self.keep = keep                    #closed orders that can still be looked up
+        self._closed = collections.deque()
+        self.lock = threading.RLock()
+        self.byoid = {}
+        self.byclient = {}
+        self.live = set()                   #oids of the live orders
+        self.unacked = {}                   #(side, price, volume) -> [TrackedOrder] without oid
+        self.journal = collections.deque(maxlen=journal)   #(time, oid, old state, new state, source)
+        self.listeners = []
+        self.synced = threading.Event()     #set after the first reconcile
+        self.gox = None
+        self.cplaces = 5
+        self._ids = itertools.count(1)
+        self._stop = threading.Event()
+
+    def _set(self, order, state, source, remaining=None):
+        old = order.state
+        if remaining is not None:
+            order.remaining = remaining
+            if state == OPEN and remaining < order.volume:
+                state = PARTIAL
+        if old in LIVE or old == state:
+            order.state = state
+        order.updated = time.time()
+        if order.oid is not None:
+            if order.state in LIVE:
+                self.live.add(order.oid)
+            elif order.oid in self.live:
+                self.live.discard(order.oid)
+                self._forget_old(order)
+        if order.state != old:
+            self.journal.append((order.updated, order.oid, old, order.state, source))
+            for listener in self.listeners:
+                try:
+                    listener(order, old, source)
+                except Exception:
+                    traceback.print_exc()
+
+    def _forget_old(self, order):
+        self._closed.append(order)
+        while len(self._closed) > self.keep:
+            old = self._closed.popleft()
+            self.byoid.pop(old.oid, None)
+            self.byclient.pop(old.client_id, None)
+
+    def _index(self, order, oid):
+        order.oid = oid
+        self.byoid[oid] = order
+
+    def get(self, oid):
+        return self.byoid.get(oid)
+
+    def by_client(self, client_id):
+        return self.byclient.get(client_id)
+
+    def open_orders(self):
+        """the live orders that have an oid, lowest price first"""
+        with self.lock:
+            orders = [self.byoid[oid] for oid in self.live]
+        return sorted(orders, key=lambda o: o.price)
+
+    def submitted(self, side, price, volume, client_id=None):
+        """an order was sent, its oid is not known yet"""
+        with self.lock:
+            if client_id is None:
+                client_id = "c%d" % self._ids.next()
+            order = TrackedOrder(client_id, side, D(price), D(volume))
+            self.byclient[client_id] = order
+            self.unacked.setdefault((order.side, order.price, order.volume), []).append(order)
+            self.journal.append((order.created, None, None, PENDING, "submit"))
+            return order
+
+    def acked(self, client_id, oid):
+        """the exchange accepted the order sent as client_id, it is oid"""
+        with self.lock:
+            order = self.byclient.get(client_id)
+            if order is None:
+                return None
+            waiting = self.unacked.get((order.side, order.price, order.volume), [])
+            if order in waiting:
+                waiting.remove(order)
+                if not waiting:
+                    del self.unacked[(order.side, order.price, order.volume)]
+            self._index(order, oid)
+            self._set(order, order.state, "ack")
+            return order
+
+    def cancel_requested(self, oid):
+        """we asked for oid to be cancelled: when it is gone it was cancelled
+        (an order that disappears without this counts as filled)"""
+        with self.lock:
+            order = self.byoid.get(oid)
+            if order is not None:
+                order.cancel_requested = True
+
+    def update(self, oid, side, price, volume, status="", source="stream", info=None):
+        """the exchange says oid is on the book with volume left"""
+        with self.lock:
+            order = self.byoid.get(oid)
+            if order is None:
+                waiting = self.unacked.get((side, price, volume))
+                if waiting:
+                    order = waiting.pop(0)
+                    if not waiting:
+                        del self.unacked[(side, price, volume)]
+                else:
+                    order = TrackedOrder(None, side, price, volume)
+                self._index(order, oid)
+            order.status = status
+            if info is not None:
+                order.info = info
+            state = PENDING if status in ("pending", "executing", "post-pending") else OPEN
+            if order.state != PENDING and state == PENDING:
+                state = order.state
+            self._set(order, state, source, remaining=volume)
+            return order
+
+    def removed(self, oid, source="stream"):
+        """oid is not on the book anymore"""
+        with self.lock:
+            order = self.byoid.get(oid)
+            if order is None or not order.live():
+                return order
+            if order.cancel_requested:
+                self._set(order, CANCELLED, source)
+            else:
+                self._set(order, FILLED, source, remaining=D(0))
+            return order
+
+    def reconcile(self, snapshot, since=None):
+        """diff the tracked orders with a REST list of open orders (dicts
+        from from_mtgox & co). Orders that changed after <since> (the time
+        the list was requested) are left alone, the stream was quicker.
+        Returns {"appeared":[], "vanished":[], "changed":[]}"""
+        if since is None:
+            since = time.time()
+        diff = {"appeared": [], "vanished": [], "changed": []}
+        with self.lock:
+            seen = set()
+            for entry in snapshot:
+                oid = entry["oid"]
+                seen.add(oid)
+                order = self.byoid.get(oid)
+                if order is None:
+                    order = self.update(oid, entry["side"], entry["price"], entry["volume"],
+                                        entry["status"], "reconcile", entry["info"])
+                    diff["appeared"].append(order)
+                else:
+                    order.info = entry["info"]
+                    order.status = entry["status"]
+                    if order.remaining != entry["volume"] and order.updated < since:
+                        self._set(order, OPEN, "reconcile", remaining=entry["volume"])
+                        diff["changed"].append(order)
+            for oid in list(self.live - seen):
+                order = self.byoid[oid]
+                if order.updated < since:
+                    self.removed(oid, "reconcile")
+                    diff["vanished"].append(order)
+        self.synced.set()
+        return diff
+
+    def start(self, fetch, parse, interval=300):
+        """reconcile with map(parse, fetch()) now and every interval seconds"""
+        def run():
+            while not self._stop.is_set():
+                try:
+                    since = time.time()
+                    self.reconcile([parse(entry) for entry in fetch()], since)
+                except Exception:
+                    traceback.print_exc()
+                self._stop.wait(interval)
+        self._stop.clear()
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def connect(self, gox):
+        """follow the user_order messages of a mtgox_prof7bitapi.Gox (keep
+        the tracker alive, Signals only hold weak references)"""
+        self.gox = gox
+        self.cplaces = 3 if gox.currency == "JPY" else 5
+        gox.signal_userorder.connect(self.slot_user_order)
+
+    def slot_user_order(self, dummy_sender, data):
+        """Slot for signal_userorder"""
+        (price, volume, typ, oid, status) = data
+        if status == "removed":
+            self.removed(oid)
+        else:
+            self.update(oid, typ, D(price).scaleb(-self.cplaces), D(volume).scaleb(-8), status)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# pricebuckets.py
+# Groups one side of an order book into price buckets. Used by the
+# mtgox_client bookgroup command and by the depthparser "steps" argument.
+#
+# Levels are passed as two parallel sequences of integers (prices, volumes)
+# in walking order: asks lowest price first, bids highest price first
+# (descending=True). Everything is done in a single pass over the integers,
+# nothing is converted to Decimal/float here.
+#
+# Every function returns a list of Bucket(price, volume, total, start, end):
+#     price   the price the bucket is labelled with
+#     volume  sum of the volumes in the bucket
+#     total   cumulative volume of this and all previous buckets
+#     start, end  index range [start:end) of the levels in the bucket
+
+import bisect
+import collections
+
+Bucket = collections.namedtuple('Bucket', 'price volume total start end')
+
+
+def _group(prices, volumes, label, inside, start, end):
+    """the actual pass: open a bucket at the first level that is not
+    inside the current one, label(price) gives the new bucket's price"""
+    if end is None:
+        end = len(prices)
+    buckets = []
+    total = 0
+    i = start
+    while i < end:
+        edge = label(prices[i])
+        j = i
+        volume = 0
+        while j < end and inside(prices[j], edge):
+            volume += volumes[j]
+            j += 1
+        total += volume
+        buckets.append(Bucket(edge, volume, total, i, j))
+        i = j
+    return buckets
+
+
+def fixed(prices, volumes, width, descending=False, start=0, end=None):
+    """buckets of a fixed price width, aligned to multiples of width
+    (like the grouping on clarkmoody's). Asks are labelled with the upper
+    bound of their bucket, bids with the lower bound."""
+    if descending:
+        return _group(prices, volumes, lambda p: p // width * width,
+                      lambda p, edge: p >= edge, start, end)
+    return _group(prices, volumes, lambda p: -(-p // width) * width,
+                  lambda p, edge: p <= edge, start, end)
+
+
+def nsteps(prices, volumes, steps, low, high, descending=False, start=0, end=None):
+    """split low..high into <steps> buckets of equal width, measured from
+    low for asks and from high for bids. Each bucket is labelled with its
+    far end, the level at low (high for bids) goes into the first one."""
+    width = max(1, -(-(high - low) // steps))
+    if descending:
+        return _group(prices, volumes,
+                      lambda p: high - max(1, -(-(high - p) // width)) * width,
+                      lambda p, edge: p >= edge, start, end)
+    return _group(prices, volumes,
+                  lambda p: low + max(1, -(-(p - low) // width)) * width,
+                  lambda p, edge: p <= edge, start, end)
+
+
+def walk(prices, volumes, steps, low, high, descending=False, start=0, end=None):
+    """the stepping used by the depth "steps" argument: the first bucket
+    ends one step (of (high-low)/steps) from the start, every level outside
+    the current bucket opens the next one and moves its end by one more
+    step. Buckets are labelled with the price of the last level that fell
+    inside the step (an opening level keeps the previous label)."""
+    if end is None:
+        end = len(prices)
+    if descending:
+        size = (high - low) * -1 / steps
+        inside = lambda p: p >= edge
+        edge = high + size
+    else:
+        size = (high - low) / steps
+        inside = lambda p: p <= edge
+        edge = low + size
+    buckets = []
+    total = 0
+    first = start
+    price = prices[start] if start < end else None
+    i = start
+    while i < end:
+        if inside(prices[i]):
+            while i < end and inside(prices[i]):
+                i += 1
+            price = prices[i - 1]
+        else:
+            if i > first:
+                volume = sum(volumes[first:i])
+                total += volume
+                buckets.append(Bucket(price, volume, total, first, i))
+            first = i
+            edge += size
+            i += 1
+    if first < end and inside(price):
+        volume = sum(volumes[first:end])
+        buckets.append(Bucket(price, volume, total + volume, first, end))
+    return buckets
+
+
+class _Prices(object):
+    """integer prices of a list of Order objects as a sequence for bisect,
+    negated for bids so it is always ascending"""
+    def __init__(self, levels, descending):
+        self.levels = levels
+        self.sign = -1 if descending else 1
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, i):
+        return self.levels[i].price * self.sign
+
+
+class BookBuckets(object):
+    """Usage: groups = BookBuckets(gox.orderbook)
+        for bucket in groups.fixed("asks", width, low, high): ...
+    Groups the live orderbook (lists of Order with integer price/volume,
+    asks lowest first, bids highest first). Results are cached per
+    book.version, so rendering the same book again costs nothing."""
+    def __init__(self, book):
+        self.book = book
+        self._cache = {}
+        self._version = None
+
+    def _levels(self, side, low, high):
+        """prices and volumes of the levels between low and high"""
+        levels = getattr(self.book, side)
+        descending = side == "bids"
+        key = _Prices(levels, descending)
+        if descending:
+            lo = bisect.bisect_left(key, -high) if high is not None else 0
+            hi = bisect.bisect_right(key, -low) if low is not None else len(levels)
+        else:
+            lo = bisect.bisect_left(key, low) if low is not None else 0
+            hi = bisect.bisect_right(key, high) if high is not None else len(levels)
+        levels = levels[lo:hi]
+        return [o.price for o in levels], [o.volume for o in levels], descending
+
+    def _get(self, key, make):
+        version = getattr(self.book, "version", None)
+        if version is None or version != self._version:
+            self._cache = {}
+            self._version = version
+        if key in self._cache:
+            return self._cache[key]
+        result = make()
+        #only keep it if the book did not change underneath us meanwhile
+        if version is not None and version == getattr(self.book, "version", None):
+            self._cache[key] = result
+        return result
+
+    def fixed(self, side, width, low=None, high=None):
+        def make():
+            prices, volumes, descending = self._levels(side, low, high)
+            return fixed(prices, volumes, width, descending)
+        return self._get(("fixed", side, width, low, high), make)
+
+    def nsteps(self, side, steps, low, high):
+        def make():
+            prices, volumes, descending = self._levels(side, low, high)
+            return nsteps(prices, volumes, steps, low, high, descending)
+        return self._get(("nsteps", side, steps, low, high), make)
+
+    def beyond(self, side, low, high):
+        """one Bucket of all the levels past the far end of low..high (asks
+        above high, bids below low), labelled with the first of their prices.
+        Its total goes on from the buckets of the range. None if there are
+        no such levels."""
+        def make():
+            levels = getattr(self.book, side)
+            key = _Prices(levels, side == "bids")
+            if side == "bids":
+                first = bisect.bisect_left(key, -high)
+                far = bisect.bisect_right(key, -low)
+            else:
+                first = bisect.bisect_left(key, low)
+                far = bisect.bisect_right(key, high)
+            if far >= len(levels):
+                return None
+            inside = sum(o.volume for o in levels[first:far])
+            volume = sum(o.volume for o in levels[far:])
+            return Bucket(levels[far].price, volume, inside + volume, far, len(levels))
+        return self._get(("beyond", side, low, high), make)
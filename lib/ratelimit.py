@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# ratelimit.py
+# Token bucket rate limits for the exchange APIs, one bucket per class of
+# endpoint (ie: mtgox "query" and "order"). The buckets are shared by every
+# thread in the process (get them through limiter()) and, where fcntl/mmap
+# exist, by every process on the machine through a small file in ../data/
+# that holds the bucket state and is locked while it is changed.
+#
+#   bucket.try_acquire()        take a token if there is one, never waits
+#   bucket.acquire()            wait until a token is there (or timeout)
+#   bucket.acquire_async(func)  call func() from a timer thread once a token
+#                               was taken, the caller goes on immediately
+#   bucket.ban(seconds)         the server said "wait", nobody gets a token
+#                               until then and it starts empty after it
+#
+# A bucket holds at most <capacity> tokens and gets <rate> new ones every
+# second, so bursts of capacity calls are allowed and the long term rate
+# stays below rate calls per second.
+
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+    import mmap
+except ImportError:     #windows: buckets are only shared inside the process
+    fcntl = None
+
+fullpath = os.path.dirname(os.path.realpath(__file__))
+if os.name == 'nt':
+    partialpath=os.path.join(fullpath + '\\..\\data\\')
+else:
+    partialpath=os.path.join(fullpath + '/../data/')
+
+#magic, tokens, time of the last update, banned until
+STATE = struct.Struct('<4sddd')
+MAGIC = 'TKB1'
+
+
+class _LocalState(object):
+    """bucket state kept in this process only"""
+    def __init__(self, capacity):
+        self.state = (capacity, time.time(), 0.0)
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def read(self):
+        return self.state
+    def write(self, tokens, stamp, banned):
+        self.state = (tokens, stamp, banned)
+
+
+class _FileState(object):
+    """bucket state in a file mapped into memory, every process using the
+    same file shares the bucket. flock() is held while it is changed."""
+    def __init__(self, path, capacity):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < STATE.size:
+                os.ftruncate(self.fd, STATE.size)
+            self.map = mmap.mmap(self.fd, STATE.size)
+            if self.map[:4] != MAGIC:
+                STATE.pack_into(self.map, 0, MAGIC, capacity, time.time(), 0.0)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return False
+    def read(self):
+        return STATE.unpack_from(self.map, 0)[1:]
+    def write(self, tokens, stamp, banned):
+        STATE.pack_into(self.map, 0, MAGIC, tokens, stamp, banned)
+
+
+class TokenBucket(object):
+    """Usage: orders = TokenBucket(1.0, 6)    #6 at once, then 1 per second
+        if orders.try_acquire(): ...
+        orders.acquire()"""
+    def __init__(self, rate, capacity, path=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.lock = threading.Lock()
+        self._state = None
+        if path and fcntl is not None:
+            try:
+                self._state = _FileState(path, self.capacity)
+            except (IOError, OSError):
+                pass
+        if self._state is None:
+            self._state = _LocalState(self.capacity)
+
+    def _take(self, n, take=True):
+        """take n tokens if they are there. Returns 0 when they were taken,
+        otherwise the seconds to wait before they can be."""
+        with self.lock:
+            with self._state:
+                tokens, stamp, banned = self._state.read()
+                now = time.time()
+                #nothing is earned during a ban, the bucket starts empty after it
+                tokens = min(self.capacity, tokens + max(0, now - max(stamp, banned)) * self.rate)
+                if now < banned:
+                    wait = banned - now
+                elif tokens >= n:
+                    if take:
+                        tokens -= n
+                    wait = 0
+                else:
+                    wait = (n - tokens) / self.rate
+                self._state.write(tokens, now, banned)
+        return wait
+
+    def wait_time(self, n=1):
+        """seconds until n tokens are available, without taking them"""
+        return self._take(n, take=False)
+
+    def try_acquire(self, n=1):
+        """take n tokens if available right now, True if they were taken"""
+        return self._take(n) == 0
+
+    def acquire(self, n=1, timeout=None):
+        """wait until n tokens were taken. Returns False if that did not
+        happen within timeout seconds."""
+        if n > self.capacity:
+            raise ValueError("bucket only holds %d tokens" % self.capacity)
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            wait = self._take(n)
+            if not wait:
+                return True
+            if deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                wait = min(wait, left)
+            time.sleep(wait)
+
+    def acquire_async(self, func, n=1):
+        """take n tokens in the background and then call func()"""
+        def attempt():
+            wait = self._take(n)
+            if wait:
+                timer = threading.Timer(wait, attempt)
+                timer.daemon = True
+                timer.start()
+            else:
+                func()
+        attempt()
+
+    def ban(self, seconds):
+        """the server refused us for <seconds>: empty the bucket and hand
+        out nothing until the ban is over"""
+        with self.lock:
+            with self._state:
+                tokens, stamp, banned = self._state.read()
+                now = time.time()
+                self._state.write(0.0, now, max(banned, now + seconds))
+
+
+class RateLimiter(object):
+    """the buckets of one exchange. buckets is {name: (rate, capacity)}"""
+    def __init__(self, name, buckets, shared=True):
+        self.name = name
+        self.buckets = {}
+        for bucket, (rate, capacity) in buckets.iteritems():
+            path = None
+            if shared:
+                path = os.path.join(partialpath, 'ratelimit_%s_%s' % (name, bucket))
+            self.buckets[bucket] = TokenBucket(rate, capacity, path)
+
+    def __getitem__(self, bucket):
+        return self.buckets[bucket]
+
+    def try_acquire(self, bucket, n=1):
+        return self.buckets[bucket].try_acquire(n)
+
+    def acquire(self, bucket, n=1, timeout=None):
+        return self.buckets[bucket].acquire(n, timeout)
+
+    def ban(self, bucket, seconds):
+        self.buckets[bucket].ban(seconds)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def limiter(name, buckets, shared=True):
+    """the process wide RateLimiter of an exchange, made on first use"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, buckets, shared)
+        return _limiters[name]
+
+#mtgox: 40 queries per 20 seconds, 6 orders per 6 seconds
+MTGOX = {"query": (2.0, 40), "order": (1.0, 6)}
+#bitstamp: 600 requests per 10 minutes, bursts kept short
+BITSTAMP = {"request": (1.0, 20)}
+#bitfloor publishes no limit, orders go at the mtgox order rate
+BITFLOOR = {"order": (1.0, 6)}
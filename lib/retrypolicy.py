@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# retrypolicy.py
+# Retries for the exchange clients. When something fails, the error is
+# sorted into a kind first:
+#     cloudflare   the Cloudflare "website unavailable" page
+#     ratelimit    the exchange said "too many", wait as long as it asked
+#     server       HTTP 5xx
+#     timeout      the socket or SSL read timed out
+#     refused      could not connect at all, or the exchange turned the call
+#                  down without doing it (a bad nonce)
+#     network      connection reset, ...
+#     badjson      the answer could not be parsed
+#     fatal        anything else (4xx, bad arguments), never retried
+# Retryable errors are tried again after an exponential backoff with jitter
+# until the attempts or the deadline of the call run out (GaveUp).
+#
+# Calls that must not be done twice (placing an order, a withdrawal) are
+# made with idempotent=False: they are only retried when the request surely
+# did not get through (ratelimit, refused). Any other retryable error means
+# it may have been carried out, Uncertain is raised instead of a retry and
+# the caller has to look (open orders) before trying again.
+#
+# Every host has a CircuitBreaker: after <threshold> failures in a row it
+# opens and every call to that host raises CircuitOpen right away, without
+# touching the network, for <reset> seconds. Then one call is let through
+# to test the host (half open); if that works the breaker closes again.
+# Errors the host answered with itself (a rate limit, a refused nonce) are
+# not failures of the host, they are left to the backoff and the wait the
+# host asked for and do not count for the breaker.
+# Callers that would rather go to another exchange than wait can check
+# available(host) first, or catch CircuitOpen.
+#
+#   policy = RetryPolicy(attempts=6, deadline=60)
+#   data = policy.call("data.mtgox.com", attempt)      #attempt() does one try
+#   result = policy.call("btc-e.com", attempt, idempotent=False)
+#
+# The interactive clients catch GaveUp, Uncertain and CircuitOpen around
+# their commands and print them, scripts let them end the script.
+
+import errno
+import random
+import socket
+import ssl
+import threading
+import time
+import urllib2
+
+CLOUDFLARE = "cloudflare"
+RATELIMIT = "ratelimit"
+SERVER = "server"
+TIMEOUT = "timeout"
+REFUSED = "refused"
+NETWORK = "network"
+BADJSON = "badjson"
+FATAL = "fatal"
+
+RETRYABLE = frozenset([CLOUDFLARE, RATELIMIT, SERVER, TIMEOUT, REFUSED, NETWORK, BADJSON])
+#the request surely was not carried out, even a non idempotent call is retried
+NOT_DONE = frozenset([RATELIMIT, REFUSED])
+
+#errnos of a connection that was never made
+_NOT_CONNECTED = frozenset([errno.ECONNREFUSED, errno.ENETUNREACH, errno.EHOSTUNREACH])
+
+
+class Retryable(Exception):
+    """raised by an attempt for an error it already knows the kind of.
+    wait is how long the server asked us to wait (rate limits)."""
+    def __init__(self, kind, message, wait=None):
+        Exception.__init__(self, message)
+        self.kind = kind
+        self.wait = wait
+
+
+class CircuitOpen(Exception):
+    """the host failed too often lately, the call was not even tried"""
+    def __init__(self, host, retry_in):
+        Exception.__init__(self, "%s is unavailable, retry in %.1f seconds" % (host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+
+class GaveUp(Exception):
+    """the call kept failing until its attempts or deadline ran out.
+    last is the last error, kind its kind."""
+    def __init__(self, host, attempts, last, kind):
+        Exception.__init__(self, "%s failed %d times, last error (%s): %s" % (host, attempts, kind, last))
+        self.host = host
+        self.attempts = attempts
+        self.last = last
+        self.kind = kind
+
+
+class Uncertain(GaveUp):
+    """a non idempotent call failed in a way that leaves open whether the
+    host carried it out, it was not tried again"""
+    def __init__(self, host, attempts, last, kind):
+        Exception.__init__(self, "%s: the call may or may not have been carried out, not retried (%s): %s" % (
+            host, kind, last))
+        self.host = host
+        self.attempts = attempts
+        self.last = last
+        self.kind = kind
+
+
+def _refused(reason):
+    """the connection for the request was never made"""
+    return isinstance(reason, socket.gaierror) or (
+        isinstance(reason, socket.error) and not isinstance(reason, (socket.timeout, ssl.SSLError))
+        and reason.errno in _NOT_CONNECTED)
+
+
+def answered(kind, exc):
+    """the host itself answered with this retryable error, it is up"""
+    return kind == RATELIMIT or (kind == REFUSED and isinstance(exc, Retryable))
+
+
+def classify_status(status, body=""):
+    """the kind of an HTTP error status (and its body)"""
+    body = body or ""
+    if "<!DOCTYPE HTML>" in body or "cloudflare" in body.lower():
+        return CLOUDFLARE
+    if status == 429 or "Too many" in body:
+        return RATELIMIT
+    if status >= 500:
+        return SERVER
+    if status == 408:
+        return TIMEOUT
+    return FATAL
+
+
+def classify(exc):
+    """the kind of an exception raised by an attempt"""
+    if isinstance(exc, Retryable):
+        return exc.kind
+    if isinstance(exc, urllib2.HTTPError):
+        return classify_status(exc.code, getattr(exc, "body", ""))
+    if isinstance(exc, socket.timeout):
+        return TIMEOUT
+    if isinstance(exc, ssl.SSLError):
+        if "timed out" in str(exc):
+            return TIMEOUT
+        return NETWORK
+    if isinstance(exc, urllib2.URLError):
+        if isinstance(exc.reason, socket.timeout):
+            return TIMEOUT
+        if _refused(exc.reason):
+            return REFUSED
+        return NETWORK
+    if _refused(exc):
+        return REFUSED
+    if isinstance(exc, (socket.error, IOError)):
+        return NETWORK
+    if isinstance(exc, ValueError):
+        return BADJSON
+    return FATAL
+
+
+class Backoff(object):
+    """exponential backoff with full jitter: try n waits a random time
+    between 0 and min(cap, base * factor**n) seconds"""
+    def __init__(self, base=0.5, cap=30.0, factor=2.0):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * self.factor ** attempt))
+
+
+class CircuitBreaker(object):
+    """Usage: breaker = CircuitBreaker("btc-e.com", threshold=5, reset=30)
+        breaker.check()         #raises CircuitOpen while it is open
+        breaker.success() / breaker.failure()"""
+    def __init__(self, host, threshold=5, reset=30.0):
+        self.host = host
+        self.threshold = threshold
+        self.reset = reset
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened = None          #time it opened, None while closed
+        self.probing = False        #a half open test call is out
+
+    def state(self):
+        with self.lock:
+            if self.opened is None:
+                return "closed"
+            if time.time() - self.opened < self.reset:
+                return "open"
+            return "halfopen"
+
+    def retry_in(self):
+        with self.lock:
+            if self.opened is None:
+                return 0
+            return max(0, self.opened + self.reset - time.time())
+
+    def check(self):
+        """let a call through, or raise CircuitOpen. Once the reset time
+        is over one call at a time is let through to test the host."""
+        with self.lock:
+            if self.opened is None:
+                return
+            left = self.opened + self.reset - time.time()
+            if left <= 0 and not self.probing:
+                self.probing = True
+                return
+        raise CircuitOpen(self.host, max(left, 0))
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened = time.time()
+            self.probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker(host):
+    """the process wide CircuitBreaker of a host, made on first use"""
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+def available(host):
+    """False while calls to host would fail fast with CircuitOpen"""
+    return breaker(host).state() != "open"
+
+
+def _print(message):
+    print message
+
+
+class RetryPolicy(object):
+    """Usage: policy = RetryPolicy(attempts=6, deadline=60)
+        result = policy.call("btc-e.com", attempt)
+    attempt() is called until it returns, raises a non retryable error
+    (raised as it is), or the attempts/deadline run out (GaveUp).
+    With idempotent=False only NOT_DONE errors are retried, other retryable
+    ones raise Uncertain.
+    log(message) is told about every retry (print by default)."""
+    def __init__(self, attempts=6, deadline=60.0, backoff=None, retry=RETRYABLE, log=_print):
+        self.attempts = attempts
+        self.deadline = deadline
+        self.backoff = backoff or Backoff()
+        self.retry = retry
+        self.log = log
+
+    def call(self, host, attempt, deadline=None, idempotent=True):
+        """deadline overrides the policy's deadline (seconds) for this call.
+        idempotent=False for calls that must not be carried out twice."""
+        circuit = breaker(host)
+        if deadline is None:
+            deadline = self.deadline
+        give_up = time.time() + deadline
+        tries = 0
+        while True:
+            circuit.check()
+            tries += 1
+            try:
+                result = attempt()
+            except Exception as e:
+                kind = classify(e)
+                if kind not in self.retry:
+                    #the host answered, it is the request that is wrong
+                    circuit.success()
+                    raise
+                if not answered(kind, e):
+                    circuit.failure()
+                if not idempotent and kind not in NOT_DONE:
+                    raise Uncertain(host, tries, e, kind)
+                wait = self.backoff.delay(tries - 1)
+                if kind == RATELIMIT and getattr(e, "wait", None):
+                    wait = max(wait, e.wait)
+                if tries >= self.attempts or time.time() + wait > give_up:
+                    raise GaveUp(host, tries, e, kind)
+                if self.log:
+                    self.log("%s error (%s), retry %d in %.1f seconds..." % (kind, e, tries, wait))
+                time.sleep(wait)
+            else:
+                circuit.success()
+                return result
+
+
+#for the interactive clients: keep trying for a minute
+default = RetryPolicy()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# tickerstore.py
+# The ticker history of the clients (it used to be json lines in
+# data/mtgox_ticker.txt) as fixed-size binary records:
+#     stamp (microseconds), bid, ask, last, volume
+# all integers in the MtGox scale (price * 1E5, volume * 1E8). volume is
+# what was traded since the record before, so it can be summed up.
+#
+# Appending is one write at the end of the file. Reading goes through a
+# memory map of the file: the records are sorted by time, so the record of
+# any moment is found with a binary search, and a whole block of records is
+# unpacked with a single struct call (a column is then just a slice of the
+# result). tail() does not depend on the size of the file, range() and
+# ohlc() only on how much they return (plus log n to find it).
+#
+#   store = TickerStore(partialpath + 'mtgox_ticker.tks')
+#   recorder = TickerRecorder(store)
+#   recorder.connect(gox)            #a record on every streamed ticker
+#   store.tail(15)
+#   store.ohlc(start, end, 3600*1000000)  #hourly candles
+
+import collections
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+PRICE_SCALE = 100000
+VOLUME_SCALE = 100000000
+
+#stamp, bid, ask, last, volume
+RECORD = struct.Struct('<qqqqq')
+FIELDS = ('stamp', 'bid', 'ask', 'last', 'volume')
+_STAMP = struct.Struct('<q')
+
+Tick = collections.namedtuple('Tick', FIELDS)
+Candle = collections.namedtuple('Candle', 'stamp open high low close volume')
+
+
+def now():
+    """the current time as a record stamp"""
+    return int(time.time() * 1000000)
+
+
+class TickerStore(object):
+    """Usage: store = TickerStore("mtgox_ticker.tks")
+        store.append(now(), bid_int, ask_int, last_int, volume_int)
+        store.tail(10)                  #[Tick,...] oldest first
+        store.range(start, end)         #start <= stamp < end
+        store.column("last", start, end, every=60)
+        store.ohlc(start, end, width)   #[Candle,...]"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        self._repair()
+        self._out = open(path, 'ab')
+        self._in = open(path, 'rb')
+        self._map = None
+        self._mapped = 0                #records covered by _map
+        newest = self.last()
+        self._newest = newest.stamp if newest else None
+
+    def _repair(self):
+        """cut off half a record left by a crash in the middle of a write"""
+        size = os.path.getsize(self.path)
+        if size % RECORD.size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(size - size % RECORD.size)
+
+    def __len__(self):
+        return os.fstat(self._in.fileno()).st_size // RECORD.size
+
+    def append(self, stamp, bid, ask, last, volume=0):
+        """stamps have to come in ascending order, older ones are dropped"""
+        with self.lock:
+            if self._newest is not None and stamp < self._newest:
+                return False
+            self._newest = stamp
+            self._out.write(RECORD.pack(stamp, bid, ask, last, volume))
+            self._out.flush()
+            return True
+
+    def close(self):
+        with self.lock:
+            self._out.close()
+            if self._map is not None:
+                self._map.close()
+            self._in.close()
+
+    def _view(self):
+        """the memory map and the number of records in it, mapped again
+        when the file has grown"""
+        count = len(self)
+        if count != self._mapped:
+            with self.lock:
+                #the old map is not closed, another thread may still read it
+                view = mmap.mmap(self._in.fileno(), count * RECORD.size, access=mmap.ACCESS_READ) if count else None
+                self._map, self._mapped = view, count
+        return self._map, self._mapped
+
+    def _bisect(self, view, count, stamp):
+        """index of the first record with a stamp >= stamp"""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _STAMP.unpack_from(view, mid * RECORD.size)[0] < stamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _block(self, view, first, end):
+        """the flat tuple of all fields of records first..end-1"""
+        if end <= first:
+            return ()
+        return struct.unpack_from('<%dq' % ((end - first) * len(FIELDS)), view, first * RECORD.size)
+
+    def _slice(self, start, end):
+        view, count = self._view()
+        first = 0 if start is None else self._bisect(view, count, start)
+        last = count if end is None else self._bisect(view, count, end)
+        return view, first, last
+
+    def first(self):
+        view, count = self._view()
+        return Tick(*RECORD.unpack_from(view, 0)) if count else None
+
+    def last(self):
+        view, count = self._view()
+        return Tick(*RECORD.unpack_from(view, (count - 1) * RECORD.size)) if count else None
+
+    def tail(self, n=15):
+        view, count = self._view()
+        values = self._block(view, max(count - n, 0), count)
+        return [Tick(*values[i:i + len(FIELDS)]) for i in xrange(0, len(values), len(FIELDS))]
+
+    def range(self, start=None, end=None):
+        view, first, last = self._slice(start, end)
+        values = self._block(view, first, last)
+        return [Tick(*values[i:i + len(FIELDS)]) for i in xrange(0, len(values), len(FIELDS))]
+
+    def column(self, field, start=None, end=None, every=1):
+        """one field of every <every>th record between start and end"""
+        view, first, last = self._slice(start, end)
+        return self._block(view, first, last)[FIELDS.index(field)::len(FIELDS) * every]
+
+    def ohlc(self, start, end, width, field="last"):
+        """candles of <width> microseconds from the <field> prices (records
+        without a price, 0, are left out). Empty periods have no candle."""
+        view, count = self._view()
+        offset = FIELDS.index(field)
+        step = len(FIELDS)
+        candles = []
+        i = self._bisect(view, count, start)
+        while i < count:
+            stamp = _STAMP.unpack_from(view, i * RECORD.size)[0]
+            if stamp >= end:
+                break
+            period = start + (stamp - start) // width * width
+            j = self._bisect(view, count, min(period + width, end))
+            values = self._block(view, i, j)
+            prices = [p for p in values[offset::step] if p]
+            if prices:
+                candles.append(Candle(period, prices[0], max(prices), min(prices), prices[-1],
+                                      sum(values[4::step])))
+            i = j
+        return candles
+
+
+class TickerRecorder(object):
+    """writes a record to the store on every ticker of a
+    mtgox_prof7bitapi.Gox, with the last trade price and the volume traded
+    since the record before (keep it alive, Signals only hold weak
+    references)"""
+    def __init__(self, store):
+        self.store = store
+        self.bid = self.ask = self.last = 0
+        self.volume = 0
+
+    def connect(self, gox):
+        gox.signal_ticker.connect(self.slot_ticker)
+        gox.signal_trade.connect(self.slot_trade)
+
+    def record(self, last=None):
+        """write the current state, last (an int) overrides the last trade"""
+        if last is not None:
+            self.last = last
+        volume, self.volume = self.volume, 0
+        self.store.append(now(), self.bid, self.ask, self.last, volume)
+
+    def slot_ticker(self, dummy_sender, data):
+        """Slot for signal_ticker"""
+        (self.bid, self.ask) = data
+        self.record()
+
+    def slot_trade(self, dummy_sender, data):
+        """Slot for signal_trade"""
+        (date, price, volume, typ, own) = data
+        self.last = price
+        self.volume += volume
+
+
+def import_json_lines(store, filename):
+    """add the {"time":...,"lastprice":...} lines of the old ticker log that
+    are newer than the last record. Returns the number of records added."""
+    newest = store.last()
+    newest = newest.stamp if newest else -1
+    added = 0
+    with open(filename, 'r') as f:
+        for line in f:
+            try:
+                j = json.loads(line)
+                stamp = int(j['time'] * 1000000)
+                last = int(round(j['lastprice'] * PRICE_SCALE))
+            except (ValueError, KeyError, TypeError):
+                continue
+            if stamp > newest and store.append(stamp, 0, 0, last):
+                newest = stamp
+                added += 1
+    return added
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# tradearchive.py
+# Partitioned on-disk trade archive shared by the history/analysis tools.
+# Trades are stored per exchange per (UTC) day as fixed-size binary records:
+#     data/archive/<exchange>/<YYYYMMDD>.trd
+# next to each partition lives a sparse index (one entry every INDEX_EVERY
+# records) mapping timestamp/tid to the file offset of that record:
+#     data/archive/<exchange>/<YYYYMMDD>.idx
+# so a reader only has to seek to the right block instead of re-parsing
+# the whole monolithic json/csv dump every time.
+#
+# All prices and amounts are stored as integers in the MtGox scale
+# (price * 1E5, amount * 1E8) regardless of the exchange they came from.
+
+import os
+import struct
+import bisect
+import time
+import json
+import collections
+
+PRICE_SCALE = 100000
+AMOUNT_SCALE = 100000000
+
+SIDE_UNKNOWN = 0
+SIDE_BID = 1
+SIDE_ASK = 2
+
+#tid, stamp (microseconds), price_int, amount_int, side
+RECORD = struct.Struct('<qqqqB')
+#stamp, tid, offset of the record in the .trd file
+INDEX = struct.Struct('<qqq')
+INDEX_EVERY = 64
+READ_CHUNK = 4096      #records per read() when scanning a partition
+
+Trade = collections.namedtuple('Trade', 'tid stamp price_int amount_int side')
+
+fullpath = os.path.dirname(os.path.realpath(__file__))
+if os.name == 'nt':
+    archivepath = os.path.join(fullpath + '\\..\\data\\archive\\')
+else:
+    archivepath = os.path.join(fullpath + '/../data/archive/')
+
+
+def dayof(stamp):
+    """return the partition name (YYYYMMDD, UTC) of a microsecond timestamp"""
+    return time.strftime("%Y%m%d", time.gmtime(stamp // 1000000))
+
+def daystart(day):
+    """return the first microsecond timestamp of a partition name"""
+    import calendar
+    return calendar.timegm(time.strptime(day, "%Y%m%d")) * 1000000
+
+def price(trade):
+    return trade.price_int / 1E5
+
+def amount(trade):
+    return trade.amount_int / 1E8
+
+
+class _Partition(object):
+    """one day of trades of one exchange: the .trd data file and its sparse .idx"""
+    def __init__(self, path):
+        self.path = path
+        self.datafile = path + '.trd'
+        self.indexfile = path + '.idx'
+        self._index = None          #[(stamp,tid,offset),...] loaded lazily
+        self._last = None
+
+    def count(self):
+        try:
+            return os.path.getsize(self.datafile) // RECORD.size
+        except OSError:
+            return 0
+
+    def index(self):
+        if self._index is None:
+            self._index = []
+            try:
+                with open(self.indexfile, 'rb') as f:
+                    raw = f.read()
+            except IOError:
+                raw = ''
+            for pos in xrange(0, len(raw) - len(raw) % INDEX.size, INDEX.size):
+                self._index.append(INDEX.unpack_from(raw, pos))
+        return self._index
+
+    def last(self):
+        """return the last Trade in this partition (or None)"""
+        if self._last is None:
+            n = self.count()
+            if n:
+                with open(self.datafile, 'rb') as f:
+                    f.seek((n - 1) * RECORD.size)
+                    self._last = Trade(*RECORD.unpack(f.read(RECORD.size)))
+        return self._last
+
+    def _tail(self):
+        """how often each (stamp, price_int, amount_int, side) occurs in the
+        trailing records that have the stamp of the last one"""
+        seen = collections.Counter()
+        last = self.last()
+        if last is None:
+            return seen
+        size = RECORD.size
+        with open(self.datafile, 'rb') as f:
+            end = self.count()
+            while end > 0:
+                start = max(0, end - READ_CHUNK)
+                f.seek(start * size)
+                raw = f.read((end - start) * size)
+                for pos in xrange(len(raw) - size, -1, -size):
+                    t = Trade(*RECORD.unpack_from(raw, pos))
+                    if t.stamp != last.stamp:
+                        return seen
+                    seen[t[1:]] += 1
+                end = start
+        return seen
+
+    def append(self, trades):
+        """append already sorted trades, returns how many were written.
+        Trades already in the partition are skipped: by tid, or for trades
+        without one (tid 0) by their stamp, price, amount and side."""
+        n = self.count()
+        last = archived = self.last()
+        tail = None                 #_tail() of the archived trades, read when needed
+        data = []
+        idx = []
+        for t in trades:
+            if last is not None:
+                if t.stamp < last.stamp:
+                    continue
+                if t.stamp == last.stamp and t.tid and t.tid <= last.tid:
+                    continue
+            if not t.tid and archived is not None and t.stamp == archived.stamp:
+                if tail is None:
+                    tail = self._tail()
+                if tail[t[1:]]:
+                    tail[t[1:]] -= 1
+                    continue
+            if n % INDEX_EVERY == 0:
+                idx.append(INDEX.pack(t.stamp, t.tid, n * RECORD.size))
+            data.append(RECORD.pack(*t))
+            last = t
+            n += 1
+        if data:
+            with open(self.datafile, 'ab') as f:
+                f.write(''.join(data))
+            if idx:
+                with open(self.indexfile, 'ab') as f:
+                    f.write(''.join(idx))
+            self._index = None
+            self._last = last
+        return len(data)
+
+    def scan(self, start=None, end=None, key=1):
+        """yield every Trade with start <= field[key] <= end. key=1 is the
+        timestamp, key=0 is the tid. Seeks using the sparse index first."""
+        offset = 0
+        if start is not None:
+            index = self.index()
+            if key == 1:
+                keys = [entry[0] for entry in index]
+            else:
+                keys = [entry[1] for entry in index]
+            i = bisect.bisect_left(keys, start) - 1
+            if i >= 0:
+                offset = index[i][2]
+        unpack = RECORD.unpack_from
+        size = RECORD.size
+        try:
+            f = open(self.datafile, 'rb')
+        except IOError:
+            return
+        with f:
+            f.seek(offset)
+            while True:
+                raw = f.read(size * READ_CHUNK)
+                if not raw:
+                    return
+                for pos in xrange(0, len(raw) - len(raw) % size, size):
+                    rec = unpack(raw, pos)
+                    k = rec[key]
+                    if start is not None and k < start:
+                        continue
+                    if end is not None and k > end:
+                        return
+                    yield Trade(*rec)
+
+
+class TradeArchive(object):
+    """Usage: archive = TradeArchive("mtgox")
+        archive.append(trades)              #iterable of Trade tuples
+        for trade in archive.read(start,end):   #start/end are unix seconds
+            ..."""
+    def __init__(self, exchange, root=None):
+        self.exchange = exchange
+        self.root = os.path.join(root or archivepath, exchange)
+        self._partitions = {}
+
+    def _partition(self, day):
+        p = self._partitions.get(day)
+        if p is None:
+            p = _Partition(os.path.join(self.root, day))
+            self._partitions[day] = p
+        return p
+
+    def days(self):
+        """sorted list of all partition names available on disk"""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return sorted(set(n[:-4] for n in names if n.endswith('.trd')))
+
+    def append(self, trades):
+        """append trades to their day partitions. Trades older than what is
+        already stored for that day are skipped, so re-importing an
+        overlapping dump is harmless. Returns the number of new trades."""
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        written = 0
+        batch = []
+        day = None
+        for t in sorted(trades, key=lambda t: (t.stamp, t.tid)):
+            d = dayof(t.stamp)
+            if d != day and batch:
+                written += self._partition(day).append(batch)
+                batch = []
+            day = d
+            batch.append(t)
+        if batch:
+            written += self._partition(day).append(batch)
+        return written
+
+    def last(self):
+        """the most recent trade in the archive, or None if it is empty"""
+        days = self.days()
+        if days:
+            return self._partition(days[-1]).last()
+        return None
+
+    def first(self):
+        """the oldest trade in the archive, or None if it is empty"""
+        for day in self.days():
+            for t in self._partition(day).scan():
+                return t
+        return None
+
+    def read(self, start=None, end=None):
+        """yield trades with start <= date <= end (unix seconds, either may
+        be None for an open range). Only the partitions and blocks that
+        overlap the range are read from disk."""
+        lo = int(start * 1E6) if start is not None else None
+        hi = int(end * 1E6) if end is not None else None
+        firstday = dayof(lo) if lo is not None else None
+        lastday = dayof(hi) if hi is not None else None
+        for day in self.days():
+            if firstday and day < firstday:
+                continue
+            if lastday and day > lastday:
+                break
+            for t in self._partition(day).scan(lo, hi):
+                yield t
+
+    def read_tids(self, first_tid, last_tid=None):
+        """yield trades with first_tid <= tid <= last_tid. MtGox tids are
+        microsecond timestamps, so the day partitions are searched directly"""
+        firstday = dayof(first_tid)
+        for day in self.days():
+            if day < firstday:
+                continue
+            if last_tid is not None and day > dayof(last_tid):
+                break
+            for t in self._partition(day).scan(first_tid, last_tid, key=0):
+                yield t
+
+
+#### importers for the existing dump formats
+
+def from_mtgox(trades):
+    """convert the "data" list of an API 2 money/trades/fetch download
+    (mtgox_entiretrades*.txt) into Trade tuples"""
+    sides = {"bid": SIDE_BID, "ask": SIDE_ASK}
+    for t in trades:
+        tid = int(t["tid"])
+        yield Trade(tid, tid if tid > 1E15 else int(t["date"]) * 1000000,
+                    int(t["price_int"]), int(t["amount_int"]),
+                    sides.get(t.get("trade_type"), SIDE_UNKNOWN))
+
+def from_csv(lines, tid=False):
+    """convert bitcoincharts style csv lines (unixtime,price,amount[,tid])
+    into Trade tuples"""
+    for line in lines:
+        row = line.strip().split(',')
+        if len(row) < 3 or not row[0][:1].isdigit():
+            continue
+        stamp = int(float(row[0]) * 1000000)
+        yield Trade(int(row[3]) if tid and len(row) > 3 else 0, stamp,
+                    int(round(float(row[1]) * PRICE_SCALE)),
+                    int(round(float(row[2]) * AMOUNT_SCALE)), SIDE_UNKNOWN)
+
+def import_mtgox_file(archive, filename):
+    """archive a file written by do_tradehist24h (vintage line + json)"""
+    with open(filename, 'r') as f:
+        everything = f.readlines()
+    data = json.loads(everything[1] if len(everything) > 1 else everything[0])
+    return archive.append(from_mtgox(data["data"]))
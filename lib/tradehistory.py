@@ -6,6 +6,7 @@ import sys
 import os
 import json
 import common 
+import tradearchive
 import pyreadline
 import time
 import datetime
@@ -34,27 +35,22 @@ def mean(l):
         raise TypeError()
 
 def readhist24():
-    print "Enter the filename in the data/ directory to open: "
-    filetoopen = raw_input("Leave blank for default: ")
-    if not(filetoopen):
+    archive = tradearchive.TradeArchive("mtgox")
+    print "Enter the filename in the data/ directory to add to the trade archive: "
+    filetoopen = raw_input("Leave blank to only read the archive: ")
+    if not(filetoopen) and archive.last() is None:
         filetoopen = "mtgox_entiretrades.txt"
-    with open(os.path.join(partialpath + filetoopen),'r') as f:
-        everything = f.readlines()
+    if filetoopen:
+        added = tradearchive.import_mtgox_file(archive,os.path.join(partialpath + filetoopen))
+        print "%s new trades were added to the archive." % added
 
-
-    everything[0],everything[1] = everything[1],everything[0]       #then by default its a history file
-
-    new = json.loads(everything[0])
-    newnew = common.floatify(new["data"])
     print "Do you want to enter a timeframe?(in secs): "
     timeframe = raw_input("Leave blank for default: ")
+    starttime = None
     if timeframe:
-        starttime = (newnew[-1]['tid']/1E6) - float(timeframe)
-        templist = []
-        for a in newnew:
-            if (a['tid']/1E6) > starttime:
-                templist.append(a)
-        newnew = templist
+        starttime = (archive.last().stamp/1E6) - float(timeframe)
+    #only the partitions/blocks inside the timeframe are read from disk
+    newnew = [{'tid':t.tid,'price':tradearchive.price(t),'amount':tradearchive.amount(t)} for t in archive.read(starttime)]
     [earliesttime],[latesttime] = [[func(x[thing] for x in newnew) for thing in ['tid']] for func in [min,max]]
 
     #rewritten with list comprehension somehow (see below)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# triggers.py
+# One engine for all the "do something when..." commands of the clients
+# (when, stoploss, updown, balancenotifier). Instead of a thread per command
+# polling the REST ticker, every condition is kept by the engine and checked
+# when the streaming API sends something:
+#     ticker (bid, ask)       the bid/ask thresholds
+#     trade (price)           the last thresholds
+#     user_order removed      the fulfil triggers of that oid
+#     wallet                  the wallet watchers
+#
+# The price thresholds of every field (bid, ask, last) are kept in two lists
+# sorted by price, one for ">" and one for "<". A new price only looks at
+# the entries it crossed: bisect finds the boundary and everything on one
+# side of it fires, so a tick costs O(log n + k) for k fired triggers no
+# matter how many are waiting. Prices are integers in the scale of the
+# stream (USD * 1E5).
+#
+# Triggers fire once and are then removed (an action can add a new one).
+# The actions run one after the other on the engine's own thread, never on
+# the socket thread.
+
+import bisect
+import itertools
+import Queue
+import sys
+import threading
+import traceback
+
+FIELDS = ("bid", "ask", "last")
+
+
+class Trigger(object):
+    """what add_price/add_fulfil/add_wallet return, .tid identifies it"""
+    def __init__(self, tid, kind, description, action):
+        self.tid = tid
+        self.kind = kind                #"price", "fulfil" or "wallet"
+        self.description = description
+        self.action = action
+        self.key = None                 #where it is kept, to remove it again
+
+
+class _Thresholds(object):
+    """the triggers of one field and direction, sorted by (price, tid)"""
+    def __init__(self, above):
+        self.above = above              #fire when the value goes above the price
+        self.keys = []
+        self.triggers = []
+
+    def add(self, price, trigger):
+        key = (price, trigger.tid)
+        i = bisect.bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.triggers.insert(i, trigger)
+        return key
+
+    def remove(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+            del self.triggers[i]
+
+    def crossed(self, value):
+        """take out and return the triggers value has crossed"""
+        if self.above:
+            i = bisect.bisect_left(self.keys, (value,))          #price < value
+            fired = self.triggers[:i]
+            del self.keys[:i]
+            del self.triggers[:i]
+        else:
+            i = bisect.bisect_right(self.keys, (value, sys.maxint))    #price > value
+            fired = self.triggers[i:]
+            del self.keys[i:]
+            del self.triggers[i:]
+        return fired
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class TriggerEngine(object):
+    """Usage: engine = TriggerEngine()
+        engine.connect(gox)
+        engine.add_price("ask", "<", 12000000, func, "ask < 120")   #func(value)
+        engine.add_fulfil(oid, func, "order filled")                #func(oid)
+        engine.add_wallet(func, "balance watch")                    #func(wallet), every time
+        engine.cancel(tid)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thresholds = {}
+        for field in FIELDS:
+            self.thresholds[(field, ">")] = _Thresholds(above=True)
+            self.thresholds[(field, "<")] = _Thresholds(above=False)
+        self.last = dict.fromkeys(FIELDS)   #latest value of every field
+        self.fulfil = {}                    #oid -> [Trigger]
+        self.wallet = {}                    #tid -> Trigger
+        self.active = {}                    #tid -> Trigger
+        self._ids = itertools.count(1)
+        self._actions = Queue.Queue()
+        self._thread = None
+        self.gox = None
+
+    def connect(self, gox):
+        """follow the streams of a mtgox_prof7bitapi.Gox (the engine has to
+        be kept alive by the caller, Signals only hold weak references)"""
+        self.gox = gox
+        gox.signal_ticker.connect(self.slot_ticker)
+        gox.signal_trade.connect(self.slot_trade)
+        gox.signal_userorder.connect(self.slot_user_order)
+        gox.signal_wallet.connect(self.slot_wallet)
+
+    def _new(self, kind, description, action):
+        trigger = Trigger(self._ids.next(), kind, description, action)
+        self.active[trigger.tid] = trigger
+        return trigger
+
+    def add_price(self, field, oper, price, action, description=""):
+        """action(value) once <field> goes <oper> ("<" or ">") price"""
+        if field not in FIELDS or oper not in ("<", ">"):
+            raise ValueError("field must be one of %s and oper < or >" % (FIELDS,))
+        with self.lock:
+            trigger = self._new("price", description, action)
+            trigger.key = (field, oper, self.thresholds[(field, oper)].add(price, trigger))
+        return trigger
+
+    def add_fulfil(self, oid, action, description=""):
+        """action(oid) once the order oid is gone from the book"""
+        with self.lock:
+            trigger = self._new("fulfil", description, action)
+            trigger.key = oid
+            self.fulfil.setdefault(oid, []).append(trigger)
+        return trigger
+
+    def add_wallet(self, action, description=""):
+        """action(wallet) on every wallet update, until it is cancelled"""
+        with self.lock:
+            trigger = self._new("wallet", description, action)
+            self.wallet[trigger.tid] = trigger
+        return trigger
+
+    def cancel(self, tid):
+        """remove a waiting trigger, False if there was none with that id"""
+        with self.lock:
+            trigger = self.active.pop(tid, None)
+            if trigger is None:
+                return False
+            if trigger.kind == "price":
+                field, oper, key = trigger.key
+                self.thresholds[(field, oper)].remove(key)
+            elif trigger.kind == "fulfil":
+                waiting = self.fulfil.get(trigger.key, [])
+                if trigger in waiting:
+                    waiting.remove(trigger)
+                if not waiting:
+                    self.fulfil.pop(trigger.key, None)
+            else:
+                del self.wallet[tid]
+            return True
+
+    def cancel_all(self):
+        for tid in self.active.keys():
+            self.cancel(tid)
+
+    def triggers(self):
+        """the waiting triggers, oldest first"""
+        with self.lock:
+            return sorted(self.active.values(), key=lambda t: t.tid)
+
+    def update(self, field, value):
+        """a new value of field, fires what it crossed"""
+        with self.lock:
+            self.last[field] = value
+            fired = self.thresholds[(field, ">")].crossed(value)
+            fired += self.thresholds[(field, "<")].crossed(value)
+            for trigger in fired:
+                del self.active[trigger.tid]
+        for trigger in fired:
+            self._run(trigger, value)
+
+    def removed(self, oid):
+        with self.lock:
+            fired = self.fulfil.pop(oid, [])
+            for trigger in fired:
+                del self.active[trigger.tid]
+        for trigger in fired:
+            self._run(trigger, oid)
+
+    def _run(self, trigger, arg):
+        if self._thread is None:
+            with self.lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker)
+                    self._thread.daemon = True
+                    self._thread.start()
+        self._actions.put((trigger, arg))
+
+    def _worker(self):
+        while True:
+            trigger, arg = self._actions.get()
+            try:
+                trigger.action(arg)
+            except Exception:
+                print "Trigger %d (%s) failed:" % (trigger.tid, trigger.description)
+                traceback.print_exc()
+
+    def slot_ticker(self, dummy_sender, data):
+        """Slot for signal_ticker"""
+        (bid, ask) = data
+        self.update("bid", bid)
+        self.update("ask", ask)
+
+    def slot_trade(self, dummy_sender, data):
+        """Slot for signal_trade"""
+        (date, price, volume, typ, own) = data
+        self.update("last", price)
+
+    def slot_user_order(self, dummy_sender, data):
+        """Slot for signal_userorder"""
+        (price, volume, typ, oid, status) = data
+        if status == "removed":
+            self.removed(oid)
+
+    def slot_wallet(self, dummy_sender, data):
+        """Slot for signal_wallet"""
+        with self.lock:
+            watchers = self.wallet.values()
+        for trigger in watchers:
+            self._run(trigger, dict(self.gox.wallet))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# ttlcache.py
+# In-process cache for the public market data calls (ticker, depth,
+# fulldepth, trades). Every shell command and background thread asking for
+# the same endpoint within its TTL gets the value that was already fetched
+# and parsed. When several threads ask at once while it is being fetched,
+# only one request goes out and the others wait for its result
+# (single-flight).
+#
+#   cache = TTLCache({"ticker": 5, "fulldepth": 120})
+#   ticker = cache.get("ticker", mtgox.get_ticker)
+#
+# An entry can also have a DiskTier: a file starting with a one line
+# header holding its vintage (unix time) followed by the payload. Only the
+# header is read to decide whether the file is fresh enough, the payload is
+# parsed just once when the memory tier does not have it yet.
+
+import json
+import json_ascii
+import threading
+import time
+
+
+class DiskTier(object):
+    """vintage line + json payload, the format of data/mtgox_fulldepth.txt"""
+    def __init__(self, path):
+        self.path = path
+
+    def vintage(self):
+        """the time the file was written, without reading the payload"""
+        try:
+            with open(self.path, 'r') as f:
+                return float(f.readline())
+        except (IOError, ValueError):
+            return None
+
+    def read(self):
+        with open(self.path, 'r') as f:
+            vintage = float(f.readline())
+            return vintage, json.load(f, object_hook=json_ascii.decode_dict)
+
+    def write(self, vintage, value):
+        with open(self.path, 'w') as f:
+            f.write(str(vintage))
+            f.write('\n')
+            json.dump(value, f)
+
+
+class _Flight(object):
+    """a fetch in progress that other threads can wait for"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache(object):
+    """Usage: cache = TTLCache({"ticker": 5}, default=10)
+        value = cache.get("ticker", fetch)          #fetch() is only called when needed
+        vintage, value = cache.get_vintage("ticker", fetch)"""
+    def __init__(self, ttls=None, default=10):
+        self.ttls = dict(ttls or {})
+        self.default = default
+        self.lock = threading.Lock()
+        self._values = {}               #key -> (vintage, value)
+        self._flights = {}              #key -> _Flight
+        self._disk = {}                 #name -> DiskTier
+        self.hits = 0
+        self.misses = 0
+
+    def ttl(self, key):
+        name = key[0] if isinstance(key, tuple) else key
+        return self.ttls.get(name, self.default)
+
+    def add_disk(self, key, path):
+        """keep key on disk too (see DiskTier)"""
+        self._disk[key] = DiskTier(path)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def age(self, key):
+        """seconds since key was fetched, None if it is not cached"""
+        entry = self._values.get(key)
+        return time.time() - entry[0] if entry else None
+
+    def get(self, key, fetch, maxage=None):
+        return self.get_vintage(key, fetch, maxage)[1]
+
+    def get_vintage(self, key, fetch, maxage=None):
+        """(vintage, value) of key, fetched again when older than maxage
+        (or the key's TTL). Exceptions of fetch() reach every waiter."""
+        if maxage is None:
+            maxage = self.ttl(key)
+        with self.lock:
+            entry = self._values.get(key)
+            if entry and time.time() - entry[0] <= maxage:
+                self.hits += 1
+                return entry
+            flight = self._flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[key] = _Flight()
+        if not owner:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = self._load(key, fetch, maxage)
+            with self.lock:
+                self._values[key] = flight.value
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _load(self, key, fetch, maxage):
+        disk = self._disk.get(key)
+        if disk is not None:
+            vintage = disk.vintage()
+            if vintage is not None and time.time() - vintage <= maxage:
+                try:
+                    entry = disk.read()
+                    self.hits += 1
+                    return entry
+                except (IOError, ValueError):
+                    pass
+        self.misses += 1
+        value = fetch()
+        vintage = time.time()
+        if disk is not None:
+            disk.write(vintage, value)
+        return vintage, value
+
+
+#public market data of the mtgox clients, shared by every thread
+public = TTLCache({"ticker": 5, "ticker2": 5, "tickerfast": 2, "depth": 10,
+                   "fetchdepth": 10, "fulldepth": 120, "trades": 30})